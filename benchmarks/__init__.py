@@ -0,0 +1,6 @@
+"""End-to-end request benchmarks for RESTAlchemy.
+
+Builds a Pyramid app with `config.include("restalchemy")` over SQLite
+(in memory and file based) with synthetic models and drives it with WebTest.
+Run with `python -m benchmarks --help`.
+"""
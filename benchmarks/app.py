@@ -0,0 +1,9 @@
+"""Benchmark app.
+
+It uses the synthetic models of the tests (see :mod:`tests.models`),
+so the benchmarks measure the same app the tests check.
+"""
+
+from tests.models import Post, Status, Tag, User, WideRow, make_config, populate
+
+__all__ = ["Post", "Status", "Tag", "User", "WideRow", "make_config", "populate"]
@@ -0,0 +1,280 @@
+"""Micro benchmarks of single hot paths.
+
+E.g.::
+
+    $ python -m benchmarks.micro
+    $ python -m benchmarks.micro --benchmark serialize
+"""
+
+import argparse
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List
+
+from pyramid.testing import DummyRequest
+from sqlalchemy import create_engine, event, inspect as sqlalchemy_inspect
+from sqlalchemy.orm import Session
+from webtest import TestApp
+
+from restalchemy.exceptions import AttributeWrong
+from restalchemy.filters import FilterNode, compile_filters
+from restalchemy.model import clear_attributes_cache
+from restalchemy.renderer import get_serialization_plan, serialize_model
+from restalchemy.validators import configure_validators, validate, validate_datetime
+
+from .app import Post, User, make_config, populate
+
+# Name and function of all micro benchmarks, each returns its metrics
+BENCHMARKS: Dict[str, Callable[[argparse.Namespace], Dict[str, float]]] = {}
+
+
+def benchmark(fn):
+    BENCHMARKS[fn.__name__.replace("bench_", "")] = fn
+    return fn
+
+
+def measure(fn: Callable, number: int) -> float:
+    """Return the seconds per call of :param:`fn` (best of 3 runs)."""
+    best = float("inf")
+    for _ in range(3):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+
+def populated_session(users: int = 100, posts_per_user: int = 10) -> Session:
+    session = Session(bind=create_engine("sqlite://"))
+    populate(session, users, posts_per_user)
+    return session
+
+
+@benchmark
+def bench_serialize(args: argparse.Namespace) -> Dict[str, float]:
+    """Rows per second :func:`restalchemy.renderer.serialize_model` serializes
+    with the cached serialization plans and when building the plan for every row.
+    """
+    posts = populated_session().query(Post).all()
+    request = DummyRequest(matchdict={"Model": Post})
+
+    def uncached():
+        for post in posts:
+            request.__dict__.pop("restalchemy_serialization_plans", None)
+            get_serialization_plan.cache_clear()
+            serialize_model(request, post)
+
+    cached = measure(lambda: [serialize_model(request, post) for post in posts], args.number)
+    return {
+        "cached_rows_per_s": round(len(posts) / cached),
+        "uncached_rows_per_s": round(len(posts) / measure(uncached, args.number)),
+    }
+
+
+@benchmark
+def bench_attributes(args: argparse.Namespace) -> Dict[str, float]:
+    """Microseconds to get the writable attributes of a model with and without the cache."""
+
+    def uncached():
+        clear_attributes_cache()
+        Post._get_writable_attributes(is_update=True)
+
+    cached = measure(lambda: Post._get_writable_attributes(is_update=True), args.number * 100)
+    return {
+        "cached_us": round(cached * 1e6, 2),
+        "uncached_us": round(measure(uncached, args.number * 10) * 1e6, 2),
+    }
+
+
+@benchmark
+def bench_validators(args: argparse.Namespace) -> Dict[str, float]:
+    """Microseconds to validate a value and to set a validated attribute."""
+    configure_validators(sqlalchemy_inspect(Post), Post)
+    post = Post()
+    column = Post.__table__.c.title
+
+    def set_title():
+        post.title = "title"
+
+    return {
+        "validate_us": round(
+            measure(lambda: validate("title", column), args.number * 100) * 1e6, 3
+        ),
+        "set_us": round(measure(set_title, args.number * 100) * 1e6, 3),
+    }
+
+
+def previous_validate_datetime(column, value):
+    """The datetime validator before it parsed with a regex (tries up to 3 formats)."""
+    if isinstance(value, datetime):
+        return value
+
+    if not isinstance(value, str):
+        raise AttributeWrong(column.key, "Datetime must be a string")
+
+    if value == "0000-00-00T00:00:00":  # mysql allows 0000-00-00 dates for invalid dates
+        return value
+
+    orig_value = value
+    # Allow ' ' or 'T' as date-time separator and only allow UTC timezone ('Z' or '+0000')
+    value = value.replace("T", " ").replace("Z", "+")
+    value, _, tz = value.partition("+")
+    if tz.strip("0:") != "":
+        raise AttributeWrong(column.key, "Only UTC (+0000) datetimes supported")
+
+    _, _, microseconds = value.partition(".")
+    # We (or better, Python) only supports microseconds (6 digits)
+    if len(microseconds) > 6:
+        value = value[: -(len(microseconds) - 6)]
+    try:
+        return datetime.strptime(value, "%Y-%m-%d %H:%M:%S.%f")
+    except ValueError:
+        pass
+
+    try:
+        return datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        pass
+
+    try:
+        return datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        raise AttributeWrong(column.key, f'"{orig_value}" is not a valid datetime')
+
+
+@benchmark
+def bench_datetime(args: argparse.Namespace) -> Dict[str, float]:
+    """Microseconds to parse a datetime with the validator and with the previous validator.
+
+    The datetimes have microseconds, seconds and only a date, so the previous validator
+    needs one, two and three `strptime` calls.
+    """
+    column = Post.__table__.c.published_at
+    values = ("2020-01-02T03:04:05.123456Z", "2020-01-02 03:04:05", "2020-01-02")
+    number = args.number * 100
+    results = {}
+    for name, validate_fn in (
+        ("validate", validate_datetime),
+        ("previous", previous_validate_datetime),
+    ):
+        for value in values:
+            assert validate_fn(column, value) == validate_datetime(column, value)
+        seconds = measure(lambda: [validate_fn(column, value) for value in values], number)
+        results[name + "_us"] = round(seconds / len(values) * 1e6, 3)
+    return results
+
+
+@benchmark
+def bench_filters(args: argparse.Namespace) -> Dict[str, float]:
+    """Microseconds to compile the filters `?status=…&user.name=…` with and without the cache."""
+    nodes = (
+        FilterNode((), None, "status", "==", "value"),
+        FilterNode((User,), "user", "name", "==", "value"),
+    )
+    number = args.number * 100
+    compile_filters(Post, nodes)
+    return {
+        "cached_us": round(measure(lambda: compile_filters(Post, nodes), number) * 1e6, 3),
+        "uncached_us": round(
+            measure(lambda: compile_filters.__wrapped__(Post, nodes), args.number) * 1e6, 3
+        ),
+    }
+
+
+@contextmanager
+def shared_memory_app() -> Iterator[TestApp]:
+    """Yield the populated benchmark app using an in memory database."""
+    config = make_config("sqlite:///file:restalchemy_micro?mode=memory&cache=shared&uri=true")
+    engine = config.registry.restalchemy_engine
+    # Keep a connection open so the in memory database is not dropped
+    keep_alive = engine.connect()
+    try:
+        session = Session(bind=engine)
+        populate(session)
+        session.close()
+        yield TestApp(config.make_wsgi_app())
+    finally:
+        keep_alive.close()
+        engine.dispose()
+
+
+@benchmark
+def bench_fields(args: argparse.Namespace) -> Dict[str, float]:
+    """Response bytes and milliseconds of a list of 100 posts with all columns and `fields`."""
+    with shared_memory_app() as app:
+        results = {}
+        for name, url in (
+            ("all", "/v1/posts?limit=100&count=false"),
+            ("fields", "/v1/posts?limit=100&count=false&fields=id,title,status"),
+        ):
+            results[name + "_bytes"] = len(app.get(url).body)
+            results[name + "_ms"] = round(measure(lambda: app.get(url), args.number) * 1e3, 3)
+        return results
+
+
+@benchmark
+def bench_list_exclude(args: argparse.Namespace) -> Dict[str, float]:
+    """Bytes per row fetched from the database and rendered for a list of 100 wide rows
+    (without their `__json_list_exclude__` notes) and for a single wide row.
+
+    The fetched bytes are the size of all values of the executed queries as text.
+    """
+    with shared_memory_app() as app:
+        engine = app.app.registry.restalchemy_engine
+        executed = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, *args):
+            executed.append((statement, parameters))
+
+        def db_bytes() -> int:
+            connection = engine.raw_connection()
+            try:
+                cursor = connection.cursor()
+                size = 0
+                for statement, parameters in executed:
+                    cursor.execute(statement, parameters)
+                    size += sum(
+                        len(str(value).encode())
+                        for row in cursor.fetchall()
+                        for value in row
+                        if value is not None
+                    )
+                return size
+            finally:
+                connection.close()
+
+        event.listen(engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            results = {}
+            for name, url, rows in (
+                ("list", "/v1/wide_rows?limit=100&count=false", 100),
+                ("detail", "/v1/wide_rows/1", 1),
+            ):
+                executed.clear()
+                body = app.get(url).body
+                results[name + "_db_bytes"] = round(db_bytes() / rows)
+                results[name + "_bytes"] = round(len(body) / rows)
+            return results
+        finally:
+            event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="RESTAlchemy micro benchmarks")
+    parser.add_argument("--benchmark", action="append", choices=list(BENCHMARKS))
+    parser.add_argument("--number", type=int, default=20, help="Calls per run")
+    args = parser.parse_args(argv)
+
+    for name in args.benchmark or list(BENCHMARKS):
+        results = BENCHMARKS[name](args)
+        print(
+            "{:<20}".format(name)
+            + "".join(" {:>24}".format("{}={}".format(k, v)) for k, v in results.items())
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,292 @@
+"""Run the benchmarks and compare them with a saved baseline.
+
+E.g.::
+
+    $ python -m benchmarks --save baseline.json
+    $ # upgrade or change something
+    $ python -m benchmarks --compare baseline.json
+
+Single hot paths (serialization, validators, filter compilation, ...) are
+measured by the micro benchmarks in :mod:`benchmarks.micro`.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from webtest import TestApp, TestResponse
+
+from restalchemy.profiling import percentile
+
+from .app import make_config, populate
+
+# Databases that are benchmarked, the file database is created in a temporary directory
+DATABASES = {
+    "memory": "sqlite:///file:restalchemy_benchmark?mode=memory&cache=shared&uri=true",
+    "file": "sqlite:///{tmpdir}/restalchemy_benchmark.sqlite",
+}
+
+
+class Scenario(NamedTuple):
+    name: str
+    # Calls the endpoint with the app, the number of the request and the arguments
+    # (`users` and `posts_per_user` are the populated rows)
+    call: Callable[[TestApp, int, argparse.Namespace], TestResponse]
+
+
+def _post_id(args: argparse.Namespace, i: int) -> int:
+    return i % (args.users * args.posts_per_user) + 1
+
+
+def _update_post(app: TestApp, i: int, args: argparse.Namespace) -> TestResponse:
+    return app.put_json(
+        "/v1/posts/{}".format(_post_id(args, i)), {"title": "Updated {}".format(i)}
+    )
+
+
+def _create_post(app: TestApp, i: int, args: argparse.Namespace) -> TestResponse:
+    return app.post_json(
+        "/v1/posts",
+        {
+            "user_id": i % args.users + 1,
+            "title": "New {}".format(i),
+            "body": "New post",
+            "status": "draft",
+        },
+    )
+
+
+SCENARIOS = [
+    Scenario("list", lambda app, i, args: app.get("/v1/posts")),
+    Scenario("list_wide", lambda app, i, args: app.get("/v1/wide_rows")),
+    Scenario("detail", lambda app, i, args: app.get("/v1/posts/{}".format(_post_id(args, i)))),
+    Scenario(
+        "filtered",
+        lambda app, i, args: app.get(
+            "/v1/posts?status=published&user.name=user_{}".format(i % args.users)
+        ),
+    ),
+    Scenario("expanded", lambda app, i, args: app.get("/v1/posts?include=user,tags")),
+    Scenario(
+        "attribute",
+        lambda app, i, args: app.get("/v1/users/{}/name".format(i % args.users + 1)),
+    ),
+    Scenario("create", _create_post),
+    Scenario("update", _update_post),
+]
+
+
+class SQLCounters:
+    """Counts the SQL statements of an engine and the time spent compiling them."""
+
+    def __init__(self, engine: Engine) -> None:
+        self.statements = 0
+        self.compile_seconds = 0.0
+        self._start: List[float] = []
+        event.listen(engine, "before_execute", self._before_execute)
+        event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+
+    def _before_execute(self, *args) -> None:
+        self._start.append(time.perf_counter())
+
+    def _before_cursor_execute(self, *args) -> None:
+        self.statements += 1
+        # Statements can also be executed without `before_execute` (e.g. by the pool)
+        if self._start:
+            self.compile_seconds += time.perf_counter() - self._start.pop()
+
+    def reset(self) -> None:
+        self.statements = 0
+        self.compile_seconds = 0.0
+
+
+def _rows(response: TestResponse) -> int:
+    """Return the number of models in a list response (1 for other responses)."""
+    try:
+        data = response.json
+    except ValueError:  # e.g. an attribute that's returned as is
+        return 1
+    resource = data.get(data.get("resource")) if isinstance(data, dict) else None
+    return len(resource) if isinstance(resource, list) else 1
+
+
+def run_scenario(
+    app: TestApp,
+    counters: SQLCounters,
+    scenario: Scenario,
+    args: argparse.Namespace,
+) -> Dict[str, float]:
+    """Return req/s, rows/s, latency percentiles (ms), response bytes,
+    peak allocations (KiB), SQL statements and their compile time (ms) per request.
+    """
+    for i in range(args.warmup):
+        scenario.call(app, i, args)
+
+    requests = args.requests
+    latencies = []
+    sizes = []
+    counters.reset()
+    start = time.perf_counter()
+    for i in range(requests):
+        request_start = time.perf_counter()
+        response = scenario.call(app, i, args)
+        latencies.append(time.perf_counter() - request_start)
+        sizes.append(len(response.body))
+    duration = time.perf_counter() - start
+    sql_statements = counters.statements / requests
+    compile_seconds = counters.compile_seconds / requests
+
+    # Allocations are traced in a separate run since tracing slows down the requests
+    peaks = []
+    for i in range(max(1, requests // 10)):
+        tracemalloc.start()
+        scenario.call(app, i, args)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    latencies.sort()
+    sizes.sort()
+    peaks.sort()
+    return {
+        "req_per_s": round(requests / duration, 1),
+        "rows_per_s": round(requests * _rows(response) / duration, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "bytes": percentile(sizes, 50),
+        "peak_kib": round(percentile(peaks, 50) / 1024, 1),
+        "sql_statements": round(sql_statements, 2),
+        "compile_ms": round(compile_seconds * 1000, 3),
+    }
+
+
+def run_database(db_url: str, args: argparse.Namespace) -> Dict[str, Dict[str, float]]:
+    """Return the results of all scenarios for the database :param:`db_url`."""
+    config = make_config(db_url)
+    app = TestApp(config.make_wsgi_app())
+    engine = config.registry.restalchemy_engine
+
+    # Keep a connection open so the in memory database is not dropped
+    keep_alive = engine.connect()
+    try:
+        session = Session(bind=engine)
+        populate(session, args.users, args.posts_per_user)
+        session.close()
+
+        counters = SQLCounters(engine)
+        return {
+            scenario.name: run_scenario(app, counters, scenario, args)
+            for scenario in SCENARIOS
+            if not args.scenario or scenario.name in args.scenario
+        }
+    finally:
+        keep_alive.close()
+        engine.dispose()
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    """Return the regressions of :param:`results` compared to the :param:`baseline`.
+
+    Latencies, compile times, response sizes and allocations regress if they're more
+    than :param:`tolerance` (a fraction) higher, rows per second if they're more than
+    :param:`tolerance` lower and SQL statements regress if there are more of them.
+    Metrics that are not in the baseline (e.g. from an older version) are skipped.
+    """
+    regressions = []
+    for database, scenarios in results.items():
+        for name, result in scenarios.items():
+            base: Optional[dict] = baseline.get(database, {}).get(name)
+            if base is None:
+                continue
+            for metric in ("p50_ms", "p95_ms", "compile_ms", "bytes", "peak_kib"):
+                if metric in base and result[metric] > base[metric] * (1 + tolerance):
+                    regressions.append(
+                        "{} {}: {} {} > {}".format(
+                            database, name, metric, result[metric], base[metric]
+                        )
+                    )
+            if "rows_per_s" in base and result["rows_per_s"] < base["rows_per_s"] * (
+                1 - tolerance
+            ):
+                regressions.append(
+                    "{} {}: rows_per_s {} < {}".format(
+                        database, name, result["rows_per_s"], base["rows_per_s"]
+                    )
+                )
+            if result["sql_statements"] > base["sql_statements"]:
+                regressions.append(
+                    "{} {}: sql_statements {} > {}".format(
+                        database, name, result["sql_statements"], base["sql_statements"]
+                    )
+                )
+    return regressions
+
+
+def print_results(results: dict) -> None:
+    columns = (
+        "req_per_s",
+        "rows_per_s",
+        "p50_ms",
+        "p95_ms",
+        "p99_ms",
+        "bytes",
+        "peak_kib",
+        "sql_statements",
+        "compile_ms",
+    )
+    print("{:<8} {:<10}".format("db", "scenario") + "".join("{:>15}".format(c) for c in columns))
+    for database, scenarios in results.items():
+        for name, result in scenarios.items():
+            print(
+                "{:<8} {:<10}".format(database, name)
+                + "".join("{:>15}".format(result[c]) for c in columns)
+            )
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="RESTAlchemy request benchmarks")
+    parser.add_argument("--db", choices=list(DATABASES), action="append", help="Default: all")
+    parser.add_argument("--scenario", action="append", choices=[s.name for s in SCENARIOS])
+    parser.add_argument("--requests", type=int, default=500, help="Requests per scenario")
+    parser.add_argument("--warmup", type=int, default=50, help="Requests before measuring")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--posts-per-user", type=int, default=10)
+    parser.add_argument("--save", metavar="FILE", help="Save the results as baseline")
+    parser.add_argument("--compare", metavar="FILE", help="Compare the results with a baseline")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.1, help="Allowed slowdown (default: 0.1 = 10%%)"
+    )
+    args = parser.parse_args(argv)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for database in args.db or list(DATABASES):
+            db_url = DATABASES[database].format(tmpdir=tmpdir)
+            results[database] = run_database(db_url, args)
+    print_results(results)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write(os.linesep)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print("REGRESSION " + regression)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
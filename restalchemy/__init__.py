@@ -11,6 +11,31 @@ class RestalchemyConfig:
     self.api_name      = api_name
     self.default_limit = int(default_limit)
     self.max_limit     = int(max_limit)
+    self.pagination    = pagination  # "offset" or "cursor"
+    self.count         = count  # "exact", "distinct_id", "estimate" or "none"
+    self.streaming     = asbool(streaming)
+    self.stream_chunk_size = int(stream_chunk_size)
+    self.bulk_batch_size = int(bulk_batch_size)
+    self.bulk_partial  = asbool(bulk_partial)
+    self.version_cache = asbool(version_cache)
+    self.version_cache_size = int(version_cache_size)
+    self.response_cache = asbool(response_cache)
+    self.response_cache_size = int(response_cache_size)
+    self.response_cache_ttl = int(response_cache_ttl)
+    self.db_url        = db_url
+    self.db_pool_size  = int(db_pool_size)
+    self.db_max_overflow = int(db_max_overflow)
+    self.db_pool_timeout = int(db_pool_timeout)
+    self.db_pool_recycle = int(db_pool_recycle)
+    self.db_echo       = asbool(db_echo)
+    self.db_replica_urls = aslist(db_replica_urls)
+    self.db_replica_selection = db_replica_selection  # "round_robin" or "least_connections"
+    self.db_sticky_seconds = int(db_sticky_seconds)
+    self.server_timing = asbool(server_timing)
+    self.profiling     = asbool(profiling)
+    self.profiling_samples = int(profiling_samples)
+    self.lazy_load_guard = asbool(lazy_load_guard)
+    self.lazy_load_threshold = int(lazy_load_threshold)
     """
 
     def __init__(
@@ -24,6 +49,31 @@ class RestalchemyConfig:
         allowed_origins: Tuple[str] = None,
         disable_cors: bool = False,
         authenticate_fn: str = None,
+        pagination: str = "offset",
+        count: str = "exact",
+        streaming: bool = False,
+        stream_chunk_size: int = 100,
+        bulk_batch_size: int = 1000,
+        bulk_partial: bool = False,
+        version_cache: bool = False,
+        version_cache_size: int = 10000,
+        response_cache: bool = False,
+        response_cache_size: int = 1000,
+        response_cache_ttl: int = 60,
+        db_url: str = None,
+        db_pool_size: int = 5,
+        db_max_overflow: int = 10,
+        db_pool_timeout: int = 30,
+        db_pool_recycle: int = -1,
+        db_echo: bool = False,
+        db_replica_urls: List[str] = None,
+        db_replica_selection: str = "round_robin",
+        db_sticky_seconds: int = 5,
+        server_timing: bool = False,
+        profiling: bool = False,
+        profiling_samples: int = 1000,
+        lazy_load_guard: bool = False,
+        lazy_load_threshold: int = 0,
     ) -> None:
 
         self.api_version = api_version
@@ -32,6 +82,51 @@ class RestalchemyConfig:
         self.default_limit = int(default_limit)
         self.max_limit = int(max_limit)
 
+        if pagination not in ("offset", "cursor"):
+            raise ValueError("`pagination` must be either 'offset' or 'cursor'")
+        self.pagination = pagination
+
+        if count not in ("exact", "distinct_id", "estimate", "none"):
+            raise ValueError("`count` must be one of 'exact', 'distinct_id', 'estimate' or 'none'")
+        self.count = count
+        # Set with `config.set_count_estimate_function`
+        self.count_estimate_fn = None
+
+        self.streaming = asbool(streaming)
+        self.stream_chunk_size = int(stream_chunk_size)
+
+        self.bulk_batch_size = int(bulk_batch_size)
+        self.bulk_partial = asbool(bulk_partial)
+
+        self.version_cache = asbool(version_cache)
+        self.version_cache_size = int(version_cache_size)
+
+        self.response_cache = asbool(response_cache)
+        self.response_cache_size = int(response_cache_size)
+        self.response_cache_ttl = int(response_cache_ttl)
+
+        self.db_url = db_url
+        self.db_pool_size = int(db_pool_size)
+        self.db_max_overflow = int(db_max_overflow)
+        self.db_pool_timeout = int(db_pool_timeout)
+        self.db_pool_recycle = int(db_pool_recycle)
+        self.db_echo = asbool(db_echo)
+
+        self.db_replica_urls = aslist(db_replica_urls or [])
+        if db_replica_selection not in ("round_robin", "least_connections"):
+            raise ValueError(
+                "`db_replica_selection` must be either 'round_robin' or 'least_connections'"
+            )
+        self.db_replica_selection = db_replica_selection
+        self.db_sticky_seconds = int(db_sticky_seconds)
+        self.server_timing = asbool(server_timing)
+
+        self.profiling = asbool(profiling)
+        self.profiling_samples = int(profiling_samples)
+
+        self.lazy_load_guard = asbool(lazy_load_guard)
+        self.lazy_load_threshold = int(lazy_load_threshold)
+
         if writable_attributes is None:
             self.writable_attributes: List[str] = []
         else:
@@ -59,12 +154,18 @@ def includeme(config: Configurator):
     config.registry.restalchemy = rest_config
 
     config.include(".sanity")  # Add sanity tween
+    config.include(".db")  # Add session and transaction tween if `db_url` is set
+    config.include(".lazyload")  # Add lazy load guard tween if `lazy_load_guard` is enabled
     config.include(".model")
     config.include(".renderer")
     config.include(".request")
     config.include(".predicates")
     config.include(".validators")
+    config.include(".conditional")
+    config.include(".cache")
     if not rest_config.disable_cors:
         config.include(".cors")
+    # Add profiling tween and endpoint if `profiling` is enabled
+    config.include(".profiling", route_prefix="/" + rest_config.api_version)
     config.include(".routes", route_prefix="/" + rest_config.api_version)
     config.include(".views")
@@ -0,0 +1,313 @@
+"""RESTAlchemy asyncio support.
+
+Coroutine versions of the core read and write paths for applications that use
+:class:`sqlalchemy.ext.asyncio.AsyncSession` (SQLAlchemy >= 1.4,
+``pip install restalchemy[async]``).
+The app has to set `request.async_dbsession` (like `request.dbsession`
+for the synchronous views) and is responsible for committing it,
+or it serves the API with :class:`AsgiApp` which does both.
+
+The database work runs in :meth:`AsyncSession.run_sync` with exactly the same
+implementation as the synchronous views, so filters, sorting, pagination and
+validation behave the same. The lifecycle hooks (`__after_get__`,
+`__before_create__`, ...) run in the session as well (with `request.dbsession` set),
+so existing hooks keep working. Hooks can also be coroutine functions, they're awaited
+outside of the database work and have to use `request.async_dbsession`.
+
+Models are rendered with :func:`render`, which also runs in the session,
+so attributes that are not loaded yet can still be lazy loaded.
+
+Only lists, single resources, creating and updating resources have coroutine versions.
+Lists can't be streamed and the queries are not faster than with the synchronous views,
+the database driver just doesn't block the event loop.
+"""
+
+import inspect as pyinspect
+import io
+import logging
+from typing import Any, Callable, Dict, Optional, Tuple, Union
+
+from pyramid.httpexceptions import HTTPException, HTTPForbidden, HTTPNotFound, HTTPNotModified
+from pyramid.interfaces import IRoutesMapper
+from pyramid.registry import Registry
+from pyramid.renderers import RendererHelper
+from pyramid.request import Request, apply_request_extensions
+from pyramid.response import Response
+
+from .conditional import cached_not_modified, conditional_response
+from .exceptions import InternalServerError
+from .model import RestalchemyBase
+from .renderer import ApiRenderer
+from .response import RestResponse
+from .utils import QueryResult, query_models
+from .views import _list_info, _load_model, forbidden, notfound
+
+log = logging.getLogger("restalchemy")
+
+
+async def maybe_await(value: Any) -> Any:
+    """Return :param:`value` or its result if it's awaitable (e.g. from an async hook)."""
+    if pyinspect.isawaitable(value):
+        return await value
+    return value
+
+
+async def call_hook(request: Request, hook: Callable, *args) -> Any:
+    """Call the lifecycle :param:`hook` (e.g. `model.__after_get__`) with :param:`request`.
+
+    Coroutine functions are awaited, other hooks run in `request.async_dbsession`
+    (see :func:`run_sync`) so they can use `request.dbsession` and lazy load attributes.
+    """
+    if pyinspect.iscoroutinefunction(hook):
+        return await hook(request, *args)
+    return await maybe_await(await run_sync(request, hook, request, *args))
+
+
+async def run_sync(request: Request, fn: Callable, *args, **kwargs) -> Any:
+    """Call :param:`fn` in `request.async_dbsession` with `request.dbsession` set
+    to its synchronous session, so the synchronous RESTAlchemy functions can be used.
+    """
+
+    def call(session):
+        missing = object()
+        dbsession = request.__dict__.get("dbsession", missing)
+        request.dbsession = session
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            if dbsession is missing:
+                del request.dbsession
+            else:
+                request.dbsession = dbsession
+
+    return await request.async_dbsession.run_sync(call)
+
+
+async def query_models_async(
+    request: Request,
+    Model: RestalchemyBase,
+    offset: int = None,
+    limit: int = None,
+    sort: str = None,
+    filter: list = None,
+    after: str = None,
+) -> QueryResult:
+    """Coroutine version of :func:`restalchemy.utils.query_models` (without streaming)."""
+    return await run_sync(
+        request, query_models, request, Model, offset, limit, sort, filter, after
+    )
+
+
+async def models_GET(request: Request) -> Union[RestResponse, HTTPNotModified]:
+    """Coroutine version of :func:`restalchemy.views.models_GET` (without streaming)."""
+    Model: RestalchemyBase = request.matchdict["Model"]
+
+    not_modified = cached_not_modified(request, Model)
+    if not_modified is not None:
+        return not_modified
+
+    query_result = await query_models_async(request, Model)
+    not_modified = conditional_response(
+        request, Model, query_result.result, query_result.count, query_result.has_more
+    )
+    if not_modified is not None:
+        return not_modified
+
+    info = _list_info(request, Model, query_result)
+    return RestResponse(Model.__list_resource_name__(request), query_result.result, info)
+
+
+async def get_model(request: Request) -> RestalchemyBase:
+    """Return the model from the `Model` and `id` in the matchdict."""
+    model = await run_sync(request, _load_model, request)
+    await call_hook(request, model.__after_get__)
+    return model
+
+
+async def model_GET(request: Request) -> Union[RestalchemyBase, HTTPNotModified]:
+    """Coroutine version of :func:`restalchemy.views.model_GET`."""
+    Model = request.matchdict["Model"]
+
+    not_modified = cached_not_modified(request, Model)
+    if not_modified is not None:
+        return not_modified
+
+    model = await get_model(request)
+    not_modified = conditional_response(request, Model, [model])
+    if not_modified is not None:
+        return not_modified
+    return model
+
+
+async def models_POST(request: Request) -> RestalchemyBase:
+    """Coroutine version of :func:`restalchemy.views.models_POST`."""
+    Model = request.matchdict["Model"]
+    model = Model()
+    data = await call_hook(request, model.__before_create__)
+    data = data or request.json
+
+    def create():
+        model._update_from_json(request, data=data, is_create=True)
+        request.dbsession.add(model)
+        # Flush so we get an ID for our resource
+        request.dbsession.flush()
+
+    await run_sync(request, create)
+    await call_hook(request, model.__after_create__)
+    return model
+
+
+async def model_PUT(request: Request) -> RestalchemyBase:
+    """Coroutine version of :func:`restalchemy.views.model_PUT`."""
+    model = await get_model(request)
+    data = await call_hook(request, model.__before_update__)
+    data = data or request.json
+
+    def update():
+        model._update_from_json(request, data=data, is_update=True)
+        request.dbsession.flush()
+
+    await run_sync(request, update)
+    await call_hook(request, model.__after_update__)
+    return model
+
+
+async def render(request: Request, value: Any) -> Optional[str]:
+    """Render the return value of a view like the RESTAlchemy renderer.
+
+    Returns ``None`` for responses (e.g. `304 Not Modified`) that are not rendered.
+    """
+    if isinstance(value, HTTPNotModified):
+        return None
+    renderer = ApiRenderer(RendererHelper(registry=request.registry))
+    return await run_sync(request, renderer, value, {"request": request})
+
+
+# Coroutine views of the routes that :class:`AsgiApp` serves, by route name and method
+ASGI_VIEWS: Dict[Tuple[str, str], Callable] = {
+    ("restalchemy.models", "GET"): models_GET,
+    ("restalchemy.models", "POST"): models_POST,
+    ("restalchemy.model", "GET"): model_GET,
+    ("restalchemy.model", "PUT"): model_PUT,
+}
+
+
+class AsgiApp:
+    """ASGI application that serves the RESTAlchemy API with the coroutine views.
+
+    Requests are matched with the routes of the Pyramid :param:`registry`
+    (e.g. `config.registry` after `config.include("restalchemy")`) and dispatched to
+    the coroutine views in :data:`ASGI_VIEWS`. Every request gets a new
+    `request.async_dbsession` from :param:`sessionmaker` (e.g. an
+    ``async_sessionmaker``) which is committed if the request succeeded and
+    rolled back otherwise.
+
+    Pyramid tweens, view permissions and the other RESTAlchemy views
+    (attributes, batches, bulk writes, NDJSON exports) are not available,
+    their routes return `404 Not Found`.
+    """
+
+    def __init__(self, registry: Registry, sessionmaker: Callable) -> None:
+        self.registry = registry
+        self.sessionmaker = sessionmaker
+
+    async def __call__(self, scope: dict, receive: Callable, send: Callable) -> None:
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown":
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+        if scope["type"] != "http":
+            raise ValueError("Unsupported ASGI scope type {}".format(scope["type"]))
+
+        body = b""
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+        response = await self.handle(self.make_request(scope, body))
+        await send(
+            {
+                "type": "http.response.start",
+                "status": response.status_code,
+                "headers": [
+                    (name.lower().encode("latin-1"), value.encode("latin-1"))
+                    for name, value in response.headerlist
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": response.body})
+
+    def make_request(self, scope: dict, body: bytes) -> Request:
+        """Return the Pyramid request for the ASGI :param:`scope` and :param:`body`."""
+        server = scope.get("server") or ("localhost", 80)
+        environ = {
+            "REQUEST_METHOD": scope["method"],
+            "SCRIPT_NAME": scope.get("root_path", ""),
+            "PATH_INFO": scope["path"],
+            "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+            "SERVER_NAME": server[0],
+            "SERVER_PORT": str(server[1]),
+            "SERVER_PROTOCOL": "HTTP/" + scope.get("http_version", "1.1"),
+            "wsgi.url_scheme": scope.get("scheme", "http"),
+            "wsgi.input": io.BytesIO(body),
+            "CONTENT_LENGTH": str(len(body)),
+        }
+        for name, value in scope.get("headers", []):
+            key = name.decode("latin-1").upper().replace("-", "_")
+            if key not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+                key = "HTTP_" + key
+            environ[key] = value.decode("latin-1")
+
+        request = Request(environ)
+        request.registry = self.registry
+        apply_request_extensions(request)
+        return request
+
+    async def handle(self, request: Request) -> Response:
+        """Return the response of the coroutine view for :param:`request`."""
+        session = request.async_dbsession = self.sessionmaker()
+        try:
+            try:
+                value = await self.dispatch(request)
+                if isinstance(value, Response):
+                    response = value
+                else:
+                    response = request.response
+                    response.text = await render(request, value)
+            except HTTPForbidden:
+                response = forbidden(request)
+            except HTTPNotFound:
+                response = notfound(request)
+            except HTTPException as e:
+                response = e
+
+            if response.status_code < 400:
+                await session.commit()
+            else:
+                await session.rollback()
+        except Exception:
+            log.exception("Error in %s %s", request.method, request.path)
+            await session.rollback()
+            response = InternalServerError()
+        finally:
+            await session.close()
+        return response
+
+    async def dispatch(self, request: Request) -> Any:
+        """Match the route of :param:`request` and return the result of its coroutine view."""
+        info = self.registry.getUtility(IRoutesMapper)(request)
+        route = info["route"]
+        if route is None:
+            raise HTTPNotFound()
+        request.matchdict = info["match"]
+        request.matched_route = route
+        view = ASGI_VIEWS.get((route.name, request.method))
+        if view is None:
+            raise HTTPNotFound()
+        return await view(request)
@@ -0,0 +1,249 @@
+"""RESTAlchemy response cache.
+
+If the `response_cache` setting is enabled, rendered responses of the
+GET views (single resources, lists and attributes) are cached per path,
+query parameters and authenticated user.
+
+Every cache key also contains a generation of the requested model class
+and all model classes that can be reached through its relationships.
+When a model is flushed or committed, the generation of its class is
+changed, so all cached responses that could contain it are invalidated
+without having to know their keys.
+Responses of models with an `__after_get__` hook or a `__read_filter__`
+(e.g. to check access rights) are not cached.
+
+The default backend is an in process LRU cache with a TTL (:class:`MemoryCache`).
+Shared backends (e.g. redis or memcached) can be used with
+`config.set_response_cache_backend` by implementing :class:`CacheBackend`.
+"""
+import time
+import uuid
+import weakref
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, Optional
+
+from pyramid.config import Configurator
+from pyramid.request import Request
+from pyramid.response import Response
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from .conditional import has_access_hooks, is_not_modified, not_modified
+from .model import RestalchemyBase, changed_model_classes
+
+
+class CacheBackend:
+    """Interface for response cache backends.
+
+    Values are picklable python objects and `ttl` is in seconds.
+    """
+
+    def get(self, key: str) -> Optional[Any]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: Any, ttl: Optional[int] = None) -> None:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+
+class MemoryCache(CacheBackend):
+    """In process LRU cache with a maximum number of entries and a TTL."""
+
+    def __init__(self, max_size: int = 1000, ttl: Optional[int] = None) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries: OrderedDict = OrderedDict()
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires is not None and expires < time.monotonic():
+            del self.entries[key]
+            self.evictions += 1
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, ttl: Optional[int] = None) -> None:
+        ttl = ttl if ttl is not None else self.ttl
+        expires = time.monotonic() + ttl if ttl else None
+        self.entries[key] = (expires, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key: str) -> None:
+        self.entries.pop(key, None)
+
+
+@lru_cache(maxsize=None)
+def related_model_classes(Model: RestalchemyBase) -> frozenset:
+    """Return :param:`Model` and all model classes reachable through its relationships."""
+    classes = {Model}
+    todo = [Model]
+    while todo:
+        for relationship in inspect(todo.pop()).relationships:
+            related = relationship.mapper.class_
+            if related not in classes:
+                classes.add(related)
+                todo.append(related)
+    return frozenset(classes)
+
+
+def _generation_key(Model: RestalchemyBase) -> str:
+    return "restalchemy.generation.{}.{}".format(Model.__module__, Model.__qualname__)
+
+
+class ResponseCache:
+    """Cache for rendered responses with invalidation by model class."""
+
+    def __init__(self, backend: CacheBackend, ttl: Optional[int] = None) -> None:
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def stats(self) -> Dict[str, Optional[int]]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": getattr(self.backend, "evictions", None),
+        }
+
+    def generation(self, Model: RestalchemyBase) -> str:
+        """Return the current generation of :param:`Model`.
+
+        If the generation is missing (never set, evicted or expired) a new one is
+        started, so responses cached under an older generation are never used again.
+        """
+        generation = self.backend.get(_generation_key(Model))
+        if generation is None:
+            generation = uuid.uuid4().hex
+            self.backend.set(_generation_key(Model), generation)
+        return generation
+
+    def key(self, request: Request, Model: RestalchemyBase) -> str:
+        params = sorted(request.params.items())
+        generations = sorted(
+            (_generation_key(cls), self.generation(cls)) for cls in related_model_classes(Model)
+        )
+        return "restalchemy.response.{!r}".format(
+            (request.path, params, request.authenticated_userid, generations)
+        )
+
+    def invalidate(self, Model: RestalchemyBase) -> None:
+        self.backend.set(_generation_key(Model), uuid.uuid4().hex)
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        self.backend.set(key, value, self.ttl)
+
+
+# All response caches that get invalidated when a session changes models
+_response_caches: "weakref.WeakSet[ResponseCache]" = weakref.WeakSet()
+
+
+def _invalidate(changed) -> None:
+    for cache in _response_caches:
+        for Model in changed:
+            cache.invalidate(Model)
+
+
+def _invalidate_after_flush(session: Session, flush_context) -> None:
+    changed = changed_model_classes(session)
+    session.info.setdefault("restalchemy_cache_changed", set()).update(changed)
+    _invalidate(changed)
+
+
+def _invalidate_after_commit(session: Session) -> None:
+    # Invalidate again so responses that were cached between flush and commit are not used
+    _invalidate(session.info.pop("restalchemy_cache_changed", ()))
+
+
+def _forget_after_rollback(session: Session) -> None:
+    session.info.pop("restalchemy_cache_changed", None)
+
+
+def cached_view(view):
+    """View decorator that caches successful responses in the response cache."""
+
+    def cached(context, request: Request):
+        cache: Optional[ResponseCache] = request.registry.restalchemy_response_cache
+        Model = request.matchdict["Model"]
+        # Access checks in the hooks have to run for every request
+        if cache is None or request.method != "GET" or has_access_hooks(Model):
+            return view(context, request)
+
+        key = cache.key(request, Model)
+        cached_response = cache.get(key)
+        if cached_response is not None:
+            body, content_type, charset, headers = cached_response
+            version = (headers.get("ETag"), None)
+            if version[0] is not None and is_not_modified(request, version):
+                return not_modified(version)
+            response = request.response
+            response.body = body
+            response.content_type = content_type
+            response.charset = charset
+            response.headers.update(headers)
+            return response
+
+        response: Response = view(context, request)
+        # Streamed responses (where the body is not rendered yet) are not cached
+        if response.status_code == 200 and isinstance(response.app_iter, list):
+            headers = {
+                h: response.headers[h] for h in ("ETag", "Last-Modified") if h in response.headers
+            }
+            cache.set(key, (response.body, response.content_type, response.charset, headers))
+        return response
+
+    return cached
+
+
+def set_response_cache_backend(config, backend):
+    """Sets the backend for the response cache.
+
+    :param:`backend` is a :class:`CacheBackend` instance (can be dotted)
+    or a factory (class) that's called without arguments.
+    """
+    backend = config.maybe_dotted(backend)
+    if isinstance(backend, type):
+        backend = backend()
+    ttl = config.registry.restalchemy.response_cache_ttl
+    _set_response_cache(config, ResponseCache(backend, ttl))
+
+
+def _set_response_cache(config: Configurator, cache: ResponseCache) -> None:
+    config.registry.restalchemy_response_cache = cache
+    _response_caches.add(cache)
+
+    if not event.contains(Session, "after_flush", _invalidate_after_flush):
+        event.listen(Session, "after_flush", _invalidate_after_flush)
+        event.listen(Session, "after_commit", _invalidate_after_commit)
+        event.listen(Session, "after_rollback", _forget_after_rollback)
+
+
+def includeme(config: Configurator):
+    rest_config = config.registry.restalchemy
+    config.registry.restalchemy_response_cache = None
+    config.add_directive(
+        "set_response_cache_backend", set_response_cache_backend, action_wrap=True
+    )
+    if rest_config.response_cache:
+        backend = MemoryCache(rest_config.response_cache_size, rest_config.response_cache_ttl)
+        _set_response_cache(config, ResponseCache(backend, rest_config.response_cache_ttl))
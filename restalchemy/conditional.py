@@ -0,0 +1,213 @@
+"""RESTAlchemy conditional requests.
+
+Models that declare a version attribute (e.g. ``__version_attribute__ = "updated_at"``)
+get an `ETag` (and `Last-Modified` if the attribute is a datetime) header
+for single resources and lists of resources.
+Requests with a matching `If-None-Match` (or `If-Modified-Since`) header
+are answered with `304 Not Modified` before the response is rendered.
+Lists only get an `ETag`: the newest version of a page doesn't change when rows
+are deleted or don't match the filters any more, so `If-Modified-Since` can't be used.
+
+The ETag is computed from the IDs and versions of the already fetched
+models so no extra query is needed.
+With the `version_cache` setting, the ETags are also remembered in
+process and a matching request is answered without touching the database at all.
+The cache is invalidated on every flush or commit that changes a model
+of the same class. This only works if all writes go through this process.
+Models with an `__after_get__` hook or a `__read_filter__` (e.g. to check access rights)
+are never answered from the cache, so their hooks always run.
+"""
+import hashlib
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Hashable, Iterable, Optional, Tuple
+
+from pyramid.config import Configurator
+from pyramid.httpexceptions import HTTPNotModified
+from pyramid.request import Request
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from .model import RestalchemyBase, changed_model_classes
+from .utils import get_loader_options
+
+# ETag and Last-Modified of a resource
+Version = Tuple[str, Optional[datetime]]
+
+
+class VersionCache:
+    """In process cache of resource versions.
+
+    Entries are stored per model class together with a generation
+    of this class which is incremented whenever a model of it changes.
+    Entries from an older generation are invalid.
+    """
+
+    def __init__(self, max_size: int = 10000) -> None:
+        self.max_size = max_size
+        self.generations: dict = {}
+        self.entries: OrderedDict = OrderedDict()
+
+    def get(self, Model: RestalchemyBase, key: Hashable) -> Optional[Version]:
+        entry = self.entries.get((Model, key))
+        if entry is None or entry[0] != self.generations.get(Model, 0):
+            return None
+        self.entries.move_to_end((Model, key))
+        return entry[1]
+
+    def set(self, Model: RestalchemyBase, key: Hashable, version: Version) -> None:
+        self.entries[(Model, key)] = (self.generations.get(Model, 0), version)
+        self.entries.move_to_end((Model, key))
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, Model: RestalchemyBase) -> None:
+        self.generations[Model] = self.generations.get(Model, 0) + 1
+
+
+version_cache = VersionCache()
+
+
+def _invalidate_after_flush(session: Session, flush_context) -> None:
+    changed = changed_model_classes(session)
+    session.info.setdefault("restalchemy_changed", set()).update(changed)
+    for Model in changed:
+        version_cache.invalidate(Model)
+
+
+def _invalidate_after_commit(session: Session) -> None:
+    # Invalidate again so versions that were read between flush and commit are not used
+    for Model in session.info.pop("restalchemy_changed", ()):
+        version_cache.invalidate(Model)
+
+
+def _forget_after_rollback(session: Session) -> None:
+    session.info.pop("restalchemy_changed", None)
+
+
+def get_version_attribute(request: Request, Model: RestalchemyBase) -> Optional[str]:
+    """Return the version attribute of :param:`Model` if conditional requests are possible.
+
+    The version only covers the model itself, so responses with expanded
+    relationships (which could change without a new version) are never conditional.
+    """
+    version_attribute = getattr(Model, "__version_attribute__", None)
+    if version_attribute is None or get_loader_options(request, Model, request.include):
+        return None
+    return version_attribute
+
+
+def get_version(models: Iterable[RestalchemyBase], version_attribute: str, *extra) -> Version:
+    """Return the ETag and Last-Modified date for :param:`models`.
+
+    :param:`extra` values that are part of the response as well
+    (e.g. the total count of a list) are included in the ETag.
+    """
+    etag = hashlib.md5(repr(extra).encode())
+    last_modified = None
+    for model in models:
+        version = getattr(model, version_attribute)
+        etag.update(repr((getattr(model, "id", None), version)).encode())
+        if isinstance(version, datetime) and (last_modified is None or version > last_modified):
+            last_modified = version
+
+    if last_modified is not None and last_modified.tzinfo is None:
+        last_modified = last_modified.replace(tzinfo=timezone.utc)
+    return 'W/"' + etag.hexdigest() + '"', last_modified
+
+
+def is_not_modified(request: Request, version: Version) -> bool:
+    """Return ``True`` if the client already has :param:`version` of the resource."""
+    etag, last_modified = version
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match is not None:
+        # Weak comparison, i.e. `W/"a"` matches `"a"`
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags or etag[2:] in tags
+    if_modified_since = request.if_modified_since
+    if if_modified_since is not None and last_modified is not None:
+        return last_modified.replace(microsecond=0) <= if_modified_since
+    return False
+
+
+def _cache_key(request: Request) -> Hashable:
+    return (request.path_qs, request.authenticated_userid)
+
+
+def set_version_headers(request: Request, version: Version) -> None:
+    etag, last_modified = version
+    request.response.headers["ETag"] = etag
+    if last_modified is not None:
+        request.response.last_modified = last_modified
+
+
+def not_modified(version: Version) -> HTTPNotModified:
+    etag, last_modified = version
+    response = HTTPNotModified(headers=[("ETag", etag)])
+    if last_modified is not None:
+        response.last_modified = last_modified
+    return response
+
+
+def has_access_hooks(Model: RestalchemyBase) -> bool:
+    """Return ``True`` if :param:`Model` has hooks that have to run for every GET request."""
+    return hasattr(Model, "__read_filter__") or (
+        getattr(Model.__after_get__, "__func__", Model.__after_get__)
+        is not RestalchemyBase.__after_get__
+    )
+
+
+def cached_not_modified(request: Request, Model: RestalchemyBase) -> Optional[HTTPNotModified]:
+    """Return `304 Not Modified` if the cached version matches the request.
+
+    Always returns ``None`` if the `version_cache` setting is not enabled.
+    """
+    if not request.registry.restalchemy.version_cache:
+        return None
+    if not (request.headers.get("If-None-Match") or request.if_modified_since):
+        return None
+    if get_version_attribute(request, Model) is None or has_access_hooks(Model):
+        return None
+    version = version_cache.get(Model, _cache_key(request))
+    if version is not None and is_not_modified(request, version):
+        return not_modified(version)
+    return None
+
+
+def conditional_response(
+    request: Request, Model: RestalchemyBase, models: Iterable[RestalchemyBase], *extra
+) -> Optional[HTTPNotModified]:
+    """Set the `ETag` and `Last-Modified` headers for :param:`models` (and :param:`extra`).
+
+    Return `304 Not Modified` if the client already has this version,
+    otherwise ``None`` and the response should be rendered as usual.
+    """
+    version_attribute = get_version_attribute(request, Model)
+    if version_attribute is None:
+        return None
+
+    if request.fields:
+        # The same models with other fields are a different representation
+        extra += (request.fields,)
+    version = get_version(models, version_attribute, *extra)
+    if "id" not in request.matchdict:
+        # Only single resources get a `Last-Modified` (see the module docstring)
+        version = (version[0], None)
+    if request.registry.restalchemy.version_cache:
+        version_cache.set(Model, _cache_key(request), version)
+    if is_not_modified(request, version):
+        return not_modified(version)
+    set_version_headers(request, version)
+    return None
+
+
+def includeme(config: Configurator):
+    rest_config = config.registry.restalchemy
+    if not rest_config.version_cache:
+        return
+
+    version_cache.max_size = rest_config.version_cache_size
+    if not event.contains(Session, "after_flush", _invalidate_after_flush):
+        event.listen(Session, "after_flush", _invalidate_after_flush)
+        event.listen(Session, "after_commit", _invalidate_after_commit)
+        event.listen(Session, "after_rollback", _forget_after_rollback)
@@ -0,0 +1,270 @@
+"""RESTAlchemy database session integration.
+
+If the `db_url` setting is set, RESTAlchemy creates the engine (with a
+connection pool configured by the `db_pool_*` settings) and provides
+`request.dbsession` itself.
+
+The session is created lazily on first access, so requests that never
+touch the database never check out a connection. The session is
+committed at the end of the request by a tween, or rolled back if the
+request failed (an exception or an error status code).
+For streamed responses this happens when the server closes the response
+after sending it (a response that was not sent completely is rolled back).
+
+With `db_replica_urls`, requests with safe methods (GET, HEAD, OPTIONS) read
+from one of the replicas (see :func:`choose_replica`). Flushes and everything
+after the first flush of a request always go to the primary database.
+After a successful write a client reads from the primary for `db_sticky_seconds`
+(tracked with a cookie), so it always sees its own writes.
+
+Every request with a session gets :class:`DBMetrics` as `request.db_metrics`
+(time waited for a pool connection, number of queries, loaded rows and
+time spent in the database). With the `server_timing` setting they're also
+returned as `Server-Timing` header.
+"""
+import itertools
+import logging
+import time
+from typing import Dict, List, Optional
+
+from pyramid.config import Configurator
+from pyramid.request import Request
+from pyramid.response import Response
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session, sessionmaker
+
+from . import RestalchemyConfig
+from .response import ClosingAppIter, is_streamed
+
+log = logging.getLogger("restalchemy")
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+# Cookie with the time until which a client reads from the primary database
+STICKY_COOKIE = "restalchemy_primary_until"
+
+
+class DBMetrics:
+    """Database metrics of a single request."""
+
+    def __init__(self) -> None:
+        # Seconds waited to check out a connection from the pool
+        self.checkout_wait = 0.0
+        self.queries = 0
+        # Rows loaded into models
+        self.rows = 0
+        # Seconds spent executing queries
+        self.db_time = 0.0
+
+    def server_timing(self) -> str:
+        """Return the metrics as value for a `Server-Timing` header."""
+        return 'db;dur={:.2f};desc="{} queries, {} rows", db-checkout;dur={:.2f}'.format(
+            self.db_time * 1000, self.queries, self.rows, self.checkout_wait * 1000
+        )
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # Kept on the execution context, so it's gone with it if the statement fails
+    context._restalchemy_query_start = time.perf_counter()
+
+
+def _record_query(conn: Connection, context) -> None:
+    start = getattr(context, "_restalchemy_query_start", None)
+    metrics: Optional[DBMetrics] = conn.info.get("restalchemy_metrics")
+    if metrics is not None and start is not None:
+        metrics.queries += 1
+        metrics.db_time += time.perf_counter() - start
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    _record_query(conn, context)
+
+
+def _handle_error(exception_context) -> None:
+    # Failed statements take database time as well
+    if exception_context.execution_context is not None:
+        _record_query(exception_context.connection, exception_context.execution_context)
+
+
+def _loaded_as_persistent(session: Session, instance) -> None:
+    metrics: Optional[DBMetrics] = session.info.get("restalchemy_metrics")
+    if metrics is not None:
+        metrics.rows += 1
+
+
+def _after_flush(session: Session, flush_context) -> None:
+    session.info["restalchemy_wrote"] = True
+
+
+def create_db_engine(rest_config: RestalchemyConfig, url: str) -> Engine:
+    """Return the engine for :param:`url` with the `db_*` settings and query instrumentation."""
+    kwargs = {"echo": rest_config.db_echo, "pool_recycle": rest_config.db_pool_recycle}
+    if not url.startswith("sqlite"):
+        # SQLite uses a pool without size limits
+        kwargs.update(
+            pool_size=rest_config.db_pool_size,
+            max_overflow=rest_config.db_max_overflow,
+            pool_timeout=rest_config.db_pool_timeout,
+        )
+    engine = create_engine(url, **kwargs)
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+    return engine
+
+
+def _checked_out(engine: Engine) -> int:
+    checkedout = getattr(engine.pool, "checkedout", None)
+    return checkedout() if checkedout is not None else 0
+
+
+def choose_replica(request: Request) -> Engine:
+    """Return the replica engine for :param:`request`.
+
+    With ``db_replica_selection = round_robin`` (default) the replicas take turns,
+    with ``least_connections`` the replica with the fewest checked out connections is used.
+    """
+    registry = request.registry
+    replicas: List[Engine] = registry.restalchemy_replicas
+    if registry.restalchemy.db_replica_selection == "least_connections":
+        return min(replicas, key=_checked_out)
+    return replicas[next(registry.restalchemy_replica_counter) % len(replicas)]
+
+
+def use_primary(request: Request) -> bool:
+    """Return ``True`` if :param:`request` has to read from the primary database."""
+    if not request.registry.restalchemy_replicas or request.method not in SAFE_METHODS:
+        return True
+    try:
+        return float(request.cookies.get(STICKY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+class RoutingSession(Session):
+    """Session that reads from :attr:`read_engine` until the first flush.
+
+    Flushes and all statements after them use :attr:`write_engine`.
+    Connections are only checked out when they're needed.
+    """
+
+    def __init__(self, *args, connect=None, read_engine=None, write_engine=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.connect = connect
+        self.read_engine = read_engine
+        self.write_engine = write_engine
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self._flushing or self.info.get("restalchemy_wrote"):
+            return self.connect(self.write_engine)
+        return self.connect(self.read_engine)
+
+
+def get_dbsession(request: Request) -> Session:
+    """Return a new session for :param:`request`."""
+    registry = request.registry
+    metrics = request.db_metrics = DBMetrics()
+    connections: Dict[Engine, Connection] = {}
+    request.restalchemy_connections = connections
+
+    def connect(engine: Engine) -> Connection:
+        connection = connections.get(engine)
+        if connection is None:
+            start = time.perf_counter()
+            connection = connections[engine] = engine.connect()
+            metrics.checkout_wait += time.perf_counter() - start
+            connection.info["restalchemy_metrics"] = metrics
+        return connection
+
+    engine = registry.restalchemy_engine
+    read_engine = engine if use_primary(request) else choose_replica(request)
+    session = registry.restalchemy_sessionmaker(
+        connect=connect, read_engine=read_engine, write_engine=engine
+    )
+    session.info["restalchemy_metrics"] = metrics
+    return session
+
+
+def _finish(request: Request, success: bool) -> bool:
+    """Commit (or rollback) the session and return ``True`` if it wrote to the database."""
+    session: Session = request.__dict__["dbsession"]
+    try:
+        if success:
+            # Committing flushes the pending changes
+            session.commit()
+            return session.info.get("restalchemy_wrote", False)
+        session.rollback()
+        return False
+    finally:
+        session.close()
+        for connection in request.restalchemy_connections.values():
+            connection.info.pop("restalchemy_metrics", None)
+            connection.close()
+
+
+def db_tween_factory(handler, registry):
+    def db_tween(request: Request) -> Response:
+        try:
+            response = handler(request)
+        except Exception:
+            if "dbsession" in request.__dict__:
+                _finish(request, False)
+            raise
+
+        # The session is only created when the request used it
+        if "dbsession" not in request.__dict__:
+            return response
+
+        success = response.status_code < 400
+        if is_streamed(response):
+            # The body is still rendered from the session while it's sent
+            wrote = success and request.dbsession.info.get("restalchemy_wrote", False)
+
+            def on_close(exhausted: bool) -> None:
+                try:
+                    _finish(request, success and exhausted)
+                except Exception:
+                    log.exception("Could not commit the database session")
+                    raise
+
+            response.app_iter = ClosingAppIter(response.app_iter, on_close)
+        else:
+            try:
+                wrote = _finish(request, success)
+            except Exception:
+                log.exception("Could not commit the database session")
+                raise
+
+        sticky_seconds = registry.restalchemy.db_sticky_seconds
+        if wrote and registry.restalchemy_replicas and sticky_seconds:
+            # Read your own writes until the replicas caught up
+            response.set_cookie(
+                STICKY_COOKIE, str(time.time() + sticky_seconds), max_age=sticky_seconds
+            )
+        if registry.restalchemy.server_timing:
+            server_timing = request.db_metrics.server_timing()
+            if "Server-Timing" in response.headers:
+                server_timing = response.headers["Server-Timing"] + ", " + server_timing
+            response.headers["Server-Timing"] = server_timing
+        return response
+
+    return db_tween
+
+
+def includeme(config: Configurator):
+    rest_config = config.registry.restalchemy
+    if not rest_config.db_url:
+        return
+
+    config.registry.restalchemy_engine = create_db_engine(rest_config, rest_config.db_url)
+    config.registry.restalchemy_replicas = [
+        create_db_engine(rest_config, url) for url in rest_config.db_replica_urls
+    ]
+    config.registry.restalchemy_replica_counter = itertools.count()
+    config.registry.restalchemy_sessionmaker = sessionmaker(class_=RoutingSession)
+    if not event.contains(Session, "loaded_as_persistent", _loaded_as_persistent):
+        event.listen(Session, "loaded_as_persistent", _loaded_as_persistent)
+        event.listen(Session, "after_flush", _after_flush)
+
+    config.add_request_method(get_dbsession, "dbsession", reify=True)
+    config.add_tween("restalchemy.db.db_tween_factory")
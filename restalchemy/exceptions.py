@@ -60,6 +60,14 @@ class FilterInvalid(ApiError):
         super().__init__(error)
 
 
+class BulkFailed(ApiError):
+    errno = 15
+
+    def __init__(self, results, error="Bulk request failed"):
+        super().__init__(error)
+        self.json_body = {**self.json_body, "results": results}
+
+
 # Authentication
 
 
@@ -0,0 +1,303 @@
+"""RESTAlchemy filter compiler.
+
+Filters from the query string (:class:`restalchemy.request.Filter`) are
+normalized into :class:`FilterNode` objects that only describe the *shape*
+of a filter (joined models, attribute, operator and kind of value).
+All filters of a request are compiled once per shape into the joins
+and a criterion with bound parameters. The compiled filters are cached,
+so requests that only differ in the filter values reuse them and
+produce the same SQL string.
+
+Sort keys (:class:`restalchemy.request.Sort`) are compiled together with the
+filters, so models that are joined for a filter get an alias with a stable name
+per join path (e.g. ``filter_users`` for ``?user.name=foo``), which is shared by
+all filters and sort keys with the same path.
+"""
+import operator
+from functools import lru_cache
+from typing import Any, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+from pyramid.request import Request
+from sqlalchemy import and_, bindparam, event, inspect
+from sqlalchemy.exc import InvalidRequestError
+from sqlalchemy.orm import Mapper, RelationshipProperty, aliased
+from sqlalchemy.orm.attributes import InstrumentedAttribute
+from sqlalchemy.orm.query import Query
+
+from .exceptions import AttributeNotFound, AttributeWrong, FilterInvalid, ParamWrong
+from .model import RestalchemyBase
+from .request import Filter, Sort
+from .validators import validate
+
+OPERATORS = {"==": operator.eq, "!=": operator.ne, "<=": operator.le, ">=": operator.ge}
+
+
+class FilterNode(NamedTuple):
+    """Normalized filter without its values."""
+
+    # Models to join (the first one from the queried model), at most 2
+    models: Tuple[RestalchemyBase, ...]
+    # Model name from the query string, used in errors if it can't be joined
+    model_name: Optional[str]
+    attribute: str
+    # "==", "!=", "<=" or ">="
+    operator: str
+    # "value", "null", "in" (multiple values) or "like" (wildcard value)
+    kind: str
+
+
+class SortNode(NamedTuple):
+    """Normalized sort key."""
+
+    models: Tuple[RestalchemyBase, ...]
+    model_name: Optional[str]
+    attribute: str
+    descending: bool
+
+
+class CompiledFilters(NamedTuple):
+    # Join targets and the model name for errors
+    joins: Tuple[Tuple[Any, Optional[str]], ...]
+    # Criterion of all filters with the bound parameters `restalchemy_filter_{i}`
+    criterion: Any
+    # How to bind the values of each filter ("value", "like", "list" or `None`)
+    # and the attribute to validate the value with
+    params: Tuple[Tuple[Optional[str], Optional[InstrumentedAttribute]], ...]
+    distinct: bool
+    order_by: Tuple[Any, ...]
+
+
+def resolve_path(
+    request: Request, Model: RestalchemyBase, path: Tuple[str, ...]
+) -> Tuple[Tuple[RestalchemyBase, ...], Optional[str], str]:
+    """Return the models to join, the model name and the attribute for :param:`path`."""
+    models: Tuple[RestalchemyBase, ...] = ()
+    model_name = None
+    attribute = ".".join(path)
+    if len(path) > 1:
+        # when filtered by a full name assume a join
+        model_name, attribute = path[0], ".".join(path[1:])
+        Model2 = request.restalchemy_get_model(model_name)
+        if not Model2:
+            raise AttributeNotFound(model_name)
+
+        if Model != Model2:
+            models = (Model2,)
+            # Allow 1 more join to filter stuff like
+            # /campaigns?profile.segments_filter.segments_id=14
+            if len(path) > 2:
+                attribute = path[2]
+                Model3 = request.restalchemy_get_model(path[1])
+                if not Model3:
+                    raise AttributeNotFound(path[1])
+                if Model3 not in [Model, Model2]:
+                    models = (Model2, Model3)
+
+    return models, model_name, attribute
+
+
+def normalize_filter(
+    request: Request, Model: RestalchemyBase, filter: Filter
+) -> Tuple[FilterNode, Tuple[Optional[str], ...]]:
+    """Return the :class:`FilterNode` and values for :param:`filter` on :param:`Model`."""
+    path, op, values = filter
+    models, model_name, attribute = resolve_path(request, Model, path)
+
+    if len(values) > 1:
+        kind = "in"
+    elif values[0] is None:
+        kind = "null"
+    elif isinstance(values[0], str) and "*" in values[0]:
+        kind = "like"
+    else:
+        kind = "value"
+
+    return FilterNode(models, model_name, attribute, op, kind), values
+
+
+def normalize_sort(request: Request, Model: RestalchemyBase, sort: Sort) -> SortNode:
+    """Return the :class:`SortNode` for :param:`sort` on :param:`Model`.
+
+    If :param:`Model` has a list of `__sortable_attributes__`, only those can be sorted by.
+    """
+    sortable = getattr(Model, "__sortable_attributes__", None)
+    if isinstance(sortable, (list, tuple, set)) and ".".join(sort.path) not in sortable:
+        raise ParamWrong("Sorting by `{}` is not allowed".format(".".join(sort.path)))
+    models, model_name, attribute = resolve_path(request, Model, sort.path)
+    return SortNode(models, model_name, attribute, sort.descending)
+
+
+def is_indexed(attribute: InstrumentedAttribute) -> bool:
+    """Return ``True`` if the column of :param:`attribute` is the first column of an index."""
+    columns = getattr(attribute.property, "columns", None)
+    if not columns:
+        return False
+    column = columns[0]
+    if column.primary_key or column.index or column.unique:
+        return True
+    return any(
+        next(iter(index.columns), None) is column for index in getattr(column.table, "indexes", ())
+    )
+
+
+@lru_cache(maxsize=None)
+def _join_alias(path: Tuple[RestalchemyBase, ...]):
+    name = "_".join(inspect(Model).local_table.name for Model in path)
+    return aliased(path[-1], name="filter_" + name)
+
+
+def _join(
+    Model: RestalchemyBase,
+    node: Union[FilterNode, SortNode],
+    joins: List[Tuple[Any, Optional[str]]],
+    joined: set,
+) -> InstrumentedAttribute:
+    """Add the joins for :param:`node` (if not :param:`joined` yet) and return its attribute."""
+    FilterModel = Model
+    for depth in range(1, len(node.models) + 1):
+        FilterModel = _join_alias(node.models[:depth])
+        if node.models[:depth] not in joined:
+            joined.add(node.models[:depth])
+            # LEFT JOIN so you can query `Model2.attr='null'`
+            joins.append((FilterModel, node.model_name))
+
+    # FIXME: ???? validate list (otherwise DBAPIError is raised)!
+    try:
+        return getattr(FilterModel, node.attribute)
+    except AttributeError:
+        raise AttributeNotFound(node.attribute)
+
+
+@lru_cache(maxsize=1024)
+def compile_filters(
+    Model: RestalchemyBase, nodes: Tuple[FilterNode, ...], sort_nodes: Tuple[SortNode, ...] = ()
+) -> CompiledFilters:
+    """Compile the filter :param:`nodes` and :param:`sort_nodes` for a query of :param:`Model`.
+
+    If :param:`Model` has ``__sortable_attributes__ = "indexed"``, only indexed
+    columns can be sorted by.
+    """
+    joins: List[Tuple[Any, Optional[str]]] = []
+    # Join paths (and n to m relationships) that are already joined
+    joined: set = set()
+    criteria = []
+    params = []
+    distinct = False
+
+    for i, node in enumerate(nodes):
+        filter_attr = _join(Model, node, joins, joined)
+
+        param = bindparam("restalchemy_filter_{}".format(i), expanding=node.kind == "in")
+        negate = node.operator == "!="
+
+        # If filter_attr is n to m relationship, the value is always `IN` and
+        # we have to join the secondary table.
+        if isinstance(filter_attr, InstrumentedAttribute) and hasattr(
+            filter_attr.property, "secondary"
+        ):
+            target: Any = filter_attr.property.mapper.class_
+            if (node.models, node.attribute) not in joined:
+                joined.add((node.models, node.attribute))
+                joins.append((filter_attr, node.attribute))
+            if node.kind == "null":
+                criteria.append(target.id != None if negate else target.id == None)
+                params.append((None, None))
+            else:
+                # Without `DISTINCT` models matching multiple filter values will return
+                # multiple rows which sqlalchemy combines to one, resulting in less rows
+                # total then the specified `limit` rows
+                distinct = True
+                param = bindparam(param.key, expanding=True)
+                criteria.append(target.id.notin_(param) if negate else target.id.in_(param))
+                params.append(("list", None))
+            continue
+
+        if node.operator in ("<=", ">=") and node.kind == "in":
+            raise FilterInvalid(msg="Less or greater equal only allowed with single values.")
+        if node.operator in ("<=", ">=") and node.kind == "like":
+            raise FilterInvalid(msg="Less or greater equal is not allowed for wildcards (`*`).")
+
+        if node.kind == "in":
+            criteria.append(filter_attr.notin_(param) if negate else filter_attr.in_(param))
+            params.append(("list", None))
+        elif node.kind == "like":
+            criteria.append(~filter_attr.like(param) if negate else filter_attr.like(param))
+            params.append(("like", filter_attr))
+        elif node.kind == "null":
+            criteria.append(OPERATORS[node.operator](filter_attr, None))
+            params.append((None, None))
+        else:
+            criteria.append(OPERATORS[node.operator](filter_attr, param))
+            params.append(("value", filter_attr))
+
+    order_by = []
+    for sort_node in sort_nodes:
+        sort_attr = _join(Model, sort_node, joins, joined)
+        if isinstance(getattr(sort_attr, "property", None), RelationshipProperty):
+            raise AttributeWrong(sort_node.attribute)
+        if getattr(Model, "__sortable_attributes__", None) == "indexed" and not is_indexed(
+            sort_attr
+        ):
+            raise ParamWrong("Sorting by `{}` is not allowed".format(sort_node.attribute))
+        order_by.append(sort_attr.desc() if sort_node.descending else sort_attr.asc())
+
+    criterion = and_(*criteria) if criteria else None
+    return CompiledFilters(tuple(joins), criterion, tuple(params), distinct, tuple(order_by))
+
+
+@event.listens_for(Mapper, "after_configured")
+def _clear_compiled_filters():
+    _join_alias.cache_clear()
+    compile_filters.cache_clear()
+
+
+def apply_filters(
+    request: Request,
+    query: Query,
+    Model: RestalchemyBase,
+    filters: Sequence[Filter],
+    sort: Sequence[Sort] = (),
+) -> Query:
+    """Return :param:`query` with all :param:`filters` and :param:`sort` keys applied."""
+    if not filters and not sort:
+        return query
+
+    normalized = [normalize_filter(request, Model, f) for f in filters]
+    compiled = compile_filters(
+        Model,
+        tuple(node for node, values in normalized),
+        tuple(normalize_sort(request, Model, s) for s in sort),
+    )
+
+    for target, model_name in compiled.joins:
+        try:
+            # FIXME: specify join argument like
+            # ``query = query.outerjoin(Model2, Model.model2_name)``
+            # otherwise sqla can't find the join with some multiple filters like:
+            # `/v3/creatives?bans.reason=null&advertiser.network_id!=9&sort=quickstats.today.clicks.desc`
+            query = query.outerjoin(target)
+        except InvalidRequestError:
+            raise AttributeWrong(model_name)
+
+    values = {}
+    for i, ((bind, filter_attr), (node, filter_values)) in enumerate(
+        zip(compiled.params, normalized)
+    ):
+        if bind is None:
+            continue
+        if bind == "list":
+            value: Any = list(filter_values)
+        else:
+            value = filter_values[0]
+            validate(value, filter_attr)
+            if bind == "like":
+                value = value.replace("*", "%")
+        values["restalchemy_filter_{}".format(i)] = value
+
+    if compiled.criterion is not None:
+        query = query.filter(compiled.criterion.params(values))
+    if compiled.distinct:
+        query = query.distinct()
+    if compiled.order_by:
+        query = query.order_by(*compiled.order_by)
+    return query
@@ -0,0 +1,142 @@
+"""RESTAlchemy lazy load guard.
+
+Relationships that are not eager loaded (see :func:`restalchemy.utils.get_loader_options`)
+are lazy loaded with one query per model when they're serialized (N+1 queries).
+
+If the `lazy_load_guard` setting is enabled (e.g. in tests and staging, not in production),
+:func:`restalchemy.renderer.serialize_model` checks the loader state of every relationship
+before accessing it and counts the lazy loads (that query the database) per model attribute.
+At the end of the request (for streamed responses after they were sent) they're logged
+as warning with the eager loading option that avoids them.
+
+With `lazy_load_threshold`, :class:`LazyLoadError` is raised (like ``raiseload``)
+as soon as an attribute is lazy loaded more often in a single request,
+so N+1 regressions fail in CI.
+"""
+import logging
+from typing import Dict, Optional, Tuple
+
+from pyramid.config import Configurator
+from pyramid.request import Request
+from pyramid.response import Response
+from sqlalchemy import inspect
+from sqlalchemy.orm.base import MANYTOONE
+from sqlalchemy.orm.exc import UnmappedColumnError
+
+from .response import ClosingAppIter, is_streamed
+
+log = logging.getLogger("restalchemy.lazyload")
+
+
+class LazyLoadError(RuntimeError):
+    """Raised when a relationship is lazy loaded more than `lazy_load_threshold` times."""
+
+
+def get_lazy_loads(request: Optional[Request]) -> Optional[Dict[Tuple[type, str], int]]:
+    """Return the lazy loads of :param:`request` per model class and attribute.
+
+    Returns ``None`` if the guard is disabled.
+    """
+    return request and request.__dict__.get("restalchemy_lazy_loads")
+
+
+def suggest_loader_option(Model: type, attr: str) -> str:
+    """Return the eager loading option for the relationship :param:`attr` of :param:`Model`."""
+    relationship = inspect(Model).relationships[attr]
+    loader = "joinedload" if relationship.direction == MANYTOONE else "selectinload"
+    return "{}({}.{})".format(loader, Model.__name__, attr)
+
+
+def will_lazy_load(model, attr: str) -> bool:
+    """Return ``True`` if accessing the unloaded relationship :param:`attr` of
+    :param:`model` queries the database.
+
+    Many-to-one relationships don't if the foreign key is ``NULL`` or if the
+    related model is already in the identity map of the session.
+    """
+    state = inspect(model)
+    if state.session is None or state.key is None:
+        return False
+    relationship = state.mapper.relationships[attr]
+    if relationship.direction != MANYTOONE:
+        return True
+
+    values = {}
+    for local, remote in relationship.local_remote_pairs:
+        try:
+            key = state.mapper.get_property_by_column(local).key
+        except UnmappedColumnError:
+            return True
+        if key not in state.dict:
+            return True
+        if state.dict[key] is None:
+            return False
+        values[remote] = state.dict[key]
+
+    Target = relationship.mapper
+    if set(values) != set(Target.primary_key):
+        return True
+    identity = Target.identity_key_from_primary_key([values[c] for c in Target.primary_key])
+    return identity not in state.session.identity_map
+
+
+def check_lazy_load(request: Request, model, attr: str) -> None:
+    """Count a lazy load if the relationship :param:`attr` of :param:`model` is not loaded
+    and accessing it queries the database (see :func:`will_lazy_load`).
+
+    Call before accessing the attribute.
+    Raises :class:`LazyLoadError` if the `lazy_load_threshold` is exceeded.
+    """
+    lazy_loads = get_lazy_loads(request)
+    if lazy_loads is None or attr not in inspect(model).unloaded:
+        return
+    if not will_lazy_load(model, attr):
+        return
+
+    key = (model.__class__, attr)
+    lazy_loads[key] = lazy_loads.get(key, 0) + 1
+    threshold = request.registry.restalchemy.lazy_load_threshold
+    if threshold and lazy_loads[key] > threshold:
+        raise LazyLoadError(
+            "{}.{} was lazy loaded more than {} times, use `{}`".format(
+                model.__class__.__name__,
+                attr,
+                threshold,
+                suggest_loader_option(model.__class__, attr),
+            )
+        )
+
+
+def log_lazy_loads(request: Request) -> None:
+    """Log the lazy loads of :param:`request` as warnings."""
+    for (Model, attr), count in request.restalchemy_lazy_loads.items():
+        log.warning(
+            "%s.%s was lazy loaded %d times in %s %s, use `%s`",
+            Model.__name__,
+            attr,
+            count,
+            request.method,
+            request.path,
+            suggest_loader_option(Model, attr),
+        )
+
+
+def lazy_load_tween_factory(handler, registry):
+    def lazy_load_tween(request: Request) -> Response:
+        request.restalchemy_lazy_loads = {}
+        response = handler(request)
+        if is_streamed(response):
+            # Streamed responses are serialized while they're sent
+            response.app_iter = ClosingAppIter(
+                response.app_iter, lambda exhausted: log_lazy_loads(request)
+            )
+        else:
+            log_lazy_loads(request)
+        return response
+
+    return lazy_load_tween
+
+
+def includeme(config: Configurator):
+    if config.registry.restalchemy.lazy_load_guard:
+        config.add_tween("restalchemy.lazyload.lazy_load_tween_factory")
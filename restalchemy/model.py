@@ -1,16 +1,50 @@
 import logging
-from functools import partial
+import weakref
+from functools import lru_cache, partial
 from json.decoder import JSONDecodeError
-from typing import Optional, Set
+from typing import Callable, Dict, FrozenSet, Hashable, Iterator, Optional, Set
 
 from pyramid.config import Configurator
 from pyramid.request import Request
+from sqlalchemy import event, inspect, orm
+from sqlalchemy.orm import Mapper
 
 from .exceptions import AttributeNotFound, AttributeReadOnly, InvalidJson
 
 
 log = logging.getLogger("restalchemy")
 
+# Class attributes SQLAlchemy adds to declarative models (`registry` since SQLAlchemy 1.4)
+SQLALCHEMY_ATTRIBUTES = frozenset(
+    ("metadata", "registry") if hasattr(orm, "registry") else ("metadata",)
+)
+
+# Cached results of `_get_read_only_attributes` and `_get_writable_attributes`
+_attributes_cache: Dict[tuple, FrozenSet[str]] = {}
+
+
+@lru_cache(maxsize=None)
+def _class_attributes(cls) -> FrozenSet[str]:
+    return frozenset(dir(cls))
+
+
+@event.listens_for(Mapper, "after_configured")
+def clear_attributes_cache():
+    """Clear the cached writable and read only attributes of all models."""
+    _attributes_cache.clear()
+    _class_attributes.cache_clear()
+
+
+# Registries of all configs, refreshed after (new) mappers are configured
+_model_registries: "weakref.WeakSet[ModelRegistry]" = weakref.WeakSet()
+
+
+@event.listens_for(Mapper, "after_configured")
+def refresh_model_registries():
+    """Forget the resolved names of all model registries."""
+    for registry in list(_model_registries):
+        registry.refresh()
+
 
 class RestalchemyBase:
     """Base class for RESTAlchemy models.
@@ -42,6 +76,7 @@ class RestalchemyBase:
 
     __get_writable_attributes__(cls, request) -> List of writable attributes
     __get_read_only_attributes__(cls, request) -> List of read only attributes
+    __attributes_cache_key__(cls, request) -> Key to cache writable/read only attributes with
 
     # special definition just for creation and not update
 
@@ -67,11 +102,18 @@ class RestalchemyBase:
 
     __json_include__ = []  # list of attributes to return  (default: all)
     __json_exclude__ = []  # list of attributes to NOT return (applied *after* json_include (default: empty))
+    __json_list_exclude__ = []  # list of attributes to NOT return (and not load) in lists
     __json_private__ = []  # list of attributes that are private and can NEVER be viewed by any user
     __json_expand__ = []  # list of attributes to expand by default
     __json_depth__ = 1  # default depth for this model
     __json_show_attribute__  # function to determine if attribute should be shown or not
     __json_return_{attribute}__  # function who's return value is used for the json instead of the real value
+
+    -----
+
+    For lists:
+
+    __sortable_attributes__ = []  # Attributes that can be sorted by or "indexed" (default: all)
     """
 
     def __single_resource_name__(self, request: Request) -> str:
@@ -129,7 +171,45 @@ class RestalchemyBase:
     ) -> Set[str]:
         return set(request.registry.restalchemy.read_only_attributes)  # type: ignore
 
+    @classmethod
+    def __attributes_cache_key__(cls, request: Request) -> Optional[Hashable]:
+        """Return a key to cache the writable and read only attributes for :param:`request`.
+
+        The attributes are cached per model, `is_create`, `is_update`
+        and the attributes from the restalchemy config.
+        When `__get_writable_attributes__` or `__get_read_only_attributes__`
+        are overwritten, the attributes are not cached (``None`` is returned)
+        unless this method is overwritten as well to return what those
+        depend on (e.g. the role of the current user).
+        """
+        for name in ("__get_writable_attributes__", "__get_read_only_attributes__"):
+            if getattr(getattr(cls, name), "__func__", None) is not getattr(
+                RestalchemyBase, name
+            ).__func__:
+                return None
+        return ()
+
     # Helper methods
+    @classmethod
+    def _attributes_cache_key(
+        cls, kind: str, request: Request = None, is_create: bool = False, is_update: bool = False
+    ) -> Optional[tuple]:
+        if request is None:
+            return (cls, kind, is_create, is_update)
+        key = cls.__attributes_cache_key__(request)
+        if key is None:
+            return None
+        config = request.registry.restalchemy  # type: ignore
+        return (
+            cls,
+            kind,
+            is_create,
+            is_update,
+            key,
+            tuple(config.writable_attributes),
+            tuple(config.read_only_attributes),
+        )
+
     @classmethod
     def _get_read_only_attributes(
         cls, request: Request = None, is_create: bool = False, is_update: bool = False
@@ -142,7 +222,7 @@ class RestalchemyBase:
         - `cls.__read_only_attributes__`
         - `cls.__create_read_only_attributes__` if :param:`is_create` is ``True``
         - `cls.__update_read_only_attributes__` if :param:`is_update` is ``True``
-        - Add SQLAlchemy's `metadata` property
+        - Add SQLAlchemy's `metadata` (and `registry`) property
         - Add all properties starting with `_`
 
         :param Request request: Pyramid :class:`Request` request object
@@ -150,6 +230,10 @@ class RestalchemyBase:
         :param bool is_update: Add attributes from `__update_read_only_attributes__` method
         :returns: List of read only attributes
         """
+        cache_key = cls._attributes_cache_key("read_only", request, is_create, is_update)
+        if cache_key in _attributes_cache:
+            return set(_attributes_cache[cache_key])
+
         if request:
             attrs = cls.__get_read_only_attributes__(request, is_create, is_update)
         else:
@@ -162,11 +246,15 @@ class RestalchemyBase:
             attrs.update(getattr(cls, "__update_read_only_attributes__", []))
 
         # Add sqlalchemy metadata property
-        attrs.add("metadata")
+        attrs.update(SQLALCHEMY_ATTRIBUTES)
 
         # Only return properties that are actually defined
         # and add private properties that start with underscore
-        return set(a for a in dir(cls) if (a.startswith("_") or a in attrs))
+        attrs = set(a for a in _class_attributes(cls) if (a.startswith("_") or a in attrs))
+
+        if cache_key is not None:
+            _attributes_cache[cache_key] = frozenset(attrs)
+        return attrs
 
     @classmethod
     def __get_writable_attributes__(
@@ -194,6 +282,10 @@ class RestalchemyBase:
         :param bool is_update: Add attributes from `__update_writable_attributes__` method
         :returns: List of writable attributes
         """
+        cache_key = cls._attributes_cache_key("writable", request, is_create, is_update)
+        if cache_key in _attributes_cache:
+            return set(_attributes_cache[cache_key])
+
         if request:
             attrs = cls.__get_writable_attributes__(request, is_create, is_update)
         else:
@@ -206,13 +298,16 @@ class RestalchemyBase:
             attrs.update(getattr(cls, "__update_writable_attributes__", []))
 
         if not attrs:
-            attrs = set(dir(cls))
+            attrs = set(_class_attributes(cls))
         else:
-            attrs.intersection_update(dir(cls))  # Only return properties that are actually defined
+            # Only return properties that are actually defined
+            attrs.intersection_update(_class_attributes(cls))
 
         read_only_attrs = cls._get_read_only_attributes(request, is_create, is_update)
         attrs.difference_update(read_only_attrs)
 
+        if cache_key is not None:
+            _attributes_cache[cache_key] = frozenset(attrs)
         return attrs
 
     def _update_from_json(
@@ -231,7 +326,7 @@ class RestalchemyBase:
         writable and read only attributes for the 'create' case
         and when :param:`is_update` is ``True`` same for 'update'.
         """
-        from .validators import validate
+        from .validators import validate, validated_attributes
 
         if data is None:
             assert request is not None, "You have to pass either `data` or `request`"
@@ -242,13 +337,16 @@ class RestalchemyBase:
         if not isinstance(data, dict):
             raise InvalidJson("JSON data is not an object")
 
+        cls = type(self)
         writeable_attrs = self._get_writable_attributes(request, is_create, is_update)
         for k, v in data.items():
             if not hasattr(self, k):
                 raise AttributeNotFound(k)
             if k not in writeable_attrs:
                 raise AttributeReadOnly(k)
-            v = validate(v, getattr(type(self), k))
+            # Columns with a "set" listener get validated by `setattr` anyway
+            if (cls, k) not in validated_attributes:
+                v = validate(v, getattr(cls, k))
             setattr(self, k, v)
 
     def _reset(
@@ -273,21 +371,127 @@ class RestalchemyBase:
             setattr(self, attr, a)
 
 
-def set_get_model_function(config, get_model_fn):
+def changed_model_classes(session) -> Set[type]:
+    """Return all model classes (and their base classes) with changes in :param:`session`."""
+    classes: Set[type] = set()
+    for instance in [*session.new, *session.dirty, *session.deleted]:
+        classes.update(
+            cls for cls in type(instance).__mro__ if issubclass(cls, RestalchemyBase)
+        )
+    return classes
+
+
+def _mapped_classes(cls: type) -> Iterator[type]:
+    for subclass in cls.__subclasses__():
+        mapper = inspect(subclass, raiseerr=False)
+        if mapper is not None and mapper.class_ is subclass:
+            yield subclass
+        yield from _mapped_classes(subclass)
+
+
+class ModelRegistry:
+    """Resolves model names (as used in URLs, filters and expands) to model classes.
+
+    Without a get model function, the names are built from all mapped
+    subclasses of :class:`RestalchemyBase`: the table name, the snake case
+    class name and the class name.
+    The mapped classes are collected again after (new) mappers are configured
+    or when :meth:`refresh` is called.
+
+    With a get model function (see :func:`set_get_model_function`) only this
+    function decides which names are models. Its results are cached per request
+    or, if :attr:`cache_model_fn` is set, per name until :meth:`refresh` is called.
+    """
+
+    def __init__(self, get_model_fn: Callable = None, cache_model_fn: bool = False) -> None:
+        self.get_model_fn = get_model_fn
+        self.cache_model_fn = cache_model_fn
+        self.models: Optional[Dict[str, RestalchemyBase]] = None
+
+    def refresh(self) -> None:
+        """Forget all resolved names."""
+        self.models = None
+
+    def _build(self) -> Dict[str, RestalchemyBase]:
+        from .utils import camel_case_to_snake_case
+
+        models: Dict[str, RestalchemyBase] = {}
+        if self.get_model_fn is not None:
+            return models
+
+        classes = list(_mapped_classes(RestalchemyBase))
+        # Table names take precedence over class names if they collide and
+        # with single table inheritance the table name belongs to the base class
+        for Model in classes:
+            models.setdefault(inspect(Model).local_table.name, Model)
+        for Model in classes:
+            for name in (Model.__name__, camel_case_to_snake_case(Model.__name__)):
+                models.setdefault(name, Model)
+        return models
+
+    def get(self, request: Request, name: str) -> Optional[RestalchemyBase]:
+        models = self.models
+        if models is None:
+            models = self.models = self._build()
+        Model = models.get(name)
+        if Model is not None or self.get_model_fn is None:
+            return Model
+
+        # The get model function may depend on the request
+        if not self.cache_model_fn:
+            models = request.__dict__.setdefault("restalchemy_models", {})
+            if name in models:
+                return models[name]
+        Model = self.get_model_fn(request, name)
+        # Only cache models, not arbitrary names that aren't models
+        if Model is not None:
+            models[name] = Model
+        return Model
+
+
+def get_model(request: Request, name: str) -> Optional[RestalchemyBase]:
+    """Return the model class for :param:`name` or ``None`` if it's not a model."""
+    return request.registry.restalchemy_models.get(request, name)
+
+
+def set_get_model_function(config, get_model_fn, cache: bool = False):
     """Sets the get model function.
 
-    :param:`get_model_fn` is a function (can be dotted) that takes a string
-    and return the model class for it.
+    :param:`get_model_fn` is a function (can be dotted) that takes the request
+    and a string and return the model class for it.
+    The result for a name is cached per request. With :param:`cache` it's cached
+    for all requests, then it must not depend on the request.
 
     It should have this signature:
-    `get_model(name: str) -> Optional[RestalchemyBase]`
+    `get_model(request: Request, name: str) -> Optional[RestalchemyBase]`
     """
-    get_model_fn = config.maybe_dotted(get_model_fn)
+    registry: ModelRegistry = config.registry.restalchemy_models
+    registry.get_model_fn = config.maybe_dotted(get_model_fn)
+    registry.cache_model_fn = cache
+    registry.refresh()
 
-    config.add_request_method(
-        lambda r: partial(get_model_fn, r), "restalchemy_get_model", reify=True
-    )
+
+def set_count_estimate_function(config, count_estimate_fn):
+    """Sets the function used by the ``estimate`` count strategy.
+
+    :param:`count_estimate_fn` is a function (can be dotted) that takes the request
+    and the (filtered) query and returns an estimated row count,
+    e.g. from the query planner or table statistics.
+
+    It should have this signature:
+    `count_estimate(request: Request, query: Query) -> int`
+    """
+    config.registry.restalchemy.count_estimate_fn = config.maybe_dotted(count_estimate_fn)
 
 
 def includeme(config: Configurator):
+    registry = ModelRegistry()
+    config.registry.restalchemy_models = registry
+    _model_registries.add(registry)
+    config.add_request_method(
+        lambda r: partial(get_model, r), "restalchemy_get_model", reify=True
+    )
     config.add_directive("set_get_model_function", set_get_model_function, action_wrap=True)
+    config.add_directive(
+        "set_count_estimate_function", set_count_estimate_function, action_wrap=True
+    )
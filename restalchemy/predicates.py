@@ -4,6 +4,7 @@ from pyramid.config import Configurator
 class ModelPredicate:
     def __init__(self, val, config):
         self.val = val
+        self.names = val if isinstance(val, tuple) else (val,)
 
     def text(self):
         return "model = {}".format(self.val)
@@ -11,9 +12,11 @@ class ModelPredicate:
     phash = text
 
     def __call__(self, context, request):
-        if isinstance(self.val, tuple):
-            return request.matchdict.get("model_name") in self.val
-        return request.matchdict.get("model_name") == self.val
+        Model = request.matchdict.get("Model")
+        if Model is None:
+            return request.matchdict.get("model_name") in self.names
+        # Any name of the model (table name, class name, ...) matches
+        return any(request.restalchemy_get_model(name) is Model for name in self.names)
 
 
 class AttributePredicate:
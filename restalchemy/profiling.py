@@ -0,0 +1,251 @@
+"""RESTAlchemy request profiling.
+
+If the `profiling` setting is enabled, a tween records how long the phases of
+each request took:
+
+- `filters`: compiling and applying filters and sort keys
+- `sql`: fetching the rows of a list
+- `count`: counting the rows of a list
+- `serialize`: serializing the models (:func:`restalchemy.renderer.serialize_model`)
+- `json`: encoding the JSON response
+- `total`: the whole request
+
+and counts the fetched `rows`, serialized `objects` and `lazy_loads`
+(models loaded from the database while serializing).
+
+The timings are returned as `Server-Timing` header, logged as JSON to the
+`restalchemy.profiling` logger and aggregated per route and model.
+Streamed responses are serialized while they're sent, after the headers. Their
+`Server-Timing` header only has the timings until then (and a `streamed` entry),
+the complete timings are logged and aggregated when the response was sent.
+The p50 / p95 / p99 of the last `profiling_samples` requests per route and model
+are returned by `GET /{api_version}/_profiling`. Profiling is meant for
+development and staging, the endpoint is not protected.
+"""
+import json
+import logging
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Deque, Dict, Iterable, Iterator, Optional, Tuple
+
+from pyramid.config import Configurator
+from pyramid.request import Request
+from pyramid.response import Response
+from sqlalchemy import event
+from sqlalchemy.orm import Mapper
+
+from .response import ClosingAppIter, is_streamed
+
+log = logging.getLogger("restalchemy.profiling")
+
+PHASES = ("filters", "sql", "count", "serialize", "json", "total")
+
+# Profile of the request that's currently handled (for the SQLAlchemy `load` event)
+_current_profile: "ContextVar[Optional[Profile]]" = ContextVar(
+    "restalchemy_profile", default=None
+)
+_no_profile = nullcontext()
+
+
+class Profile:
+    """Phase timings (in seconds) and counts of a single request."""
+
+    def __init__(self) -> None:
+        self.phases: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+        # Name of the phase that's currently running
+        self.phase: Optional[str] = None
+
+    @contextmanager
+    def measure(self, phase: str):
+        parent, self.phase = self.phase, phase
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[phase] = self.phases.get(phase, 0.0) + time.perf_counter() - start
+            self.phase = parent
+
+    def count(self, name: str, n: int = 1) -> None:
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def server_timing(self) -> str:
+        """Return the timings as value for a `Server-Timing` header."""
+        timings = []
+        for phase, duration in self.phases.items():
+            timing = "{};dur={:.2f}".format(phase, duration * 1000)
+            if phase == "serialize":
+                timing += ';desc="{} objects, {} lazy loads"'.format(
+                    self.counts.get("objects", 0), self.counts.get("lazy_loads", 0)
+                )
+            elif phase == "sql":
+                timing += ';desc="{} rows"'.format(self.counts.get("rows", 0))
+            timings.append(timing)
+        return ", ".join(timings)
+
+
+def profile_phase(request: Optional[Request], phase: str):
+    """Return a context manager that adds its duration to :param:`phase` of the request profile.
+
+    Does nothing if profiling is disabled.
+    """
+    profile: Optional[Profile] = request and request.__dict__.get("restalchemy_profile")
+    if profile is None:
+        return _no_profile
+    return profile.measure(phase)
+
+
+def profile_count(request: Optional[Request], name: str, n: int = 1) -> None:
+    """Add :param:`n` to the count :param:`name` of the request profile.
+
+    Does nothing if profiling is disabled.
+    """
+    profile: Optional[Profile] = request and request.__dict__.get("restalchemy_profile")
+    if profile is not None:
+        profile.count(name, n)
+
+
+def _count_lazy_load(target, context) -> None:
+    profile = _current_profile.get()
+    if profile is not None and profile.phase == "serialize":
+        profile.count("lazy_loads")
+
+
+def percentile(values: list, p: float) -> float:
+    """Return the :param:`p` percentile (nearest rank) of the sorted :param:`values`."""
+    return values[min(len(values) - 1, max(0, int(round(p / 100 * len(values))) - 1))]
+
+
+class ProfileStats:
+    """Timings and counts of the last :attr:`max_samples` requests per route and model."""
+
+    def __init__(self, max_samples: int = 1000) -> None:
+        self.max_samples = max_samples
+        self.samples: Dict[Tuple[Optional[str], Optional[str]], Deque[Dict[str, float]]] = (
+            defaultdict(lambda: deque(maxlen=self.max_samples))
+        )
+
+    def add(self, route: Optional[str], model: Optional[str], profile: Profile) -> None:
+        self.samples[(route, model)].append({**profile.phases, **profile.counts})
+
+    def summary(self) -> list:
+        """Return p50, p95 and p99 of every phase (in ms) and count per route and model."""
+        summary = []
+        for (route, model), samples in list(self.samples.items()):
+            samples = list(samples)
+            names = sorted({name for sample in samples for name in sample})
+            values = {}
+            for name in names:
+                sorted_values = sorted(sample.get(name, 0) for sample in samples)
+                if name in PHASES:
+                    sorted_values = [v * 1000 for v in sorted_values]
+                values[name] = {
+                    "p" + str(p): round(percentile(sorted_values, p), 3) for p in (50, 95, 99)
+                }
+            summary.append(
+                {"route": route, "model": model, "requests": len(samples), "values": values}
+            )
+        return summary
+
+
+def _profiled_app_iter(app_iter: Iterable[bytes], profile: Profile) -> Iterator[bytes]:
+    """Iterate :param:`app_iter` with :param:`profile` as profile of the current request.
+
+    Closes :param:`app_iter` when it's closed itself.
+    """
+    iterator = iter(app_iter)
+    try:
+        while True:
+            token = _current_profile.set(profile)
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                _current_profile.reset(token)
+            yield chunk
+    finally:
+        close = getattr(app_iter, "close", None)
+        if close is not None:
+            close()
+
+
+def profiling_tween_factory(handler, registry):
+    stats: ProfileStats = registry.restalchemy_profile_stats
+
+    def record(request: Request, response: Response, profile: Profile, streamed: bool) -> None:
+        route = request.matched_route.name if request.matched_route else None
+        model = (request.matchdict or {}).get("model_name")
+        stats.add(route, model, profile)
+        log.info(
+            json.dumps(
+                {
+                    "method": request.method,
+                    "path": request.path,
+                    "route": route,
+                    "model": model,
+                    "status": response.status_code,
+                    "streamed": streamed,
+                    "phases": {k: round(v * 1000, 3) for k, v in profile.phases.items()},
+                    "counts": profile.counts,
+                }
+            )
+        )
+
+    def profiling_tween(request: Request) -> Response:
+        profile = request.restalchemy_profile = Profile()
+        start = time.perf_counter()
+        token = _current_profile.set(profile)
+        try:
+            with profile.measure("total"):
+                response = handler(request)
+        finally:
+            _current_profile.reset(token)
+
+        if request.matched_route and request.matched_route.name == "restalchemy.profiling":
+            return response
+
+        server_timing = profile.server_timing()
+        streamed = is_streamed(response)
+        if streamed:
+            # The body is serialized while it's sent, after the headers
+            server_timing += ', streamed;desc="timings until the body is sent are only logged"'
+        if "Server-Timing" in response.headers:
+            server_timing = response.headers["Server-Timing"] + ", " + server_timing
+        response.headers["Server-Timing"] = server_timing
+
+        if not streamed:
+            record(request, response, profile, False)
+            return response
+
+        def on_close(exhausted: bool) -> None:
+            profile.phases["total"] = time.perf_counter() - start
+            record(request, response, profile, True)
+
+        response.app_iter = ClosingAppIter(
+            _profiled_app_iter(response.app_iter, profile), on_close
+        )
+        return response
+
+    return profiling_tween
+
+
+def profiling_GET(request: Request) -> dict:
+    """Return the aggregated timings (in ms) and counts per route and model."""
+    return {"profiles": request.registry.restalchemy_profile_stats.summary()}
+
+
+def includeme(config: Configurator):
+    rest_config = config.registry.restalchemy
+    if not rest_config.profiling:
+        return
+
+    config.registry.restalchemy_profile_stats = ProfileStats(rest_config.profiling_samples)
+    if not event.contains(Mapper, "load", _count_lazy_load):
+        event.listen(Mapper, "load", _count_lazy_load)
+
+    config.add_tween("restalchemy.profiling.profiling_tween_factory")
+    config.add_route("restalchemy.profiling", "/_profiling")
+    config.add_view(profiling_GET, request_method="GET", route_name="restalchemy.profiling")
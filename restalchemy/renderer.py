@@ -1,28 +1,35 @@
 import enum
+import inspect as pyinspect
 from datetime import datetime
-from typing import Optional
+from functools import lru_cache
+from typing import FrozenSet, Iterator, NamedTuple, Optional, Tuple, Union
 
 import rapidjson
 from pyramid.config import Configurator
 from pyramid.renderers import RendererHelper
 from pyramid.request import Request
-from sqlalchemy import inspect
+from sqlalchemy import event, inspect
 from sqlalchemy.ext.associationproxy import _AssociationList
+from sqlalchemy.orm import Mapper
 from sqlalchemy.orm.collections import InstrumentedList
 
-from .model import RestalchemyBase
-from .response import RestResponse
+from .lazyload import check_lazy_load, get_lazy_loads
+from .model import SQLALCHEMY_ATTRIBUTES, RestalchemyBase
+from .profiling import profile_count, profile_phase
+from .response import QueryStream, RestResponse
 
 
 def get_expand(request: Request, model, expand=None) -> list:
+    """Return the attributes to expand for :param:`model` (an instance or model class)."""
     if expand is None:
         expand = []
+    Model = model if isinstance(model, type) else model.__class__
     model_expand = []
     # make copy of expand so expand.extend with the model.__json_expand__ attributes
     # doesn't alter request.expand (passed in as argument)
     # also filter expand to only expand the root level or explicitly specified with a dot.
     for exp in expand:
-        if model.__class__ == request.matchdict.get("Model"):
+        if Model == request.matchdict.get("Model"):
             if "." not in exp:
                 # we're in the root level and no '.' in expand.
                 model_expand.append(exp)
@@ -30,12 +37,41 @@ def get_expand(request: Request, model, expand=None) -> list:
             # we're in a sub-level model
             if "." in exp:
                 model_name, attr = exp.split(".", 1)
-                if request.restalchemy_get_model(model_name) == model.__class__:
+                if request.restalchemy_get_model(model_name) == Model:
                     model_expand.append(attr)
 
     return model_expand + getattr(model, "__json_expand__", [])
 
 
+def get_model_fields(request: Request, Model) -> Optional[Tuple[str, ...]]:
+    """Return the attributes requested with `fields` for :param:`Model` or ``None`` for all."""
+    fields = getattr(request, "fields", None)
+    if not fields:
+        return None
+    for model_name, attributes in fields.items():
+        if model_name == "":
+            if Model == request.matchdict.get("Model"):
+                return attributes
+        elif request.restalchemy_get_model(model_name) == Model:
+            return attributes
+    return None
+
+
+def get_list_exclude(request: Request, Model) -> Optional[Tuple[str, ...]]:
+    """Return the `__json_list_exclude__` attributes if :param:`Model` is returned as list.
+
+    They're only excluded from the list of the requested model (not for a
+    single resource) and if the attributes are not explicitly requested with `fields`.
+    """
+    list_exclude = getattr(Model, "__json_list_exclude__", None)
+    if not list_exclude or request is None or get_model_fields(request, Model) is not None:
+        return None
+    matchdict = request.matchdict or {}
+    if Model != matchdict.get("Model") or "id" in matchdict:
+        return None
+    return tuple(list_exclude)
+
+
 def get_attributes(
     request: Request, model, include=None, exclude=None, private=None, expand=None
 ) -> list:
@@ -43,11 +79,11 @@ def get_attributes(
         include = getattr(
             model,
             "__json_include__",
-            # By default don't show fields starting with '_', 'validate' or `metadata`
+            # By default don't show fields starting with '_', 'validate' or `metadata`/`registry`
             [
                 f
                 for f in dir(model)
-                if not (f.startswith("_") or f.startswith("validate_") or f == "metadata")
+                if not (f.startswith("_") or f.startswith("validate_") or f in SQLALCHEMY_ATTRIBUTES)
             ],
         )
 
@@ -66,34 +102,173 @@ def get_attributes(
     return [a for a in include if a not in exclude]
 
 
+class PlanEntry(NamedTuple):
+    attr: str
+    is_relationship: bool
+    expanded: bool
+    return_hook: Optional[str]
+
+
+class SerializationPlan(NamedTuple):
+    entries: Tuple[PlanEntry, ...]
+    has_show_attribute: bool
+    # All attributes of the class (to find attributes that are only set on an instance)
+    # or ``None`` if the attributes are fixed (e.g. by `__json_include__`)
+    class_attributes: Optional[FrozenSet[str]]
+    # Attributes that are never returned (excluded, private or not in `fields`)
+    hidden: FrozenSet[str]
+    fields: Optional[Tuple[str, ...]]
+
+
+def _freeze(attributes) -> Optional[tuple]:
+    return None if attributes is None else tuple(attributes)
+
+
+@lru_cache(maxsize=1024)
+def get_serialization_plan(
+    Model, expand: tuple, include=None, exclude=None, private=None, fields=None, list_exclude=None
+) -> SerializationPlan:
+    """Return the (cached) serialization plan for :param:`Model`.
+
+    The plan holds the ordered list of attributes to render together with
+    everything about them that only depends on the model class, so that
+    :func:`serialize_model` doesn't have to run ``dir()`` and look up hooks
+    for every single row.
+    Public attributes that are only set on an instance (e.g. in `__after_get__`)
+    are still returned, :func:`serialize_model` adds them per row.
+    The cache is cleared whenever SQLAlchemy (re)configures its mappers.
+    """
+    attributes = get_attributes(
+        None,
+        Model,
+        include,
+        None if exclude is None else list(exclude),
+        None if private is None else list(private),
+        expand,
+    )
+    class_attributes = None
+    if include is None and not hasattr(Model, "__json_include__"):
+        class_attributes = frozenset(dir(Model))
+    # Excluded and private attributes (to hide attributes that are only set on instances)
+    hidden = {*(exclude or ()), *(private or ()), *getattr(Model, "__json_private__", ())}
+    hidden.update(e for e in getattr(Model, "__json_exclude__", ()) if e not in expand)
+    if fields is not None:
+        # Sparse fieldsets only restrict the attributes, private ones are still hidden
+        attributes = [a for a in attributes if a in fields]
+    if list_exclude is not None:
+        attributes = [a for a in attributes if a not in list_exclude or a in expand]
+        hidden.update(a for a in list_exclude if a not in expand)
+    relationships = inspect(Model).relationships
+
+    entries = []
+    for attr in attributes:
+        return_hook = "__json_return_{}__".format(attr)
+        if not hasattr(Model, return_hook):
+            return_hook = None
+            # Methods defined on models are never serialized (unless they have a return hook)
+            if pyinspect.isroutine(pyinspect.getattr_static(Model, attr, None)):
+                continue
+        entries.append(PlanEntry(attr, attr in relationships, attr in expand, return_hook))
+
+    return SerializationPlan(
+        tuple(entries),
+        hasattr(Model, "__json_show_attribute__"),
+        class_attributes,
+        frozenset(hidden),
+        fields,
+    )
+
+
+def _instance_entries(plan: SerializationPlan, model) -> Tuple[PlanEntry, ...]:
+    """Return the plan entries plus the public attributes only set on :param:`model`.
+
+    E.g. an attribute that's set in `__after_get__`.
+    """
+    extra = [
+        attr
+        for attr in model.__dict__
+        if attr not in plan.class_attributes
+        and not (attr.startswith("_") or attr.startswith("validate_") or attr in SQLALCHEMY_ATTRIBUTES)
+        and attr not in plan.hidden
+        and (plan.fields is None or attr in plan.fields)
+    ]
+    if not extra:
+        return plan.entries
+    Model = model.__class__
+    entries = list(plan.entries)
+    for attr in extra:
+        return_hook = "__json_return_{}__".format(attr)
+        entries.append(
+            PlanEntry(attr, False, False, return_hook if hasattr(Model, return_hook) else None)
+        )
+    # Same order as `dir()`
+    return tuple(sorted(entries, key=lambda entry: entry.attr))
+
+
+@event.listens_for(Mapper, "after_configured")
+def _clear_serialization_plans():
+    get_serialization_plan.cache_clear()
+
+
+def _get_plan(
+    request: Optional[Request], Model, expand, include, exclude, private
+) -> Tuple[list, SerializationPlan]:
+    """Return the expanded attributes and the serialization plan for :param:`Model`.
+
+    Both only depend on the request (not on the row), so they're
+    remembered for all rows of a request.
+    """
+    key = (Model, _freeze(expand), _freeze(include), _freeze(exclude), _freeze(private))
+    plans = request.__dict__.setdefault("restalchemy_serialization_plans", {}) if request else {}
+    cached = plans.get(key)
+    if cached is None:
+        model_expand = get_expand(request, Model, expand)
+        plan = get_serialization_plan(
+            Model,
+            tuple(model_expand),
+            key[2],
+            key[3],
+            key[4],
+            get_model_fields(request, Model) if request else None,
+            get_list_exclude(request, Model),
+        )
+        cached = plans[key] = (model_expand, plan)
+    return cached
+
+
 def serialize_model(
     request: Request, model, include=None, exclude=None, private=None, expand=None, depth=0
 ):
+    """Return :param:`model` as dict that can be serialized to json.
+
+    Only the attributes requested with `fields` (see :func:`get_model_fields`) are returned.
     """
-    FIXME: rename expand to `include`. Instead of attributes do `fields[users]=name`
-    """
-    expand = get_expand(request, model, expand)
-    attributes = get_attributes(request, model, include, exclude, private, expand)
+    profile_count(request, "objects")
+    expand, plan = _get_plan(request, model.__class__, expand, include, exclude, private)
+    show_attribute = request and plan.has_show_attribute
+    lazy_loads = get_lazy_loads(request)
+    entries = plan.entries
+    if plan.class_attributes is not None:
+        entries = _instance_entries(plan, model)
 
     res = {}
-    i = inspect(model)
-    for attr in attributes:
+    for attr, is_relationship, expanded, return_hook in entries:
         # If depth is 0 and it's a relationship do nothing since
         # only accessing the attribute could trigger a SQL query
-        if depth == 0 and attr not in expand and attr in i.mapper.relationships:
-            # Check that attr is a relationship and not a synonym.
+        if depth == 0 and is_relationship and not expanded:
             continue
 
-        if request and hasattr(model, "__json_show_attribute__"):
-            if not model.__json_show_attribute__(request, attr):
-                continue
-        if request and hasattr(model, "__json_return_{}__".format(attr)):
-            val = getattr(model, "__json_return_{}__".format(attr))(request)
+        if show_attribute and not model.__json_show_attribute__(request, attr):
+            continue
+        if request and return_hook:
+            val = getattr(model, return_hook)(request)
         else:
+            if lazy_loads is not None and is_relationship:
+                check_lazy_load(request, model, attr)
             val = getattr(model, attr)
 
         # expand objects have same depth as original model
-        if attr in expand:
+        if expanded:
             expand_depth = depth
         else:
             expand_depth = depth - 1
@@ -109,7 +284,7 @@ def serialize_model(
             and len(val) > 0
             and isinstance(val[0], RestalchemyBase)
         ):
-            if depth > 1 or not hasattr(val[0], "id") or attr in expand:
+            if depth > 1 or not hasattr(val[0], "id") or expanded:
                 val = [
                     serialize_model(request, v, include, exclude, private, expand, expand_depth)
                     for v in val
@@ -119,7 +294,7 @@ def serialize_model(
             else:
                 continue  # don't return relations for depth == 0
         elif isinstance(val, RestalchemyBase):
-            if depth > 1 or not hasattr(val, "id") or attr in expand:
+            if depth > 1 or not hasattr(val, "id") or expanded:
                 val = serialize_model(request, val, include, exclude, private, expand, expand_depth)
             elif depth == 1:
                 val = val.id  # type: ignore
@@ -137,7 +312,7 @@ def serialize_response(request, value):
     if isinstance(value, list) or isinstance(value, set):
         return [serialize_response(request, v) for v in value]
     if isinstance(value, RestalchemyBase):
-        return serialize_model(request, value)
+        return serialize_model(request, value, expand=getattr(request, "include", None))
     if isinstance(value, RestResponse):
         return serialize_response(request, value.resource)
     return value
@@ -158,13 +333,16 @@ class ApiRenderer:
         # print('settings', info.settings)
         self.settings = info.settings
 
-    def __call__(self, value, system: dict) -> str:
+    def __call__(self, value, system: dict) -> Union[str, Iterator[bytes]]:
         """Call the renderer implementation with the value
         and the system value passed in as arguments and return
         the result (a string or unicode object).  The value is
         the return value of a view.  The system value is a
         dictionary containing available system values
-        (e.g., view, context, and request)."""
+        (e.g., view, context, and request).
+
+        A :class:`RestResponse` with a :class:`QueryStream` as resource is rendered
+        as iterator that's used as `app_iter` for the response."""
         request: Optional[Request] = system.get("request")
         name = "json"
         if request is not None:
@@ -183,14 +361,59 @@ class ApiRenderer:
             name = value.__single_resource_name__(request)
         elif isinstance(value, RestResponse):
             name = value.name
-            r = {**r, **value.return_info}
+            if isinstance(value.resource, QueryStream):
+                return stream_response(request, r, value)
 
-        resp = serialize_response(request, value)
+        with profile_phase(request, "serialize"):
+            resp = serialize_response(request, value)
+        if isinstance(value, RestResponse):
+            r = {**r, **get_return_info(value)}
 
         r["resource"] = name
         r[name] = resp
 
-        return dumps(r)
+        with profile_phase(request, "json"):
+            return dumps(r)
+
+
+def get_return_info(value: RestResponse) -> dict:
+    if callable(value.return_info):
+        return value.return_info()
+    return value.return_info
+
+
+def stream_response(request: Request, envelope: dict, value: RestResponse) -> Iterator[bytes]:
+    """Render :param:`value` piece by piece.
+
+    First the :param:`envelope` (`success`, `timestamp` and `resource`),
+    then the rows of the :class:`QueryStream` in chunks as they're
+    fetched from the database and last the return info
+    (which can depend on the rows, e.g. the `next` link).
+    """
+    stream: QueryStream = value.resource  # type: ignore
+    head = dumps({**envelope, "resource": value.name})
+    yield (head[:-1] + "," + dumps(value.name) + ":[").encode()
+
+    separator = ""
+    chunk = []
+    for row in stream:
+        profile_count(request, "rows")
+        with profile_phase(request, "serialize"):
+            data = serialize_response(request, row)
+        with profile_phase(request, "json"):
+            chunk.append(dumps(data))
+        if len(chunk) >= stream.chunk_size:
+            yield (separator + ",".join(chunk)).encode()
+            separator = ","
+            chunk = []
+    if chunk:
+        yield (separator + ",".join(chunk)).encode()
+
+    info = get_return_info(value)
+    if info:
+        yield ("]," + dumps(info)[1:]).encode()
+    else:
+        yield b"]}"
 
 
 def _json_dumps_default(obj):
@@ -1,74 +1,194 @@
+"""RESTAlchemy request parameters.
+
+The query parameters are parsed lazily with reified request properties
+(i.g. `request.limit`), so they're only checked and converted when a view
+uses them and not for every request of the app (i.g. `/login` or CORS preflights).
+"""
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
 from pyramid.config import Configurator
-from pyramid.events import NewRequest
 from pyramid.request import Request
 
 from . import RestalchemyConfig
 from .exceptions import BadRequest, ParamWrong
 
+# Query parameters that are not filters (besides `fields[{model}]`)
+RESERVED_PARAMS = ("limit", "offset", "include", "sort", "after", "count", "fields")
+
+
+class Filter(NamedTuple):
+    """A parsed filter query parameter, i.g. `user.name!=foo,bar`."""
+
+    # Attribute name, prefixed with up to 2 model names (i.g. `("user", "name")`)
+    path: Tuple[str, ...]
+    # "==", "!=", "<=" or ">="
+    operator: str
+    # Comma separated values, a single `null` value is `None`
+    values: Tuple[Optional[str], ...]
+
+
+class Sort(NamedTuple):
+    """A parsed sort key, i.g. `-created_at` or `user.name.desc`."""
+
+    # Attribute name, prefixed with up to 2 model names (i.g. `("user", "name")`)
+    path: Tuple[str, ...]
+    descending: bool
+
+
+def parse_sort(sort: Optional[str]) -> List[Sort]:
+    """Return the :class:`Sort` keys of the comma separated :param:`sort` parameter.
 
-def check_params(event: NewRequest):
-    """Checks that the request parameters are the right type for the
-    model query (i.g. type(request.params['limit']) == int)
-    and sets the params directly as request attribute (i.g. request.limit)
+    Keys are sorted descending when they start with `-` or end with `.desc`.
     """
-    request: Request = event.request
-    rest_conf: RestalchemyConfig = request.registry.restalchemy
-    params: dict = request.params
+    sorts = []
+    for key in (sort or "").split(","):
+        key = key.strip()
+        if not key:
+            continue
+        descending = key.startswith("-")
+        key = key.lstrip("-")
+        if key.endswith(".desc"):
+            descending, key = True, key[: -len(".desc")]
+        elif key.endswith(".asc"):
+            descending, key = False, key[: -len(".asc")]
+        sorts.append(Sort(tuple(key.split(".", 2)), descending))
+    return sorts
+
+
+def parse_filter(filter_by: str, value: str) -> Filter:
+    """Return the :class:`Filter` for the query parameter :param:`filter_by`=:param:`value`."""
+    operator = {"!": "!=", "<": "<=", ">": ">="}.get(filter_by[-1:], "==")
+    filter_by = filter_by.rstrip("!<>")
+
+    # When a filter ends with an underscore, simply ignore it.
+    # Appending '_' is allowed to avoid a conflict with a reserved word like
+    # 'limit' or 'offset' etc.
+    if filter_by.endswith("_"):
+        filter_by = filter_by[:-1]
+
+    if not isinstance(value, str):
+        values: Tuple[Optional[str], ...] = (value,)
+    elif value.lower() == "null":
+        values = (None,)
+    else:
+        values = tuple(value.split(","))
 
+    return Filter(tuple(filter_by.split(".", 2)), operator, values)
+
+
+def get_params(request: Request):
+    """Return the query parameters or raise :class:`BadRequest` if they can't be decoded."""
     try:
-        request.sort = params.get("sort")
+        return request.params
     except (TypeError, UnicodeDecodeError):
         # WebOb / pyramid has problems with non standard confirm (i.i. non utf-8 encoded)
         # query params or wrong missing Content-Type headers
         # see: https://github.com/Pylons/webob/issues/161
         raise BadRequest()
 
+
+def get_sort(request: Request) -> Optional[str]:
+    return get_params(request).get("sort")
+
+
+def get_sorts(request: Request) -> List[Sort]:
+    """Return the parsed sort keys of :func:`get_sort`."""
+    return parse_sort(request.sort)
+
+
+def get_offset(request: Request) -> int:
     try:
-        request.offset = int(params.get("offset", 0))
-        if request.offset < 0:
+        offset = int(get_params(request).get("offset", 0))
+        if offset < 0:
             raise ValueError
     except ValueError:
         raise ParamWrong("`offset` must be a number >= 0")
+    return offset
+
+
+def get_limit(request: Request) -> int:
+    rest_conf: RestalchemyConfig = request.registry.restalchemy
     try:
-        request.limit = min(
-            int(params.get("limit", rest_conf.default_limit)), int(rest_conf.max_limit)
+        limit = min(
+            int(get_params(request).get("limit", rest_conf.default_limit)),
+            int(rest_conf.max_limit),
         )
-        if request.limit <= 0:
+        if limit <= 0:
             raise ValueError
     except ValueError:
         raise ParamWrong("`limit` must be a number > 0")
-    # request.depth = int(request.registry.settings.get('default_result_depth'))
-    # if 'depth' in params:
-    #     try:
-    #         request.depth = int(params.get('depth'))
-    #     except ValueError:
-    #         raise ParamWrong('`depth` must be an integer value')
-
-    # FIXME: do fields[user]=name,!email
-    # request.include = []
-    # request.exclude = []
-    # if params.get('attributes'):
-    #     request.attributes = []
-    #     for attr in params.get('attributes').split(','):
-    #         attr = attr.strip()
-    #         if attr.startswith('!'):
-    #             request.exclude.append(attr.lstrip('!'))
-    #         else:
-    #             request.attributes.append(attr)
-    # request.attributes = request.attributes
-
-    request.search = params.get("search")
-
-    request.filter = [
-        (k, v) for k, v in params.items() if k not in ["limit", "offset", "include", "sort"]
+    return limit
+
+
+def get_count(request: Request) -> bool:
+    count = get_params(request).get("count", "true").lower()
+    if count not in ("true", "false"):
+        raise ParamWrong("`count` must be either `true` or `false`")
+    return count == "true"
+
+
+def get_after(request: Request) -> Optional[str]:
+    # Opaque cursor for keyset pagination (decoded in `query_models`)
+    return get_params(request).get("after")
+
+
+def get_search(request: Request) -> Optional[str]:
+    return get_params(request).get("search")
+
+
+def get_filter(request: Request) -> List[Tuple[str, str]]:
+    """Return all query parameters that are filters as `(name, value)` tuples."""
+    return [
+        (k, v)
+        for k, v in get_params(request).items()
+        if k not in RESERVED_PARAMS and not k.startswith("fields[")
     ]
 
-    # Get relationships to include
+
+def get_filters(request: Request) -> List[Filter]:
+    """Return the parsed filters of :func:`get_filter`."""
+    return [parse_filter(k, v) for k, v in request.filter]
+
+
+def get_include(request: Request) -> List[str]:
+    """Return the relationships to include."""
     # FIXME: add model?
-    request.include = []
-    if "include" in params:
-        request.include = [i.strip() for i in params.get("include").split(",") if i.strip()]
+    include = get_params(request).get("include")
+    if include is None:
+        return []
+    return [i.strip() for i in include.split(",") if i.strip()]
+
+
+def get_fields(request: Request) -> Dict[str, Tuple[str, ...]]:
+    """Return the attributes to return per model name.
+
+    `fields=id,name` is for the requested model (with the empty model name) and
+    `fields[user]=name,email` for the (expanded) `user` model.
+    """
+    fields = {}
+    for k, v in get_params(request).items():
+        if k == "fields":
+            model_name = ""
+        elif k.startswith("fields[") and k.endswith("]"):
+            model_name = k[len("fields[") : -1]
+        else:
+            continue
+        fields[model_name] = tuple(f.strip() for f in v.split(",") if f.strip())
+    return fields
 
 
 def includeme(config: Configurator):
-    config.add_subscriber(check_params, NewRequest)
+    for name, fn in (
+        ("sort", get_sort),
+        ("sorts", get_sorts),
+        ("offset", get_offset),
+        ("limit", get_limit),
+        ("count", get_count),
+        ("after", get_after),
+        ("search", get_search),
+        ("filter", get_filter),
+        ("filters", get_filters),
+        ("include", get_include),
+        ("fields", get_fields),
+    ):
+        config.add_request_method(fn, name, reify=True)
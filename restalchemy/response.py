@@ -1,12 +1,75 @@
 from pyramid.response import Response as PyramidResponse
 
-from typing import NamedTuple
+from typing import Callable, Iterable, Iterator, NamedTuple, Union
+
+from sqlalchemy.orm.query import Query
 
 
 class RestResponse(NamedTuple):
     name: str
     resource: list
-    return_info: dict
+    # Can be a function for info that's only known after `resource` got rendered
+    return_info: Union[dict, Callable[[], dict]]
+
+
+class QueryStream:
+    """Lazy iterator over the rows of a list query.
+
+    Rows are fetched from the database in chunks of :param:`chunk_size`
+    (see `Query.yield_per`) while they are rendered, so they never
+    have to be in memory all at once.
+    The query should be limited to :param:`limit` + 1 rows.
+    `has_more` and `last` are only known after the iterator is exhausted.
+    """
+
+    def __init__(self, query: Query, limit: int = None, chunk_size: int = 100) -> None:
+        self.query = query
+        self.limit = limit
+        self.chunk_size = chunk_size
+        self.has_more = False
+        self.last = None
+
+    def __iter__(self):
+        for i, row in enumerate(self.query.yield_per(self.chunk_size)):
+            if self.limit and i >= self.limit:
+                self.has_more = True
+                break
+            self.last = row
+            yield row
+
+
+def is_streamed(response: PyramidResponse) -> bool:
+    """Return ``True`` if the body of :param:`response` is generated while it's sent."""
+    return not isinstance(response.app_iter, (list, tuple))
+
+
+class ClosingAppIter:
+    """Wraps the `app_iter` of a streamed response and calls :param:`on_close`
+    when the server closes it (after the body was sent or the client went away).
+
+    :param:`on_close` gets ``True`` if the body was sent completely.
+    """
+
+    def __init__(self, app_iter: Iterable[bytes], on_close: Callable[[bool], None]) -> None:
+        self.app_iter = app_iter
+        self.on_close = on_close
+        self.exhausted = False
+        self.closed = False
+
+    def __iter__(self) -> Iterator[bytes]:
+        yield from self.app_iter
+        self.exhausted = True
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            close = getattr(self.app_iter, "close", None)
+            if close is not None:
+                close()
+        finally:
+            self.on_close(self.exhausted)
 
 
 class Response(PyramidResponse):
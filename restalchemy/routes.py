@@ -6,10 +6,10 @@ from .exceptions import ResourceNotFound
 
 def is_model(info: dict, request: Request):
     """Custom route predicate that checks that the model path is an actual model.
-    To verify the model name, the function that was set during configuration
-    with `config.set_get_model_function` is called.
+    The model name is resolved with the model registry
+    (see :class:`restalchemy.model.ModelRegistry`).
     If it is a valid model, add a "Model" key to the match dictionary with the
-    return value of this function.
+    model class.
     """
     match = info["match"]
     Model = request.restalchemy_get_model(match["model_name"])
@@ -32,4 +32,15 @@ def includeme(config: Configurator):
         custom_predicates=(is_model,),
     )
     config.add_route("restalchemy.model", r"/{model_name}/{id:\d+}", custom_predicates=(is_model,))
+    config.add_route(
+        "restalchemy.models.batch",
+        r"/{model_name}/{ids:\d+(?:,\d+)+}",
+        custom_predicates=(is_model,),
+    )
+    config.add_route(
+        "restalchemy.models.bulk", "/{model_name}/_bulk", custom_predicates=(is_model,)
+    )
+    config.add_route(
+        "restalchemy.models.ndjson", "/{model_name}.ndjson", custom_predicates=(is_model,)
+    )
     config.add_route("restalchemy.models", "/{model_name}", custom_predicates=(is_model,))
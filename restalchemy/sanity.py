@@ -28,7 +28,11 @@ def check_json(request):
             rjson = request.json
         except JSONDecodeError:
             raise InvalidJson
-        if not isinstance(rjson, dict):
+        # Bulk endpoints take a list of objects
+        if request.path_info.endswith("/_bulk"):
+            if not isinstance(rjson, list):
+                raise InvalidJson("JSON data is not a list")
+        elif not isinstance(rjson, dict):
             raise InvalidJson("JSON data is not an object")
 
 
@@ -1,132 +1,362 @@
-from typing import Any, List, Optional, Tuple
+import base64
+import binascii
+from typing import List, NamedTuple, Optional, Tuple, Union
 
+import rapidjson
 from pyramid.request import Request
-from sqlalchemy import distinct, func
-from sqlalchemy.exc import InvalidRequestError
-from sqlalchemy.orm import aliased
+from sqlalchemy import and_, distinct, func, inspect, or_
+from sqlalchemy.orm import (
+    ColumnProperty,
+    RelationshipProperty,
+    defer,
+    joinedload,
+    load_only,
+    selectinload,
+)
 from sqlalchemy.orm.attributes import InstrumentedAttribute
+from sqlalchemy.orm.base import MANYTOONE
 from sqlalchemy.orm.query import Query
 
-from .exceptions import AttributeNotFound, AttributeWrong, FilterInvalid
+from .exceptions import AttributeNotFound, ParamWrong
+from .filters import apply_filters, resolve_path
 from .model import RestalchemyBase
+from .profiling import profile_count, profile_phase
+from .renderer import (
+    dumps,
+    get_expand,
+    get_list_exclude,
+    get_model_fields,
+    get_serialization_plan,
+)
+from .request import Filter, parse_filter, parse_sort
+from .response import QueryStream
 from .validators import validate
 
+# Columns (and if they're sorted descending) that make up a pagination cursor
+KeysetColumns = List[Tuple[InstrumentedAttribute, bool]]
+
+# Dialects that sort `NULL` before all other values (in ascending order)
+NULLS_FIRST_DIALECTS = {"sqlite", "mysql", "mssql"}
+
+
+class QueryResult(NamedTuple):
+    result: Union[List[RestalchemyBase], QueryStream]
+    count: Optional[int]
+    count_strategy: str
+    # `None` for a `QueryStream` result, use `QueryStream.has_more` after iterating it
+    has_more: Optional[bool]
+
 
 def sort_query(request: Request, Model: RestalchemyBase, query: Query, sort: str) -> Query:
     """Return a query with sorting applied.
 
     Take :param:`query` for model :param:`Model` and return a new query
     with :param:`sort` parameters applied.
+    :param:`sort` is a comma separated list of (optionally dotted) attributes,
+    prefixed with `-` (or suffixed with `.desc`) to sort descending,
+    e.g. ``name,-created_at,user.name``.
     """
-    return query
+    return apply_filters(request, query, Model, [], parse_sort(sort))
+
+
+def get_loader_options(
+    request: Request,
+    Model: RestalchemyBase,
+    expand: list = None,
+    depth: int = 0,
+    _loader=None,
+    _path: tuple = (),
+) -> list:
+    """Return eager loading options for all relationships :func:`serialize_model` will access.
+
+    It follows the same rules as the serializer (:param:`expand`, `__json_expand__`,
+    `__json_exclude__`, :param:`depth`, ...) so that rendering a list of models
+    doesn't lazy load the relationships of every single row.
+    Many-to-one relationships are loaded with a ``JOIN`` (`joinedload`) and
+    one-to-many and many-to-many relationships with a second
+    ``SELECT ... WHERE id IN (...)`` (`selectinload`).
+    """
+    expand = get_expand(request, Model, expand)
+    plan = get_serialization_plan(
+        Model,
+        tuple(expand),
+        fields=get_model_fields(request, Model),
+        list_exclude=get_list_exclude(request, Model),
+    )
+    relationships = inspect(Model).relationships
+
+    options = []
+    for attr, is_relationship, expanded, return_hook in plan.entries:
+        if not is_relationship or return_hook or not (expanded or depth > 0):
+            continue
+        relationship = relationships[attr]
+        # Don't follow relationships back to where we came from
+        if relationship.lazy == "dynamic" or relationship in _path:
+            continue
+
+        if relationship.direction == MANYTOONE:
+            loader = _loader.joinedload if _loader is not None else joinedload
+        else:
+            loader = _loader.selectinload if _loader is not None else selectinload
+        option = loader(getattr(Model, attr))
+        options.append(option)
+        load_only_attributes = get_load_only_attributes(request, relationship.mapper.class_)
+        if load_only_attributes is not None:
+            options.append(option.load_only(*load_only_attributes))
+
+        # Related models are serialized as well (and not only their IDs)
+        if expanded or depth > 1:
+            nested_depth = depth if expanded else depth - 1
+            options += get_loader_options(
+                request,
+                relationship.mapper.class_,
+                expand,
+                nested_depth,
+                option,
+                _path + (relationship,),
+            )
+
+    return options
+
+
+def get_load_only_attributes(request: Request, Model: RestalchemyBase) -> Optional[list]:
+    """Return the column attributes to load for the `fields` of :param:`Model`.
+
+    Returns ``None`` (load all columns) without `fields` or if a field is
+    not a column or relationship (e.g. a property or hybrid attribute),
+    because it's unknown which columns it needs.
+    The primary key is always loaded by SQLAlchemy.
+    """
+    fields = get_model_fields(request, Model)
+    if fields is None:
+        return None
+
+    mapper = inspect(Model)
+    attributes = set()
+    for field in fields:
+        prop = mapper.attrs.get(field)
+        if prop is None:
+            if hasattr(Model, field):
+                return None
+            continue  # Unknown fields are just not returned
+        if isinstance(prop, ColumnProperty):
+            attributes.add(field)
+        elif isinstance(prop, RelationshipProperty):
+            # Foreign keys so the related model can be loaded without loading the column first
+            attributes.update(
+                mapper.get_property_by_column(column).key for column in prop.local_columns
+            )
+        else:
+            return None
+
+    # The version for the `ETag` and the sort keys for a pagination cursor
+    version_attribute = getattr(Model, "__version_attribute__", None)
+    if version_attribute is not None:
+        attributes.add(version_attribute)
+    if Model == request.matchdict.get("Model"):
+        attributes.update(s.path[0] for s in request.sorts if len(s.path) == 1)
+    return [a for a in attributes if a in mapper.column_attrs]
+
+
+def get_column_options(request: Request, Model: RestalchemyBase) -> list:
+    """Return the options to only load the columns of a list of :param:`Model` that are returned.
+
+    These are the `fields` (see :func:`get_load_only_attributes`)
+    or all columns except the `__json_list_exclude__` ones.
+    """
+    load_only_attributes = get_load_only_attributes(request, Model)
+    if load_only_attributes is not None:
+        return [load_only(*load_only_attributes)]
+    # Large columns that are not needed in lists
+    column_attrs = inspect(Model).column_attrs
+    return [defer(attr) for attr in get_list_exclude(request, Model) or () if attr in column_attrs]
+
+
+def get_pagination(request: Request, Model: RestalchemyBase) -> str:
+    """Return the pagination mode (``"offset"`` or ``"cursor"``) for :param:`Model`.
+
+    Models can overwrite the `pagination` setting from the restalchemy config
+    with a `__pagination__` attribute.
+    """
+    return getattr(Model, "__pagination__", request.registry.restalchemy.pagination)
+
+
+def get_keyset_columns(
+    request: Request, Model: RestalchemyBase, sort: str = None
+) -> KeysetColumns:
+    """Return the columns a cursor for :param:`Model` is made of.
+
+    These are the attributes of :param:`sort` (or `request.sort`).
+    Each entry is a tuple of the column and ``True`` if it's sorted descending.
+    The last column is always `Model.id` so that the keyset is unique.
+    """
+    if not hasattr(Model, "id"):
+        raise ParamWrong("`after` is not supported for this resource")
+
+    columns: KeysetColumns = []
+    for key in request.sorts if sort is None else parse_sort(sort):
+        models, model_name, attribute = resolve_path(request, Model, key.path)
+        if models:
+            raise ParamWrong("`after` can't be used when sorting by other resources")
+        column = getattr(Model, attribute, None)
+        if column is None:
+            raise AttributeNotFound(attribute)
+        columns.append((column, key.descending))
+        if attribute == "id":
+            return columns
+    columns.append((Model.id, False))  # type: ignore
+    return columns
+
+
+def encode_cursor(model: RestalchemyBase, columns: KeysetColumns) -> str:
+    """Return an opaque cursor that points after :param:`model`."""
+    values = [getattr(model, column.key) for column, _ in columns]
+    return base64.urlsafe_b64encode(dumps(values).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, columns: KeysetColumns) -> list:
+    """Return the (validated) column values from :param:`cursor`."""
+    try:
+        values = rapidjson.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, ValueError):
+        raise ParamWrong("`after` is not a valid cursor")
+    if not isinstance(values, list) or len(values) != len(columns):
+        raise ParamWrong("`after` is not a valid cursor")
+    return [validate(value, column) for (column, _), value in zip(columns, values)]
+
+
+def _nulls_first(query: Query, Model: RestalchemyBase) -> bool:
+    """Return ``True`` if the database of :param:`query` sorts ``NULL`` before other values.
+
+    SQLite, MySQL and SQL Server do, PostgreSQL and Oracle sort ``NULL`` last.
+    """
+    return query.session.get_bind(Model).dialect.name in NULLS_FIRST_DIALECTS
+
+
+def keyset_query(query: Query, columns: KeysetColumns, values: list) -> Query:
+    """Return :param:`query` filtered to the rows after :param:`values`.
+
+    The seek predicate is the expanded form of ``(a, b) > (x, y)``, i.e.
+    ``a > x OR (a = x AND b > y)``, so it works with mixed sort directions
+    and on databases without row value comparisons.
+    ``NULL`` values of nullable columns are sorted like the database sorts them.
+    """
+    nulls_first = _nulls_first(query, columns[-1][0].class_)
+    clauses = []
+    equal = []
+    for (column, descending), value in zip(columns, values):
+        nullable = any(c.nullable for c in getattr(column.property, "columns", ()))
+        # `NULL` is sorted after all values of this column
+        nulls_last = nullable and descending == nulls_first
+        if value is None:
+            if not nulls_last:
+                clauses.append(and_(*equal, column.isnot(None)))
+            equal.append(column.is_(None))
+            continue
+
+        seek = column < value if descending else column > value
+        if nulls_last:
+            seek = or_(seek, column.is_(None))
+        clauses.append(and_(*equal, seek))
+        equal.append(column == value)
+    return query.filter(or_(*clauses))
+
+
+def get_streaming(request: Request, Model: RestalchemyBase) -> bool:
+    """Return if lists of :param:`Model` are streamed.
+
+    Models can overwrite the `streaming` setting from the restalchemy config
+    with a `__streaming__` attribute.
+    """
+    return getattr(Model, "__streaming__", request.registry.restalchemy.streaming)
+
+
+def get_count_strategy(request: Request, Model: RestalchemyBase) -> str:
+    """Return how the total number of rows for :param:`Model` is counted.
+
+    - ``exact``: ``SELECT count(*) FROM (SELECT ... )``
+    - ``distinct_id``: ``SELECT count(DISTINCT Model.id) FROM ...``
+    - ``estimate``: Estimated count from `Model.__count_estimate__(request, query)`
+      or the function set with `config.set_count_estimate_function`
+    - ``none``: Don't count at all
+
+    The strategy is taken from `Model.__count__` or the `count` setting
+    from the restalchemy config. ``?count=false`` always disables counting.
+    """
+    if not request.count:
+        return "none"
+    return getattr(Model, "__count__", request.registry.restalchemy.count)
+
+
+def count_query(request: Request, Model: RestalchemyBase, query: Query, strategy: str):
+    """Return a tuple of the row count for :param:`query` and the strategy actually used.
+
+    Strategies that are not possible for :param:`Model` (e.g. ``distinct_id``
+    without an `id` column or ``estimate`` without an estimate function)
+    fall back to ``exact``.
+    """
+    if strategy == "none":
+        return None, strategy
+
+    query = query.order_by(None)
+    if strategy == "distinct_id" and hasattr(Model, "id"):
+        # SELECT count(DISTINCT Model.id) FROM Model ...
+        return query.with_entities(func.count(distinct(Model.id))).scalar(), strategy
+
+    if strategy == "estimate":
+        estimate_fn = getattr(Model, "__count_estimate__", None)
+        if estimate_fn is None:
+            estimate_fn = request.registry.restalchemy.count_estimate_fn
+        if estimate_fn is not None:
+            return estimate_fn(request, query), strategy
+
+    # SELECT count(*) FROM (SELECT ... FROM Model ... )
+    return query.count(), "exact"
 
 
 def filter_query(
-    request: Request, query: Query, Model: RestalchemyBase, filter_by: str, value: str
+    request: Request,
+    query: Query,
+    Model: RestalchemyBase,
+    filter_by: Union[str, Filter],
+    value: str = None,
 ) -> Query:
-    negate = filter_by.endswith("!")  # negate filter when last char is !
-    less_equal = filter_by.endswith("<")  # use less equal when last char is <
-    greater_equal = filter_by.endswith(">")  # use greater equal when last char is >
-    filter_by = filter_by.rstrip("!<>")
-
-    # When a filter ends with an underscore, simply ignore it.
-    # Appending '_' is allowed to avoid a conflict with a reserved word like
-    # 'limit' or 'offset' etc.
-    if filter_by.endswith("_"):
-        filter_by = filter_by[:-1]
-
-    # FilterModel is the model who's attribute will be used for the filter
-    FilterModel: RestalchemyBase = Model
-    if "." in filter_by:
-        # when filtered by a full name assume a join
-        model2_name, filter_by = filter_by.split(".", 1)
-
-        Model2 = request.restalchemy_get_model(model2_name)
-        if not Model2:
-            raise AttributeNotFound(model2_name)
-
-        if Model != Model2:
-            try:
-                FilterModel = Model2 = aliased(Model2)  # type: ignore
-                # LEFT JOIN so you can query `Model2.attr='null'`
-                query = query.outerjoin(Model2)
-                # FIXME: specify join argument like
-                # ``query = query.outerjoin(Model2, Model.model2_name)``
-                # otherwise sqla can't find the join with some multiple filters like:
-                # `/v3/creatives?bans.reason=null&advertiser.network_id!=9&sort=quickstats.today.clicks.desc`
-
-                # Allow 1 more join to filter stuff like /campaigns?profile.segments_filter.segments_id=14
-                if "." in filter_by:
-                    model3_name, filter_by = filter_by.split(".", 1)
-                    Model3 = request.restalchemy_get_model(model3_name)
-                    if not Model3:
-                        raise AttributeNotFound(model3_name)
-
-                    # Join Model 3 with Model2 (SQLAlchemy knows how)
-                    # and filter attribute on Model3
-                    if Model3 not in [Model, Model2]:
-                        FilterModel = aliased(Model3)  # type: ignore
-                        query = query.outerjoin(FilterModel)
-            except InvalidRequestError:
-                raise AttributeWrong(model2_name)
-
-    # FIXME: ???? validate list (otherwise DBAPIError is raised)!
-    try:
-        filter_attr = getattr(FilterModel, filter_by)
-    except AttributeError:
-        raise AttributeNotFound(filter_by)
-
-    # If filter_attr is n to m relationship, the value is always `IN` and
-    # we have to join the secondary table.
-    if isinstance(filter_attr, InstrumentedAttribute) and hasattr(
-        filter_attr.property, "secondary"
-    ):
-        target: Any = request.restalchey_get_model(filter_attr.property.target.name)
-        # Without `DISTINCT` models matching multiple filter values will return multiple
-        # rows which sqlalchemy combines to one, resulting in less rows total then
-        # the specified `limit` rows
-        query = query.outerjoin(filter_attr)
-        if isinstance(value, str) and value.lower() == "null":
-            if negate:
-                return query.filter(target.id != None)
-            else:
-                return query.filter(target.id == None)
-        elif negate:
-            return query.filter(target.id.notin_(value.split(","))).distinct()
-        else:
-            return query.filter(target.id.in_(value.split(","))).distinct()
+    """Return :param:`query` with the filter :param:`filter_by`=:param:`value` applied.
 
-    # else
+    :param:`filter_by` can also be an already parsed :class:`restalchemy.request.Filter`.
+    Use :func:`restalchemy.filters.apply_filters` to apply multiple filters at once.
+    """
+    if not isinstance(filter_by, Filter):
+        filter_by = parse_filter(filter_by, value)
+    return apply_filters(request, query, Model, [filter_by])
 
-    if isinstance(value, str) and "," in value:
-        if less_equal or greater_equal:
-            raise FilterInvalid(msg="Less or greater equal only allowed with single values.")
-        if negate:
-            return query.filter(filter_attr.notin_(value.split(",")))
-        return query.filter(filter_attr.in_(value.split(",")))
 
-    if isinstance(value, str) and "*" in value:
-        if less_equal or greater_equal:
-            raise FilterInvalid(msg="Less or greater equal is not allowed for wildcards (`*`).")
-        validate(value, filter_attr)
-        value = value.replace("*", "%")
+def models_query(request: Request, Model: RestalchemyBase, sort: str, filter: list) -> Query:
+    """Return the (unpaginated) query for a list of :param:`Model`.
 
-        if negate:
-            return query.filter(~getattr(FilterModel, filter_by).like(value))
-        else:
-            return query.filter(getattr(FilterModel, filter_by).like(value))
+    The query has the `__read_filter__` of the model, eager loading options,
+    sorting and all filters applied.
+    :param:`filter` is a list of :class:`restalchemy.request.Filter` or `(name, value)` tuples.
+    """
+    query = request.dbsession.query(Model)  # type: Query
+
+    if hasattr(Model, "__read_filter__"):
+        query = Model.__read_filter__(query, request)
+    query = query.options(*get_loader_options(request, Model, request.include))
+    query = query.options(*get_column_options(request, Model))
+
+    # Filters and sort keys are applied together so they share the joins
+    filters = [f if isinstance(f, Filter) else parse_filter(*f) for f in filter]
+    sorts = parse_sort(sort)
+    with profile_phase(request, "filters"):
+        query = apply_filters(request, query, Model, filters, sorts)
 
-    if isinstance(value, str) and value.lower() == "null":
-        value = None  # type: ignore
-    validate(value, filter_attr)
-    if negate:
-        return query.filter(filter_attr != value)
-    if less_equal:
-        return query.filter(filter_attr <= value)
-    if greater_equal:
-        return query.filter(filter_attr >= value)
+    # Always order by ID last to get a stable sort
+    # https://docs.sqlalchemy.org/en/latest/faq/ormconfiguration.html#faq-subqueryload-limit-sort
+    if hasattr(Model, "id") and ("id",) not in [s.path for s in sorts]:
+        query = query.order_by(Model.id)
 
-    return query.filter(filter_attr == value)
+    return query
 
 
 def query_models(
@@ -136,55 +366,63 @@ def query_models(
     limit: int = None,
     sort: str = None,
     filter: str = None,
-) -> Tuple[List[RestalchemyBase], int, Optional[str]]:
-    """Return list of models."""
+    after: str = None,
+    stream: bool = False,
+) -> QueryResult:
+    """Return list of models as :class:`QueryResult`.
+
+    `count` is ``None`` if counting is disabled (see :func:`get_count_strategy`).
+
+    When :param:`after` (or `request.after`) is set, the page starts after the row
+    the cursor points to (keyset pagination) instead of skipping `offset` rows.
+
+    One row more than :param:`limit` is fetched to tell if there are more rows
+    (`has_more`) without having to rely on the count.
+
+    If :param:`stream` is ``True``, the rows are not fetched right away and `result`
+    is a :class:`QueryStream` that fetches them in chunks while it's iterated.
+    """
     Model = request.matchdict["Model"]
     model_name = request.matchdict["model_name"]
 
     offset = offset or request.offset
     limit = limit or request.limit
     sort = sort or request.sort
-    filter = filter or request.filter
-
-    query = request.dbsession.query(Model)  # type: Query
+    filter = filter or request.filters
+    after = after or request.after
 
-    if hasattr(Model, "__read_filter__"):
-        query = Model.__read_filter__(query, request)
-    query = sort_query(request, Model, query, request.sort)
-
-    # Always order by ID to get a stable sort
-    # https://docs.sqlalchemy.org/en/latest/faq/ormconfiguration.html#faq-subqueryload-limit-sort
-    if hasattr(Model, "id"):
-        query = query.order_by(Model.id)
+    if after is not None and offset:
+        raise ParamWrong("`offset` and `after` can't be used together")
 
-    for filter_by, value in filter:
-        query = filter_query(request, query, Model, filter_by, value)
+    query = models_query(request, Model, sort, filter)
 
-    if offset:
-        query = query.offset(offset)
+    page_query = query
+    if after is not None:
+        columns = get_keyset_columns(request, Model, sort)
+        page_query = keyset_query(page_query, columns, decode_cursor(after, columns))
+    elif offset:
+        page_query = page_query.offset(offset)
     if limit:
-        query = query.limit(limit)
+        page_query = page_query.limit(limit + 1)
 
-    result = query.all()
-
-    # FIXME: sqlite? and count(*)
-    # if there's a GROUP BY we count the slow way:
-    # SELECT count(*) FROM (SELECT ... FROM Model ... )
-    if True or query.statement._group_by_clause.clauses or not hasattr(Model, "id"):
-        count = query.limit(None).offset(None).order_by(None).count()
+    if stream:
+        chunk_size = request.registry.restalchemy.stream_chunk_size
+        result = QueryStream(page_query, limit, chunk_size)
+        has_more = None
     else:
-        # Remove limit, offset and order by from query and
-        # SELECT count(DISTINCT Model.id) FROM Model ...
-        count_query = query.statement.with_only_columns([func.count(distinct(Model.id))])
-        count = count_query.limit(None).offset(None).order_by(None).scalar()
-
-    # FIXME: `Last-Modified` not working!
-    # query too slow and it should work with expand and depth==1 etc as well
-    # otherwise pretty useless.
-    # FIXME: `max` function takes forever in big tables.
-    last_modified = None
-
-    return result, count, last_modified
+        with profile_phase(request, "sql"):
+            result = page_query.all()
+        profile_count(request, "rows", len(result))
+        has_more = bool(limit) and len(result) > limit
+        if has_more:
+            result = result[:limit]
+
+    with profile_phase(request, "count"):
+        count, count_strategy = count_query(
+            request, Model, query, get_count_strategy(request, Model)
+        )
+
+    return QueryResult(result, count, count_strategy, has_more)
 
 
 def camel_case_to_snake_case(string: str) -> str:
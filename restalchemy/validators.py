@@ -1,10 +1,13 @@
+import re
 from datetime import datetime
+from functools import lru_cache
+from typing import Callable, Optional, Set, Tuple
 
 from pyramid.config import Configurator
 from restalchemy.exceptions import AttributeWrong
-from sqlalchemy import DECIMAL, DateTime, Enum, Float, Integer, String, event
+from sqlalchemy import DECIMAL, DateTime, Enum, Float, Integer, String, event, inspect
 
-from .model import RestalchemyBase
+from .model import RestalchemyBase, _mapped_classes
 
 
 def validate_int(column, value):
@@ -46,6 +49,12 @@ def validate_enum(column, value):
     return value
 
 
+# Date and optional time with fractional seconds (up to microseconds, more digits are ignored)
+_datetime_re = re.compile(
+    r"(\d{4})-(\d{1,2})-(\d{1,2})(?:\s+(\d{1,2}):(\d{1,2}):(\d{1,2})(?:\.(\d{1,6})\d*)?)?"
+)
+
+
 def validate_datetime(column, value):
     if isinstance(value, datetime):
         return value
@@ -63,24 +72,25 @@ def validate_datetime(column, value):
     if tz.strip("0:") != "":
         raise AttributeWrong(column.key, "Only UTC (+0000) datetimes supported")
 
-    _, _, microseconds = value.partition(".")
-    # We (or better, Python) only supports microseconds (6 digits)
-    if len(microseconds) > 6:
-        value = value[: -(len(microseconds) - 6)]
-    try:
-        return datetime.strptime(value, "%Y-%m-%d %H:%M:%S.%f")
-    except ValueError:
-        pass
-
-    try:
-        return datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
-    except ValueError:
-        pass
-
-    try:
-        return datetime.strptime(value, "%Y-%m-%d")
-    except ValueError:
-        raise AttributeWrong(column.key, f'"{orig_value}" is not a valid datetime')
+    match = _datetime_re.fullmatch(value)
+    if match is not None:
+        year, month, day, hour, minute, second, fraction = match.groups()
+        try:
+            if hour is None:
+                return datetime(int(year), int(month), int(day))
+            return datetime(
+                int(year),
+                int(month),
+                int(day),
+                int(hour),
+                int(minute),
+                int(second),
+                int(fraction.ljust(6, "0")) if fraction else 0,
+            )
+        except ValueError:  # e.g. month 13
+            pass
+
+    raise AttributeWrong(column.key, f'"{orig_value}" is not a valid datetime')
 
 
 validators = {
@@ -93,26 +103,80 @@ validators = {
 }
 
 
-def validate(value, column):
-    """Check if `value` is a valid sqlalchemy type for `column`."""
+# Model attributes (model class, attribute name) that are validated on every "set"
+validated_attributes: Set[Tuple[type, str]] = set()
+
+
+@lru_cache(maxsize=None)
+def _get_type_validator(type_class: type) -> Optional[Callable]:
+    # Walk the MRO so that subclassed types (e.g. `BigInteger` or `Unicode`) are validated too
+    for cls in type_class.__mro__:
+        if cls in validators:
+            return validators[cls]
+    return None
+
+
+def get_validator(column) -> Optional[Callable]:
+    """Return the validator function for the type of `column` (or ``None``)."""
     try:
-        validator = validators.get(column.type.__class__)
+        type_class = column.type.__class__
     except Exception:
-        return value
+        return None
+    return _get_type_validator(type_class)
+
+
+def register_validator(type_class: type, validator: Callable) -> None:
+    """Register `validator` for the sqlalchemy type `type_class` (and its subclasses).
+
+    The validator gets called with the column and the value to validate
+    and has to return the (converted) value or raise :class:`AttributeWrong`.
+    """
+    validators[type_class] = validator
+    _get_type_validator.cache_clear()
+
+
+def validate(value, column):
+    """Check if `value` is a valid sqlalchemy type for `column`."""
+    validator = get_validator(column)
     if validator and value is not None:
         return validator(column, value)
     return value
 
 
+def _set_listener(validator: Callable, column) -> Callable:
+    def validate_set(instance, value, oldvalue, initiator):
+        if value is None:
+            return value
+        return validator(column, value)
+
+    return validate_set
+
+
+def configure_validators(mapper, class_):
+    """Add a "set" listener that validates the value for every column attribute of `class_`.
+
+    The validator for each column is looked up only once here
+    when SQLAlchemy configures the mapper.
+    """
+    for prop in mapper.column_attrs:
+        if (class_, prop.key) in validated_attributes:
+            continue
+        column = prop.columns[0]
+        validator = get_validator(column)
+        if validator is None:
+            continue
+        listener = _set_listener(validator, column)
+        event.listen(getattr(class_, prop.key), "set", listener, retval=True)
+        validated_attributes.add((class_, prop.key))
+
+
 def includeme(config: Configurator):
-    # This event is called whenever an attribute on a class is instrumented
-    @event.listens_for(RestalchemyBase, "attribute_instrument")
-    def configure_listener(class_, key, inst):
-        if not hasattr(inst.property, "columns"):
-            return
-
-        # This event is called whenever a "set"
-        # occurs on that instrumented attribute
-        @event.listens_for(inst, "set", retval=True)
-        def set_(instance, value, oldvalue, initiator):
-            return validate(value, inst.property.columns[0])
+    # This event is called whenever a mapper of a RestalchemyBase model is configured
+    if not event.contains(RestalchemyBase, "mapper_configured", configure_validators):
+        event.listen(RestalchemyBase, "mapper_configured", configure_validators, propagate=True)
+
+    # Mappers that were already configured before RESTAlchemy was included
+    for Model in _mapped_classes(RestalchemyBase):
+        mapper = inspect(Model)
+        if mapper.configured:
+            configure_validators(mapper, Model)
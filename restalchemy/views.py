@@ -1,22 +1,43 @@
+from functools import partial
 from json.decoder import JSONDecodeError
 
 from pyramid.config import Configurator
-from pyramid.httpexceptions import HTTPNotModified
 from pyramid.request import Request
-from restalchemy.response import RestResponse
+from restalchemy.response import QueryStream, RestResponse
 from sqlalchemy import inspect
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm.base import MANYTOMANY, MANYTOONE, ONETOMANY
+from sqlalchemy.orm.util import identity_key
 
+from .cache import cached_view
+from .conditional import cached_not_modified, conditional_response
 from .exceptions import (
+    ApiError,
     AttributeNotFound,
     AttributeWrong,
+    BulkFailed,
     Forbidden,
+    InvalidJson,
+    MissingParameters,
     ModelNotFound,
+    ParamWrong,
     ResourceNotFound,
     Unauthorized,
 )
 from .model import RestalchemyBase
-from .utils import query_models
+from .profiling import profile_count, profile_phase
+from .renderer import dumps, serialize_response
+from .utils import (
+    QueryResult,
+    encode_cursor,
+    get_column_options,
+    get_keyset_columns,
+    get_loader_options,
+    get_pagination,
+    get_streaming,
+    models_query,
+    query_models,
+)
 
 
 def forbidden(request: Request):
@@ -56,72 +77,218 @@ def root(request: Request):
     return res
 
 
-def models_GET(request: Request):
-    """Return models.
-
-    E.g Return all users on HTTP GET `/users`.
-    """
-    Model: RestalchemyBase = request.matchdict["Model"]
-
+def _list_info(request: Request, Model: RestalchemyBase, query_result: QueryResult) -> dict:
+    """Return the info (pagination, count, ...) for a list of models."""
     offset = request.offset
     limit = request.limit
 
-    result, count, last_modified = query_models(request, Model)
-
-    if last_modified:
-        request.response.headerlist.append(("Last-Modified", last_modified))
-    # etag = 'W/"' + md5(str(result).encode()).hexdigest() + '"'
-    # request.response.headerlist.append(('ETag', etag))
-
-    # if request.headers.get('If-None-Match') == etag or \
-    #         (last_modified and last_modified <= request.headers.get('If-Modified-Since', '')):
-    #     return HTTPNotModified(headers=[('ETag', etag)])
-
-    # Build next and previous links
-    params = "&".join([p + "=" + request.params[p] for p in request.params if p != "offset"])
-    if count <= offset + limit:
-        next_link = None
+    result = query_result.result
+    if isinstance(result, QueryStream):
+        has_more, last = result.has_more, result.last
     else:
-        next_link = "{}?{}&offset={}".format(request.path_url, params, offset + limit)
+        has_more, last = query_result.has_more, result[-1] if result else None
 
-    if offset <= 0:
+    # Build next and previous links
+    if request.after is not None or get_pagination(request, Model) == "cursor":
+        # Keyset pagination only links forward with a cursor after the last row
+        params = "&".join(
+            [p + "=" + request.params[p] for p in request.params if p not in ("offset", "after")]
+        )
+        if not has_more:
+            next_link = None
+        else:
+            cursor = encode_cursor(last, get_keyset_columns(request, Model))
+            next_link = "{}?{}&after={}".format(request.path_url, params, cursor)
         prev_link = None
     else:
-        prev_link = "{}?{}&offset={}".format(request.path_url, params, max(0, offset - limit))
-
-    info = {
+        params = "&".join([p + "=" + request.params[p] for p in request.params if p != "offset"])
+        if not has_more:
+            next_link = None
+        else:
+            next_link = "{}?{}&offset={}".format(request.path_url, params, offset + limit)
+
+        if offset <= 0:
+            prev_link = None
+        else:
+            prev_link = "{}?{}&offset={}".format(request.path_url, params, max(0, offset - limit))
+
+    return {
         "sort": request.sort,
         "offset": request.offset,
         "limit": request.limit,
         "filter": request.filter,
-        "count": count,
+        "count": query_result.count,
+        "count_strategy": query_result.count_strategy,
         "previous": prev_link,
         "next": next_link,
     }
-    return RestResponse(Model.__list_resource_name__(request), result, info)
 
 
-def model_GET(request: Request):
-    """Return model.
+def models_GET(request: Request):
+    """Return models.
 
-    E.g. Return user 23 on HTTP GET `/users/23`.
+    E.g Return all users on HTTP GET `/users`.
+
+    If streaming is enabled for the model, the rows are fetched and rendered
+    in chunks and the info (which depends on the last row) is rendered after them.
+    """
+    Model: RestalchemyBase = request.matchdict["Model"]
+
+    not_modified = cached_not_modified(request, Model)
+    if not_modified is not None:
+        return not_modified
+
+    stream = get_streaming(request, Model)
+    query_result = query_models(request, Model, stream=stream)
+
+    # Streamed rows are not fetched yet, so there is no version for them
+    if not stream:
+        not_modified = conditional_response(
+            request, Model, query_result.result, query_result.count, query_result.has_more
+        )
+        if not_modified is not None:
+            return not_modified
+
+    if stream:
+        info = partial(_list_info, request, Model, query_result)
+    else:
+        info = _list_info(request, Model, query_result)
+    return RestResponse(Model.__list_resource_name__(request), query_result.result, info)
+
+
+def models_export_GET(request: Request):
+    """Return all models as newline delimited JSON (one model per line).
+
+    E.g. Return all users on HTTP GET `/users.ndjson`.
+
+    Filters are applied like for :func:`models_GET` but there is no pagination,
+    count or envelope. Rows are fetched with a server side cursor in chunks
+    while the response is sent, so memory use doesn't grow with the number of rows.
     """
+    Model: RestalchemyBase = request.matchdict["Model"]
+    chunk_size = request.registry.restalchemy.stream_chunk_size
+    query = models_query(request, Model, request.sort, request.filters)
+
+    def app_iter():
+        lines = []
+        for model in query.yield_per(chunk_size):
+            profile_count(request, "rows")
+            with profile_phase(request, "serialize"):
+                data = serialize_response(request, model)
+            with profile_phase(request, "json"):
+                lines.append(dumps(data))
+            if len(lines) >= chunk_size:
+                yield ("\n".join(lines) + "\n").encode()
+                lines = []
+        if lines:
+            yield ("\n".join(lines) + "\n").encode()
+
+    response = request.response
+    response.content_type = "application/x-ndjson"
+    response.charset = "utf-8"
+    response.app_iter = app_iter()
+    return response
+
+
+def _load_model(request: Request) -> RestalchemyBase:
+    """Return the model from the `Model` and `id` in the matchdict without calling any hooks."""
     Model = request.matchdict["Model"]
     id = request.matchdict["id"]
 
-    model = request.dbsession.query(Model).get(id)
+    query = request.dbsession.query(Model).options(
+        *get_loader_options(request, Model, request.include)
+    )
+    model = query.get(id)
     if model is None:
         raise ModelNotFound
+    return model
+
+
+def _get_model(request: Request) -> RestalchemyBase:
+    """Return the model from the `Model` and `id` in the matchdict."""
+    model = _load_model(request)
     model.__after_get__(request)
     return model
 
 
+def model_GET(request: Request):
+    """Return model.
+
+    E.g. Return user 23 on HTTP GET `/users/23`.
+    """
+    Model = request.matchdict["Model"]
+
+    not_modified = cached_not_modified(request, Model)
+    if not_modified is not None:
+        return not_modified
+
+    model = _get_model(request)
+    not_modified = conditional_response(request, Model, [model])
+    if not_modified is not None:
+        return not_modified
+    return model
+
+
+def models_batch_GET(request: Request):
+    """Return multiple models by their IDs.
+
+    E.g. Return users 1, 2 and 3 on HTTP GET `/users/1,2,3`.
+
+    All models are fetched with one `IN` query (models that are already
+    in the session are not fetched again) and returned in the requested order.
+    Like for lists, the `__read_filter__` of the model is applied.
+    IDs that don't exist (or are filtered) are returned in the `missing` info.
+    There is no pagination or count.
+    """
+    Model: RestalchemyBase = request.matchdict["Model"]
+    ids = list(dict.fromkeys(int(id) for id in request.matchdict["ids"].split(",")))
+    if len(ids) > request.registry.restalchemy.max_limit:
+        raise ParamWrong(
+            "Can't get more than {} IDs at once".format(request.registry.restalchemy.max_limit)
+        )
+
+    not_modified = cached_not_modified(request, Model)
+    if not_modified is not None:
+        return not_modified
+
+    session = request.dbsession
+    models = {}
+    # Models in the session can only be used if no read filter has to check them
+    read_filter = getattr(Model, "__read_filter__", None)
+    if read_filter is None:
+        for id in ids:
+            model = session.identity_map.get(identity_key(Model, id))
+            if model is not None and not inspect(model).expired and model not in session.deleted:
+                models[id] = model
+
+    fetch_ids = [id for id in ids if id not in models]
+    if fetch_ids:
+        query = session.query(Model)
+        if read_filter is not None:
+            query = read_filter(query, request)
+        query = query.options(
+            *get_loader_options(request, Model, request.include),
+            *get_column_options(request, Model),
+        )
+        models.update((model.id, model) for model in query.filter(Model.id.in_(fetch_ids)))
+
+    result = [models[id] for id in ids if id in models]
+    for model in result:
+        model.__after_get__(request)
+
+    missing = [id for id in ids if id not in models]
+    not_modified = conditional_response(request, Model, result, missing)
+    if not_modified is not None:
+        return not_modified
+    return RestResponse(Model.__list_resource_name__(request), result, {"missing": missing})
+
+
 def model_attribute_GET(request: Request):
     """Return attribute for a resource.
 
     E.g. Return user name on HTTP GET `/users/23/name`.
     """
-    model = model_GET(request)
+    model = _get_model(request)
     attribute = request.matchdict["attribute"]
 
     if not hasattr(model, attribute):
@@ -145,6 +312,190 @@ def models_POST(request: Request):
     return model
 
 
+def _bulk_items(request: Request) -> list:
+    """Return the list of objects from the json body of a bulk request."""
+    try:
+        items = request.json
+    except JSONDecodeError:
+        raise InvalidJson
+    if not isinstance(items, list):
+        raise InvalidJson("JSON data is not a list")
+    return items
+
+
+def _bulk_save(request: Request, items: list, prepare, after_save) -> RestResponse:
+    """Save all :param:`items` in batches and return the saved models with per item results.
+
+    `prepare(item)` has to return a validated model (added to the session)
+    or raise an :class:`ApiError`. Each batch of prepared models
+    (`bulk_batch_size` from the restalchemy config) is written with a single flush
+    and `after_save(model)` is called for every model of the batch after that.
+
+    With `bulk_partial` set, valid items are saved even when others fail.
+    Each batch is flushed in a savepoint and if the database rejects it,
+    its items are prepared and flushed again one by one (each in its own savepoint),
+    so only the items the database rejects fail.
+    Otherwise nothing is saved if a single item fails and :class:`BulkFailed`
+    is raised with the errors of all failed items.
+
+    While an item is processed, it's available as `request.bulk_item`
+    (e.g. for `__before_create__` or `__after_update__`).
+    """
+    Model: RestalchemyBase = request.matchdict["Model"]
+    rest_config = request.registry.restalchemy
+    batch_size = rest_config.bulk_batch_size
+    partial = rest_config.bulk_partial
+    dbsession = request.dbsession
+
+    results: list = [None] * len(items)
+    saved = []
+    failed = False
+
+    def save_item(index: int):
+        """Prepare and flush a single item in a savepoint, return its model or ``None``."""
+        savepoint = dbsession.begin_nested()
+        request.bulk_item = items[index]
+        try:
+            model = prepare(items[index])
+            dbsession.flush()
+            savepoint.commit()
+            return model
+        except ApiError as e:
+            error = e.json_body["error"]
+        except SQLAlchemyError:
+            error = "Resource could not be saved"
+        savepoint.rollback()
+        results[index] = {"index": index, "success": False, "error": error}
+        return None
+    for start in range(0, len(items), batch_size):
+        savepoint = dbsession.begin_nested() if partial else None
+        batch = []
+        for index in range(start, min(start + batch_size, len(items))):
+            request.bulk_item = items[index]
+            try:
+                batch.append((index, prepare(items[index])))
+            except ApiError as e:
+                failed = True
+                results[index] = {"index": index, "success": False, "error": e.json_body["error"]}
+
+        if partial:
+            try:
+                dbsession.flush()
+                savepoint.commit()
+            except SQLAlchemyError:
+                savepoint.rollback()
+                # Find the items the database rejected
+                retried = [(index, save_item(index)) for index, _ in batch]
+                batch = [(index, model) for index, model in retried if model is not None]
+        elif failed:
+            # Nothing will be saved, only check the remaining items for errors
+            continue
+        else:
+            dbsession.flush()
+
+        for index, model in batch:
+            request.bulk_item = items[index]
+            after_save(model)
+            results[index] = {"index": index, "success": True, "id": getattr(model, "id", None)}
+            saved.append(model)
+
+    request.bulk_item = None
+    if failed and not partial:
+        raise BulkFailed([r for r in results if r is not None])
+    return RestResponse(Model.__list_resource_name__(request), saved, {"results": results})
+
+
+def models_bulk_POST(request: Request):
+    """Create multiple new resources from a json list.
+
+    E.g. Create 2 users on HTTP POST `/users/_bulk`
+    with ``[{"name": "foo"}, {"name": "bar"}]``
+    """
+    Model = request.matchdict["Model"]
+
+    def prepare(data):
+        model = Model()
+        data = model.__before_create__(request) or data
+        model._update_from_json(request, data=data, is_create=True)
+        request.dbsession.add(model)
+        return model
+
+    def after_save(model):
+        model.__after_create__(request)
+
+    return _bulk_save(request, _bulk_items(request), prepare, after_save)
+
+
+def _coerce_id(Model: RestalchemyBase, id):
+    """Return :param:`id` as the type of the primary key of :param:`Model`.
+
+    Strings are converted like the ID in the URL of a resource (e.g. ``"2"`` to ``2``
+    for an integer primary key), other types have to match.
+    Raises :class:`ParamWrong` if :param:`id` is not a valid ID.
+    """
+    try:
+        python_type = Model.id.type.python_type
+    except (AttributeError, NotImplementedError):
+        return id
+    if isinstance(id, python_type) and not isinstance(id, bool):
+        return id
+    if isinstance(id, str):
+        try:
+            return python_type(id)
+        except (TypeError, ValueError):
+            pass
+    raise ParamWrong(error="`{}` is not a valid id".format(id))
+
+
+def models_bulk_PUT(request: Request):
+    """Update multiple resources from a json list.
+
+    Every object in the list has to have the `id` of the resource to update.
+
+    E.g. Update 2 users on HTTP PUT `/users/_bulk`
+    with ``[{"id": 1, "name": "foo"}, {"id": 2, "name": "bar"}]``
+    """
+    Model = request.matchdict["Model"]
+    items = _bulk_items(request)
+    batch_size = request.registry.restalchemy.bulk_batch_size
+
+    # Fetch all models to update with one `IN` query per batch
+    ids = []
+    for item in items:
+        try:
+            ids.append(_coerce_id(Model, item["id"]))
+        except (TypeError, KeyError, ParamWrong):
+            continue  # Reported when the item is prepared
+    models = {}
+    for start in range(0, len(ids), batch_size):
+        batch_ids = ids[start : start + batch_size]
+        query = request.dbsession.query(Model).filter(Model.id.in_(batch_ids))
+        models.update((model.id, model) for model in query)
+
+    def prepare(data):
+        if not isinstance(data, dict):
+            raise InvalidJson("JSON data is not an object")
+        data = dict(data)
+        if "id" not in data:
+            raise MissingParameters("`id` is missing")
+        model = models.get(_coerce_id(Model, data.pop("id")))
+        if model is None:
+            raise ModelNotFound
+        try:
+            data = model.__before_update__(request) or data
+            model._update_from_json(request, data=data, is_update=True)
+        except ApiError:
+            # Discard changes that were already made to the model
+            request.dbsession.expire(model)
+            raise
+        return model
+
+    def after_save(model):
+        model.__after_update__(request)
+
+    return _bulk_save(request, items, prepare, after_save)
+
+
 def model_attribute_POST(request: Request):
     """Add a new resource to a model attribute.
 
@@ -155,7 +506,7 @@ def model_attribute_POST(request: Request):
         HTTP POST /users/23/blogs
         { "title": "new entry", "text": "blog text"}
     """
-    model = model_GET(request)
+    model = _get_model(request)
     Model: RestalchemyBase = request.matchdict["Model"]
     model_name = model.__single_resource_name__(request)
     attr_name = request.matchdict["attribute"]
@@ -187,7 +538,7 @@ def model_attribute_POST(request: Request):
 def model_PUT(request: Request):
     """Update resource from json body."""
 
-    model = model_GET(request)
+    model = _get_model(request)
     data = model.__before_update__(request)
     data = data or request.json
     model._update_from_json(request, data=data, is_update=True)
@@ -205,7 +556,7 @@ def model_attribute_PUT(request: Request):
         HTTP PUT /blogs/42/user
         { "name": "foobar", "language": "de"}
     """
-    model = model_GET(request)
+    model = _get_model(request)
     Model = request.matchdict["Model"]
     model_name = model.__single_resource_name__(request)
     attr_name = request.matchdict["attribute"]
@@ -238,7 +589,7 @@ def model_attribute_DELETE(request: Request):
 
         HTTP DELETE /blog/42/user
     """
-    model = model_GET(request)
+    model = _get_model(request)
     Model = request.matchdict["Model"]
     model_name = model.__single_resource_name__(request)
     attr_name = request.matchdict["attribute"]
@@ -266,17 +617,37 @@ def includeme(config: Configurator):
     config.add_view(root, request_method="GET", route_name="restalchemy.root")
 
     # GET
-    config.add_view(model_GET, request_method="GET", route_name="restalchemy.model")
-    config.add_view(model_attribute_GET, request_method="GET", route_name="restalchemy.attribute")
-    config.add_view(models_GET, request_method="GET", route_name="restalchemy.models")
+    config.add_view(
+        model_GET, request_method="GET", route_name="restalchemy.model", decorator=cached_view
+    )
+    config.add_view(
+        models_batch_GET,
+        request_method="GET",
+        route_name="restalchemy.models.batch",
+        decorator=cached_view,
+    )
+    config.add_view(
+        model_attribute_GET,
+        request_method="GET",
+        route_name="restalchemy.attribute",
+        decorator=cached_view,
+    )
+    config.add_view(
+        models_GET, request_method="GET", route_name="restalchemy.models", decorator=cached_view
+    )
+    config.add_view(
+        models_export_GET, request_method="GET", route_name="restalchemy.models.ndjson"
+    )
 
     # POST
     config.add_view(models_POST, request_method="POST", route_name="restalchemy.models")
     config.add_view(model_attribute_POST, request_method="POST", route_name="restalchemy.attribute")
+    config.add_view(models_bulk_POST, request_method="POST", route_name="restalchemy.models.bulk")
 
     # PUT
     config.add_view(model_PUT, request_method="PUT", route_name="restalchemy.model")
     config.add_view(model_attribute_PUT, request_method="PUT", route_name="restalchemy.attribute")
+    config.add_view(models_bulk_PUT, request_method="PUT", route_name="restalchemy.models.bulk")
 
     # DELETE
     # config.add_view(model_DELETE, request_method="DELETE", route_name="restalchemy.model")
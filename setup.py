@@ -12,6 +12,8 @@ extra_require = {
     # 'all': ['sqlacodegen?', 'alembic?'],
     'test': ['pytest'],
     'docs': ['sphinx'],
+    'benchmark': ['WebTest'],
+    'async': ['SQLAlchemy>=1.4', 'aiosqlite'],
 }
 
 setuptools.setup(
@@ -26,7 +28,7 @@ setuptools.setup(
     long_description_content_type="text/markdown",
     url="https://github.com/dakra/restalchemy",
     license='ISC',
-    packages=setuptools.find_packages(),
+    packages=setuptools.find_packages(exclude=['benchmarks', 'benchmarks.*']),
     classifiers=(
         'Development Status :: 4 - Beta',
         'Intended Audience :: Developers',
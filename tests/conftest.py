@@ -0,0 +1,71 @@
+import pytest
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from webtest import TestApp
+
+from .models import make_config, populate
+
+
+class StatementCounter:
+    """Counts (and keeps) the SQL statements executed by an engine."""
+
+    def __init__(self, engine) -> None:
+        self.count = 0
+        self.sql = []
+        event.listen(engine, "before_cursor_execute", self._count)
+
+    def _count(self, conn, cursor, statement, *args) -> None:
+        self.count += 1
+        self.sql.append(statement)
+
+    def reset(self) -> None:
+        self.count = 0
+        self.sql = []
+
+
+def make_app(tmp_path, settings: dict = None, users: int = 10, posts_per_user: int = 3):
+    """Return the WebTest app with `users` and `posts_per_user` posts in a SQLite file db."""
+    config = make_config("sqlite:///{}".format(tmp_path / "db.sqlite"), settings)
+    app = TestApp(config.make_wsgi_app())
+    session = Session(bind=config.registry.restalchemy_engine)
+    populate(session, users, posts_per_user, tags=5)
+    session.close()
+    app.registry = config.registry
+    return app
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = make_app(tmp_path)
+    yield app
+    app.registry.restalchemy_engine.dispose()
+
+
+@pytest.fixture
+def statements(request):
+    # Counts the statements of the app of the test (e.g. `app` or `version_cache_app`)
+    app_fixture = next(name for name in request.fixturenames if name.endswith("app"))
+    app = request.getfixturevalue(app_fixture)
+    return StatementCounter(app.registry.restalchemy_engine)
+
+
+@pytest.fixture
+def connections(request):
+    """Return the number of connections of the app of the test that are checked out.
+
+    Counted with pool events, since the SQLite file databases use a `NullPool`
+    (without `checkedout()`).
+    """
+    app_fixture = next(name for name in request.fixturenames if name.endswith("app"))
+    engine = request.getfixturevalue(app_fixture).registry.restalchemy_engine
+    checked_out = [0]
+
+    def checkout(*args):
+        checked_out[0] += 1
+
+    def checkin(*args):
+        checked_out[0] -= 1
+
+    event.listen(engine, "checkout", checkout)
+    event.listen(engine, "checkin", checkin)
+    return lambda: checked_out[0]
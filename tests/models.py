@@ -0,0 +1,145 @@
+"""Synthetic models of the test and benchmark app.
+
+- :class:`User` has many :class:`Post` (1-n)
+- :class:`Post` has many :class:`Tag` and the other way round (n-m)
+- :class:`Post` has an enum and datetimes
+- :class:`WideRow` has many columns of different types and large `notes`
+  that are left out of lists
+"""
+
+import enum
+from datetime import datetime, timedelta
+
+from pyramid.config import Configurator
+from sqlalchemy import (
+    Boolean,
+    Column,
+    DateTime,
+    Enum,
+    Float,
+    ForeignKey,
+    Integer,
+    String,
+    Table,
+    Text,
+)
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import relationship
+
+from restalchemy.model import RestalchemyBase
+
+Base = declarative_base(cls=RestalchemyBase)
+
+WIDE_COLUMNS = 30
+
+post_tags = Table(
+    "post_tags",
+    Base.metadata,
+    Column("post_id", Integer, ForeignKey("posts.id"), primary_key=True),
+    Column("tag_id", Integer, ForeignKey("tags.id"), primary_key=True),
+)
+
+
+class Status(enum.Enum):
+    draft = "draft"
+    published = "published"
+    archived = "archived"
+
+
+class User(Base):
+    __tablename__ = "users"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String(100), nullable=False, index=True)
+    email = Column(String(200), nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    posts = relationship("Post", back_populates="user")
+
+
+class Tag(Base):
+    __tablename__ = "tags"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String(50), nullable=False, unique=True)
+
+    posts = relationship("Post", secondary=post_tags, back_populates="tags")
+
+
+class Post(Base):
+    __tablename__ = "posts"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    title = Column(String(200), nullable=False)
+    body = Column(Text, nullable=False)
+    status = Column(Enum(Status), nullable=False, default=Status.draft, index=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow, index=True)
+    published_at = Column(DateTime)
+    updated_at = Column(
+        DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow
+    )
+
+    __version_attribute__ = "updated_at"
+
+    user = relationship("User", back_populates="posts")
+    tags = relationship("Tag", secondary=post_tags, back_populates="posts")
+
+
+class WideRow(Base):
+    __tablename__ = "wide_rows"
+
+    id = Column(Integer, primary_key=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    active = Column(Boolean, nullable=False, default=True)
+    notes = Column(Text)
+
+    __json_list_exclude__ = ["notes"]
+
+
+# Add string, integer and float columns to make the rows "wide"
+for i in range(WIDE_COLUMNS):
+    column_type = (String(100), Integer, Float)[i % 3]
+    setattr(WideRow, "col_{}".format(i), Column(column_type))
+
+
+def populate(session, users: int = 100, posts_per_user: int = 10, tags: int = 20) -> None:
+    """Create the tables and insert the synthetic rows."""
+    Base.metadata.create_all(session.get_bind())
+
+    tag_models = [Tag(name="tag_{}".format(i)) for i in range(tags)]
+    session.add_all(tag_models)
+    start = datetime(2020, 1, 1)
+    statuses = list(Status)
+    for u in range(users):
+        user = User(name="user_{}".format(u), email="user_{}@example.com".format(u))
+        session.add(user)
+        for p in range(posts_per_user):
+            n = u * posts_per_user + p
+            status = statuses[n % len(statuses)]
+            session.add(
+                Post(
+                    user=user,
+                    title="Post {}".format(n),
+                    body="Lorem ipsum dolor sit amet. " * 20,
+                    # Enum columns are validated (and set) by name like JSON values
+                    status=status.name,
+                    created_at=start + timedelta(minutes=n),
+                    published_at=start + timedelta(days=1) if status != Status.draft else None,
+                    tags=[tag_models[(n + i) % tags] for i in range(3)],
+                )
+            )
+        row = WideRow(notes="Lorem ipsum dolor sit amet. " * 100)
+        for i in range(WIDE_COLUMNS):
+            value = ("value {}".format(i), u * i, u / (i + 1))[i % 3]
+            setattr(row, "col_{}".format(i), value)
+        session.add(row)
+    session.commit()
+
+
+def make_config(db_url: str, settings: dict = None) -> Configurator:
+    """Return the config of the benchmark app with RESTAlchemy managing the sessions."""
+    settings = {"restalchemy.db_url": db_url, **(settings or {})}
+    config = Configurator(settings=settings)
+    config.include("restalchemy")
+    return config
@@ -0,0 +1,160 @@
+import asyncio
+import json
+
+import pytest
+
+from restalchemy.exceptions import Forbidden
+
+from .conftest import make_app
+from .models import Post, User
+
+pytest.importorskip("aiosqlite")
+sqlalchemy_asyncio = pytest.importorskip("sqlalchemy.ext.asyncio")
+
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from restalchemy.aio import AsgiApp  # noqa: E402
+
+
+async def call(app: AsgiApp, method: str, url: str, data=None):
+    """Send a request to the ASGI :param:`app` and return the status and JSON body."""
+    path, _, query = url.partition("?")
+    scope = {
+        "type": "http",
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "root_path": "",
+        "query_string": query.encode(),
+        "headers": [(b"content-type", b"application/json")] if data is not None else [],
+        "server": ("localhost", 80),
+    }
+    body = json.dumps(data).encode() if data is not None else b""
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    await app(scope, receive, send)
+    assert sent[0]["type"] == "http.response.start"
+    response_body = b"".join(message.get("body", b"") for message in sent[1:])
+    return sent[0]["status"], json.loads(response_body) if response_body else None
+
+
+@pytest.fixture
+def wsgi_app(tmp_path):
+    app = make_app(tmp_path)
+    yield app
+    app.registry.restalchemy_engine.dispose()
+
+
+@pytest.fixture
+def run_asgi(tmp_path, wsgi_app):
+    """Run a coroutine function with the ASGI app over an aiosqlite engine."""
+    url = "sqlite+aiosqlite:///{}".format(tmp_path / "db.sqlite")
+
+    def run(fn):
+        async def main():
+            engine = sqlalchemy_asyncio.create_async_engine(url)
+            try:
+                sessions = sessionmaker(engine, class_=sqlalchemy_asyncio.AsyncSession)
+                return await fn(AsgiApp(wsgi_app.registry, sessions))
+            finally:
+                await engine.dispose()
+
+        return asyncio.run(main())
+
+    return run
+
+
+def test_asgi_app_returns_the_same_json(wsgi_app, run_asgi):
+    urls = [
+        "/v1/posts?limit=5&sort=-id&include=user",
+        "/v1/posts?user.name=user_1&fields=id,title",
+        "/v1/posts/1?include=tags",
+    ]
+
+    async def get_all(app):
+        return [await call(app, "GET", url) for url in urls]
+
+    for url, (status, data) in zip(urls, run_asgi(get_all)):
+        assert status == 200
+        expected = wsgi_app.get(url).json
+        name = expected["resource"]
+        assert data[name] == expected[name]
+        assert data.get("count") == expected.get("count")
+
+
+def test_asgi_writes_are_committed(wsgi_app, run_asgi):
+    async def write(app):
+        status, data = await call(
+            app,
+            "POST",
+            "/v1/posts",
+            {"user_id": 1, "title": "Async", "body": "Body", "status": "draft"},
+        )
+        assert status == 200
+        post_id = data["post"]["id"]
+        status, data = await call(app, "PUT", "/v1/posts/{}".format(post_id), {"title": "Changed"})
+        assert status == 200
+        return post_id
+
+    post_id = run_asgi(write)
+    assert wsgi_app.get("/v1/posts/{}".format(post_id)).json["post"]["title"] == "Changed"
+
+
+def test_asgi_failed_writes_are_rolled_back(wsgi_app, run_asgi, monkeypatch):
+    def forbid(self, request):
+        request.dbsession.flush()
+        raise Forbidden()
+
+    monkeypatch.setattr(Post, "__after_update__", forbid)
+
+    async def write(app):
+        return await call(app, "PUT", "/v1/posts/1", {"title": "Changed"})
+
+    assert run_asgi(write)[0] == 403
+    assert wsgi_app.get("/v1/posts/1").json["post"]["title"] == "Post 0"
+
+
+def test_sync_hooks_can_use_the_session_and_lazy_load(run_asgi, monkeypatch):
+    def after_get(self, request):
+        self.user_posts = request.dbsession.query(Post).filter(Post.user_id == User.id).count()
+        # Lazy loads `Post.user`, which fails outside of `run_sync`
+        self.user_name = self.user.name
+
+    monkeypatch.setattr(Post, "__after_get__", after_get)
+
+    async def get(app):
+        return await call(app, "GET", "/v1/posts/1")
+
+    status, data = run_asgi(get)
+    assert status == 200
+    assert data["post"]["user_name"] == "user_0"
+
+
+def test_async_hooks_are_awaited(run_asgi, monkeypatch):
+    async def forbid(self, request):
+        raise Forbidden()
+
+    monkeypatch.setattr(Post, "__after_get__", forbid)
+
+    async def get(app):
+        return await call(app, "GET", "/v1/posts/1")
+
+    assert run_asgi(get)[0] == 403
+
+
+def test_unsupported_routes_are_not_found(run_asgi):
+    async def get(app):
+        return [
+            await call(app, "GET", "/v1/unknown_models"),
+            await call(app, "GET", "/v1/posts.ndjson"),
+        ]
+
+    assert [status for status, data in run_asgi(get)] == [404, 404]
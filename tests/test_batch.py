@@ -0,0 +1,48 @@
+import pytest
+
+from .conftest import make_app
+from .models import Post, Status
+
+
+def test_batch_get_uses_one_query(app, statements):
+    response = app.get("/v1/posts/3,1,2")
+    assert [post["id"] for post in response.json["posts"]] == [3, 1, 2]
+    assert statements.count == 1
+    assert "posts.id IN" in statements.sql[0]
+
+
+def test_batch_get_duplicate_ids(app):
+    response = app.get("/v1/posts/2,1,2")
+    assert [post["id"] for post in response.json["posts"]] == [2, 1]
+
+
+def test_batch_get_missing(app):
+    response = app.get("/v1/posts/9999,1,9998")
+    assert [post["id"] for post in response.json["posts"]] == [1]
+    assert response.json["missing"] == [9999, 9998]
+
+
+def test_batch_get_id_limit(tmp_path):
+    app = make_app(tmp_path, {"restalchemy.max_limit": "2"})
+    try:
+        assert app.get("/v1/posts/1,2").json["missing"] == []
+        response = app.get("/v1/posts/1,2,3", status=400)
+        assert response.json["error"].endswith("Can't get more than 2 IDs at once")
+    finally:
+        app.registry.restalchemy_engine.dispose()
+
+
+@pytest.fixture
+def read_filter(monkeypatch):
+    def __read_filter__(query, request):
+        return query.filter(Post.status != Status.archived)
+
+    monkeypatch.setattr(Post, "__read_filter__", __read_filter__, raising=False)
+
+
+def test_batch_get_applies_the_read_filter(app, read_filter):
+    # Post 3 is archived
+    assert app.get("/v1/posts?status=archived&id=3").json["count"] == 0
+    response = app.get("/v1/posts/1,2,3")
+    assert [post["id"] for post in response.json["posts"]] == [1, 2]
+    assert response.json["missing"] == [3]
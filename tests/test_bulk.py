@@ -0,0 +1,117 @@
+import pytest
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from .conftest import make_app
+
+
+def new_post(title: str, **data) -> dict:
+    return {"user_id": 1, "title": title, "body": "Body", "status": "draft", **data}
+
+
+@pytest.fixture
+def partial_app(tmp_path):
+    app = make_app(tmp_path, {"restalchemy.bulk_partial": "true"})
+    yield app
+    app.registry.restalchemy_engine.dispose()
+
+
+@pytest.fixture
+def flushes():
+    count = [0]
+
+    def after_flush(*args):
+        count[0] += 1
+
+    event.listen(Session, "after_flush", after_flush)
+    yield lambda: count[0]
+    event.remove(Session, "after_flush", after_flush)
+
+
+def test_bulk_create(app):
+    response = app.post_json("/v1/posts/_bulk", [new_post("A"), new_post("B")])
+    assert [post["title"] for post in response.json["posts"]] == ["A", "B"]
+    assert [r["success"] for r in response.json["results"]] == [True, True]
+    assert app.get("/v1/posts?title=A").json["count"] == 1
+
+
+def test_bulk_is_all_or_nothing(app):
+    response = app.post_json(
+        "/v1/posts/_bulk", [new_post("A"), new_post("B", status="unknown")], status=400
+    )
+    (result,) = response.json["results"]
+    assert result["index"] == 1
+    assert not result["success"]
+    assert app.get("/v1/posts?title=A").json["count"] == 0
+
+
+def test_bulk_partial_reports_failed_items(partial_app):
+    response = partial_app.post_json(
+        "/v1/posts/_bulk", [new_post("A"), new_post("B", status="unknown"), new_post("C")]
+    )
+    results = response.json["results"]
+    assert [r["success"] for r in results] == [True, False, True]
+    assert results[1]["error"]
+    assert [post["title"] for post in response.json["posts"]] == ["A", "C"]
+
+
+def test_bulk_partial_retries_batches_the_database_rejects(partial_app):
+    # `tag_0` already exists and tag names are unique
+    response = partial_app.post_json(
+        "/v1/tags/_bulk", [{"name": "new_1"}, {"name": "tag_0"}, {"name": "new_2"}]
+    )
+    results = response.json["results"]
+    assert [r["success"] for r in results] == [True, False, True]
+    assert results[1]["error"] == "Resource could not be saved"
+    assert [tag["name"] for tag in response.json["tags"]] == ["new_1", "new_2"]
+    assert partial_app.get("/v1/tags?name=new_*").json["count"] == 2
+
+
+def test_bulk_flushes_in_batches(tmp_path, flushes):
+    app = make_app(tmp_path, {"restalchemy.bulk_batch_size": "2"})
+    try:
+        before = flushes()
+        app.post_json("/v1/posts/_bulk", [new_post(str(i)) for i in range(5)])
+        assert flushes() - before == 3
+    finally:
+        app.registry.restalchemy_engine.dispose()
+
+
+def test_bulk_update_loads_the_models_per_batch(tmp_path):
+    app = make_app(tmp_path, {"restalchemy.bulk_batch_size": "2"})
+    try:
+        statements = []
+        event.listen(
+            app.registry.restalchemy_engine,
+            "before_cursor_execute",
+            lambda conn, cursor, statement, *args: statements.append(statement),
+        )
+        app.put_json("/v1/posts/_bulk", [{"id": i, "title": str(i)} for i in range(1, 6)])
+        selects = [s for s in statements if s.startswith("SELECT") and "posts.id IN" in s]
+        assert len(selects) == 3
+        assert app.get("/v1/posts/5").json["post"]["title"] == "5"
+    finally:
+        app.registry.restalchemy_engine.dispose()
+
+
+def test_bulk_update_ids(app):
+    # IDs can be strings like in the URL
+    response = app.put_json("/v1/posts/_bulk", [{"id": "2", "title": "Changed"}])
+    assert response.json["results"] == [{"index": 0, "success": True, "id": 2}]
+    assert app.get("/v1/posts/2").json["post"]["title"] == "Changed"
+
+
+@pytest.mark.parametrize(
+    "item, error",
+    [
+        ({"id": 9999, "title": "Changed"}, "Model not found"),
+        ({"id": "two", "title": "Changed"}, "`two` is not a valid id"),
+        ({"id": 2.5, "title": "Changed"}, "`2.5` is not a valid id"),
+        ({"title": "Changed"}, "`id` is missing"),
+    ],
+)
+def test_bulk_update_wrong_ids(partial_app, item, error):
+    response = partial_app.put_json("/v1/posts/_bulk", [item, {"id": 1, "title": "Changed"}])
+    results = response.json["results"]
+    assert results[0] == {"index": 0, "success": False, "error": error}
+    assert results[1]["success"]
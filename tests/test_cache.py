@@ -0,0 +1,53 @@
+import pytest
+from pyramid.testing import DummyRequest
+
+from restalchemy.cache import MemoryCache, ResponseCache, _generation_key
+from restalchemy.exceptions import Forbidden
+
+from .conftest import make_app
+from .models import Post, User
+
+
+@pytest.fixture
+def cache_app(tmp_path):
+    app = make_app(tmp_path, {"restalchemy.response_cache": "true"})
+    yield app
+    app.registry.restalchemy_engine.dispose()
+
+
+def test_response_cache(cache_app, statements):
+    first = cache_app.get("/v1/posts/1")
+    statements.reset()
+    assert cache_app.get("/v1/posts/1").body == first.body
+    assert statements.count == 0
+    assert cache_app.registry.restalchemy_response_cache.stats["hits"] == 1
+
+
+def test_response_cache_is_invalidated_on_write(cache_app):
+    cache_app.get("/v1/posts?limit=2")
+    cache_app.get("/v1/users/1")
+    cache_app.put_json("/v1/posts/1", {"title": "Changed"})
+    assert cache_app.get("/v1/posts/1").json["post"]["title"] == "Changed"
+    assert cache_app.get("/v1/posts?limit=2").json["posts"][0]["title"] == "Changed"
+
+
+def test_response_cache_runs_after_get_hooks(cache_app, monkeypatch):
+    cache_app.get("/v1/posts/1")
+
+    def forbid(self, request):
+        raise Forbidden()
+
+    monkeypatch.setattr(Post, "__after_get__", forbid)
+    cache_app.get("/v1/posts/1", status=403)
+
+
+def test_evicted_generation_does_not_revive_old_responses():
+    cache = ResponseCache(MemoryCache())
+    request = DummyRequest(path="/v1/users")
+    key = cache.key(request, User)
+    cache.set(key, "old response")
+    assert cache.key(request, User) == key
+
+    # e.g. evicted by the LRU or expired
+    cache.backend.delete(_generation_key(User))
+    assert cache.key(request, User) != key
@@ -0,0 +1,54 @@
+import pytest
+
+from restalchemy.exceptions import Forbidden
+
+from .conftest import make_app
+from .models import Post
+
+FUTURE = "Thu, 01 Jan 2099 00:00:00 GMT"
+
+
+def test_single_resource_if_modified_since(app):
+    response = app.get("/v1/posts/1")
+    assert response.headers["ETag"]
+    assert response.last_modified is not None
+    app.get("/v1/posts/1", headers={"If-Modified-Since": FUTURE}, status=304)
+
+
+def test_list_has_no_last_modified(app):
+    response = app.get("/v1/posts?limit=2")
+    assert response.headers["ETag"]
+    assert "Last-Modified" not in response.headers
+    # A deleted row wouldn't change the newest version of the page
+    app.get("/v1/posts?limit=2", headers={"If-Modified-Since": FUTURE}, status=200)
+
+
+def test_list_if_none_match(app):
+    etag = app.get("/v1/posts?limit=2").headers["ETag"]
+    app.get("/v1/posts?limit=2", headers={"If-None-Match": etag}, status=304)
+    app.put_json("/v1/posts/1", {"title": "Changed"})
+    app.get("/v1/posts?limit=2", headers={"If-None-Match": etag}, status=200)
+
+
+@pytest.fixture
+def version_cache_app(tmp_path):
+    app = make_app(tmp_path, {"restalchemy.version_cache": "true"})
+    yield app
+    app.registry.restalchemy_engine.dispose()
+
+
+def test_version_cache(version_cache_app, statements):
+    etag = version_cache_app.get("/v1/posts/1").headers["ETag"]
+    statements.reset()
+    version_cache_app.get("/v1/posts/1", headers={"If-None-Match": etag}, status=304)
+    assert statements.count == 0
+
+
+def test_version_cache_runs_after_get_hooks(version_cache_app, monkeypatch):
+    etag = version_cache_app.get("/v1/posts/1").headers["ETag"]
+
+    def forbid(self, request):
+        raise Forbidden()
+
+    monkeypatch.setattr(Post, "__after_get__", forbid)
+    version_cache_app.get("/v1/posts/1", headers={"If-None-Match": etag}, status=403)
@@ -0,0 +1,99 @@
+import pytest
+from sqlalchemy.orm import Session
+from webtest import TestApp
+
+from .conftest import StatementCounter, make_app
+from .models import Post, make_config, populate
+
+
+def count_sql(statements) -> list:
+    return [sql for sql in statements.sql if "count(" in sql]
+
+
+@pytest.fixture
+def count_app(request, tmp_path):
+    app = make_app(tmp_path, {"restalchemy.count": request.param})
+    yield app
+    app.registry.restalchemy_engine.dispose()
+
+
+def test_exact_count(app, statements):
+    info = app.get("/v1/posts?limit=2&status=draft").json
+    assert (info["count"], info["count_strategy"]) == (10, "exact")
+    (sql,) = count_sql(statements)
+    assert sql.startswith("SELECT count(*)")
+    assert "FROM (SELECT" in sql
+
+
+@pytest.mark.parametrize("count_app", ["distinct_id"], indirect=True)
+def test_distinct_id_count(count_app, statements):
+    info = count_app.get("/v1/posts?limit=2&status=draft").json
+    assert (info["count"], info["count_strategy"]) == (10, "distinct_id")
+    (sql,) = count_sql(statements)
+    assert "count(DISTINCT posts.id)" in sql
+    assert "FROM (SELECT" not in sql
+
+
+@pytest.mark.parametrize("count_app", ["none"], indirect=True)
+def test_no_count(count_app, statements):
+    info = count_app.get("/v1/posts?limit=2").json
+    assert (info["count"], info["count_strategy"]) == (None, "none")
+    assert statements.count == 1
+    # Pagination doesn't depend on the count
+    assert info["next"] is not None
+
+
+def test_count_false_disables_counting(app, statements):
+    info = app.get("/v1/posts?limit=2&count=false").json
+    assert (info["count"], info["count_strategy"]) == (None, "none")
+    assert count_sql(statements) == []
+    assert statements.count == 1
+
+
+@pytest.mark.parametrize("count_app", ["distinct_id"], indirect=True)
+def test_model_count_strategy(count_app, statements, monkeypatch):
+    monkeypatch.setattr(Post, "__count__", "exact", raising=False)
+    assert count_app.get("/v1/posts?limit=2").json["count_strategy"] == "exact"
+    assert count_app.get("/v1/users?limit=2").json["count_strategy"] == "distinct_id"
+
+
+@pytest.mark.parametrize("count_app", ["estimate"], indirect=True)
+def test_model_count_estimate(count_app, statements, monkeypatch):
+    queries = []
+
+    def __count_estimate__(request, query):
+        queries.append(query)
+        return 1000
+
+    monkeypatch.setattr(Post, "__count_estimate__", __count_estimate__, raising=False)
+    info = count_app.get("/v1/posts?limit=2&status=draft").json
+    assert (info["count"], info["count_strategy"]) == (1000, "estimate")
+    assert count_sql(statements) == []
+    # The estimate function gets the filtered query
+    assert "posts.status = " in str(queries[0])
+
+
+@pytest.mark.parametrize("count_app", ["estimate"], indirect=True)
+def test_estimate_falls_back_to_exact(count_app, statements):
+    info = count_app.get("/v1/posts?limit=2").json
+    assert (info["count"], info["count_strategy"]) == (30, "exact")
+    assert len(count_sql(statements)) == 1
+
+
+def test_count_estimate_function(tmp_path):
+    config = make_config(
+        "sqlite:///{}".format(tmp_path / "db.sqlite"), {"restalchemy.count": "estimate"}
+    )
+    config.set_count_estimate_function(lambda request, query: 42)
+    app = TestApp(config.make_wsgi_app())
+    engine = config.registry.restalchemy_engine
+    session = Session(bind=engine)
+    populate(session, 2, 2, tags=5)
+    session.close()
+    statements = StatementCounter(engine)
+    try:
+        info = app.get("/v1/posts").json
+        assert (info["count"], info["count_strategy"]) == (42, "estimate")
+        assert count_sql(statements) == []
+    finally:
+        engine.dispose()
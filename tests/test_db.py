@@ -0,0 +1,124 @@
+import pytest
+from sqlalchemy import create_engine, exc
+from sqlalchemy.orm import Session
+
+from restalchemy import RestalchemyConfig
+from restalchemy.db import STICKY_COOKIE, DBMetrics, create_db_engine
+from restalchemy.exceptions import Forbidden
+
+from .conftest import make_app
+from .models import Post, populate
+
+
+@pytest.fixture
+def streaming_app(tmp_path):
+    app = make_app(
+        tmp_path, {"restalchemy.streaming": "true", "restalchemy.stream_chunk_size": "4"}
+    )
+    yield app
+    app.registry.restalchemy_engine.dispose()
+
+
+def test_streamed_list(streaming_app, connections):
+    response = streaming_app.get("/v1/posts?limit=20&include=user")
+    assert len(response.json["posts"]) == 20
+    assert response.json["posts"][0]["user"]["id"] == 1
+    assert response.json["next"]
+    assert connections() == 0
+
+
+def test_ndjson_export(app, connections):
+    lines = app.get("/v1/posts.ndjson").text.splitlines()
+    assert len(lines) == 30
+    assert connections() == 0
+
+
+def test_session_is_closed_if_the_stream_is_not_consumed(app, connections):
+    response = app.app(
+        {
+            "REQUEST_METHOD": "GET",
+            "PATH_INFO": "/v1/posts.ndjson",
+            "SERVER_NAME": "localhost",
+            "SERVER_PORT": "80",
+            "wsgi.url_scheme": "http",
+        },
+        lambda status, headers, exc_info=None: None,
+    )
+    next(iter(response))
+    assert connections() == 1
+    response.close()
+    assert connections() == 0
+
+
+@pytest.fixture
+def replica_app(tmp_path):
+    replica_url = "sqlite:///{}".format(tmp_path / "replica.sqlite")
+    replica = create_engine(replica_url)
+    session = Session(bind=replica)
+    populate(session, 10, 3, tags=5)
+    # Tell the databases apart by the title of the first post
+    session.query(Post).filter(Post.id == 1).update({"title": "replica"})
+    session.commit()
+    session.close()
+    replica.dispose()
+
+    app = make_app(tmp_path, {"restalchemy.db_replica_urls": replica_url})
+    yield app
+    app.registry.restalchemy_engine.dispose()
+    for engine in app.registry.restalchemy_replicas:
+        engine.dispose()
+
+
+def get_title(app) -> str:
+    return app.get("/v1/posts/1").json["post"]["title"]
+
+
+def test_safe_methods_read_from_the_replica(replica_app):
+    assert get_title(replica_app) == "replica"
+    assert replica_app.get("/v1/posts?limit=1").json["posts"][0]["title"] == "replica"
+
+
+def test_writes_and_reads_after_them_use_the_primary(replica_app):
+    response = replica_app.put_json("/v1/posts/2", {"title": "Changed"})
+    assert response.json["post"]["title"] == "Changed"
+    assert STICKY_COOKIE in replica_app.cookies
+
+    # Read your own writes
+    assert get_title(replica_app) == "Post 0"
+    assert replica_app.get("/v1/posts/2").json["post"]["title"] == "Changed"
+
+    # Other clients (and this one after the sticky window) read from the replica
+    replica_app.reset()
+    assert get_title(replica_app) == "replica"
+    assert replica_app.get("/v1/posts/2").json["post"]["title"] == "Post 1"
+
+
+def test_failed_writes_are_not_sticky(replica_app, monkeypatch):
+    def forbid(self, request):
+        request.dbsession.flush()
+        raise Forbidden()
+
+    monkeypatch.setattr(Post, "__after_update__", forbid)
+    replica_app.put_json("/v1/posts/2", {"title": "Changed"}, status=403)
+    assert STICKY_COOKIE not in replica_app.cookies
+
+
+def test_without_replicas_everything_uses_the_primary(app):
+    assert not app.registry.restalchemy_replicas
+    assert get_title(app) == "Post 0"
+    app.put_json("/v1/posts/1", {"title": "Changed"})
+    assert STICKY_COOKIE not in app.cookies
+    assert get_title(app) == "Changed"
+
+
+def test_query_metrics_of_failed_statements():
+    engine = create_db_engine(RestalchemyConfig(), "sqlite://")
+    with engine.connect() as connection:
+        metrics = connection.info["restalchemy_metrics"] = DBMetrics()
+        with pytest.raises(exc.OperationalError):
+            connection.execute("SELECT * FROM missing_table")
+        assert connection.execute("SELECT 1").scalar() == 1
+        assert metrics.queries == 2
+        assert metrics.db_time > 0
+        # Nothing is left over from the failed statement
+        assert set(connection.info) == {"restalchemy_metrics"}
@@ -0,0 +1,21 @@
+def test_list_returns_json_by_default(app):
+    for headers in (
+        {},
+        {"Accept": "*/*"},
+        {"Accept": "text/html,application/xhtml+xml,*/*;q=0.8"},
+    ):
+        response = app.get("/v1/posts?limit=2", headers=headers)
+        assert response.content_type == "application/json"
+        assert len(response.json["posts"]) == 2
+
+
+def test_list_ignores_ndjson_accept_header(app):
+    response = app.get("/v1/posts?limit=2", headers={"Accept": "application/x-ndjson"})
+    assert response.content_type == "application/json"
+
+
+def test_ndjson_export(app):
+    response = app.get("/v1/posts.ndjson?user_id=1")
+    assert response.content_type == "application/x-ndjson"
+    lines = response.text.splitlines()
+    assert len(lines) == 3
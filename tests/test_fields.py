@@ -0,0 +1,31 @@
+from .models import Post
+
+
+def test_fields_only_selects_the_requested_columns(app, statements):
+    response = app.get("/v1/posts?fields=id,title&count=false")
+    assert set(response.json["posts"][0]) == {"id", "title"}
+    sql = statements.sql[0]
+    assert "posts.title" in sql
+    assert "posts.body" not in sql
+
+
+def test_list_exclude_is_deferred_in_lists(app, statements, monkeypatch):
+    monkeypatch.setattr(Post, "__json_list_exclude__", ["body"], raising=False)
+
+    posts = app.get("/v1/posts?count=false").json["posts"]
+    assert "body" not in posts[0]
+    assert "title" in posts[0]
+    assert "posts.body" not in statements.sql[0]
+
+    statements.reset()
+    posts = app.get("/v1/posts?fields=id,body&count=false").json["posts"]
+    assert posts[0]["body"].startswith("Lorem ipsum")
+    assert "posts.body" in statements.sql[0]
+
+    assert "body" in app.get("/v1/posts/1").json["post"]
+
+
+def test_included_models_keep_their_columns(app, monkeypatch):
+    monkeypatch.setattr(Post, "__json_list_exclude__", ["body"], raising=False)
+    user = app.get("/v1/users/1?include=posts").json["user"]
+    assert "body" in user["posts"][0]
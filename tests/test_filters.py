@@ -0,0 +1,43 @@
+from restalchemy.filters import FilterNode, compile_filters
+
+from .models import Post, User
+
+
+def test_filters_with_different_values_share_the_compiled_sql(app, statements):
+    compile_filters.cache_clear()
+    first = app.get("/v1/posts?status=published&user.name=user_1&count=false")
+    assert {post["user_id"] for post in first.json["posts"]} == {2}
+    misses = compile_filters.cache_info().misses
+
+    statements.reset()
+    second = app.get("/v1/posts?status=draft&user.name=user_2&count=false")
+    assert {post["user_id"] for post in second.json["posts"]} == {3}
+    assert compile_filters.cache_info().misses == misses
+    assert compile_filters.cache_info().hits >= 1
+
+    statements.reset()
+    app.get("/v1/posts?status=published&user.name=user_1&count=false")
+    sql = statements.sql
+    statements.reset()
+    app.get("/v1/posts?status=archived&user.name=user_5&count=false")
+    assert statements.sql == sql
+    assert "filter_users" in sql[0]
+
+
+def test_filters_with_a_different_shape_are_compiled_again():
+    compile_filters.cache_clear()
+    value = FilterNode((), None, "status", "==", "value")
+    in_list = FilterNode((), None, "status", "==", "in")
+    compile_filters(Post, (value,))
+    compile_filters(Post, (value,))
+    compile_filters(Post, (in_list,))
+    assert compile_filters.cache_info().hits == 1
+    assert compile_filters.cache_info().misses == 2
+
+
+def test_joins_with_the_same_path_are_shared():
+    nodes = (
+        FilterNode((User,), "user", "name", "==", "value"),
+        FilterNode((User,), "user", "email", "==", "like"),
+    )
+    assert len(compile_filters(Post, nodes).joins) == 1
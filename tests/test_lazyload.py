@@ -0,0 +1,103 @@
+import logging
+
+import pytest
+from sqlalchemy import Column, ForeignKey, Integer, create_engine
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import Session, relationship
+
+from restalchemy import utils
+from restalchemy.lazyload import will_lazy_load
+from restalchemy.model import RestalchemyBase
+
+from .conftest import make_app
+
+Base = declarative_base(cls=RestalchemyBase)
+
+
+class Parent(Base):
+    __tablename__ = "lazy_parents"
+
+    id = Column(Integer, primary_key=True)
+
+
+class Child(Base):
+    __tablename__ = "lazy_children"
+
+    id = Column(Integer, primary_key=True)
+    parent_id = Column(Integer, ForeignKey("lazy_parents.id"))
+
+    parent = relationship(Parent, backref="children")
+
+
+@pytest.fixture
+def session():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    session = Session(bind=engine)
+    session.add_all([Child(id=1), Child(id=2, parent=Parent(id=1))])
+    session.commit()
+    session.expunge_all()
+    yield session
+    session.close()
+
+
+def test_many_to_one_with_null_foreign_key_is_not_a_lazy_load(session):
+    child = session.query(Child).get(1)
+    assert not will_lazy_load(child, "parent")
+    assert child.parent is None
+
+
+def test_many_to_one_in_the_identity_map_is_not_a_lazy_load(session):
+    child = session.query(Child).get(2)
+    assert will_lazy_load(child, "parent")
+    parent = session.query(Parent).get(1)
+    assert not will_lazy_load(child, "parent")
+    assert child.parent is parent
+
+
+def test_collections_are_lazy_loads(session):
+    parent = session.query(Parent).get(1)
+    assert will_lazy_load(parent, "children")
+
+
+@pytest.fixture
+def lazy_load_app(tmp_path):
+    app = make_app(tmp_path, {"restalchemy.lazy_load_guard": "true"})
+    yield app
+    app.registry.restalchemy_engine.dispose()
+
+
+@pytest.fixture
+def no_eager_loading(monkeypatch):
+    # Like a custom query or view that forgot the eager loading options
+    monkeypatch.setattr(utils, "get_loader_options", lambda *args: [])
+
+
+@pytest.fixture
+def warnings(caplog):
+    caplog.set_level(logging.WARNING, logger="restalchemy.lazyload")
+    return lambda: " ".join(
+        r.getMessage() for r in caplog.records if r.name == "restalchemy.lazyload"
+    )
+
+
+def test_lazy_loads_are_logged(lazy_load_app, no_eager_loading, statements, warnings):
+    lazy_load_app.get("/v1/posts?limit=9&include=user,tags&count=false")
+    # 3 posts per user, the other posts of a user find it in the identity map
+    assert "Post.user was lazy loaded 3 times in GET /v1/posts" in warnings()
+    assert "Post.tags was lazy loaded 9 times" in warnings()
+    assert statements.count == 1 + 3 + 9
+
+
+def test_eager_loads_are_not_logged(lazy_load_app, warnings):
+    lazy_load_app.get("/v1/posts?limit=9&include=user,tags")
+    assert warnings() == ""
+
+
+def test_lazy_loads_of_streamed_responses_are_logged(lazy_load_app, no_eager_loading, warnings):
+    lazy_load_app.app.registry.restalchemy.streaming = True
+    lazy_load_app.get("/v1/posts?limit=9&include=user&count=false")
+    assert "Post.user was lazy loaded 3 times in GET /v1/posts" in warnings()
+
+    lazy_load_app.get("/v1/posts.ndjson?include=user")
+    assert "Post.user was lazy loaded 10 times in GET /v1/posts.ndjson" in warnings()
@@ -0,0 +1,100 @@
+import gc
+import weakref
+
+from pyramid.testing import DummyRequest
+from sqlalchemy import Column, Integer, String
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import configure_mappers
+
+from restalchemy import model
+
+from .models import Post, make_config
+
+
+def test_writable_attributes_are_cached():
+    model.clear_attributes_cache()
+    attributes = Post._get_writable_attributes(is_update=True)
+    assert "title" in attributes
+    assert "id" in attributes
+    assert "metadata" not in attributes
+    assert (Post, "writable", False, True) in model._attributes_cache
+
+    # Callers get a copy they can change
+    attributes.discard("title")
+    assert "title" in Post._get_writable_attributes(is_update=True)
+
+
+def test_read_only_attributes_are_cached():
+    model.clear_attributes_cache()
+    attributes = Post._get_read_only_attributes(is_create=True)
+    assert "metadata" in attributes
+    assert "_sa_class_manager" in attributes
+    assert (Post, "read_only", True, False) in model._attributes_cache
+
+
+def test_attributes_cache_is_cleared_when_mappers_are_configured():
+    configure_mappers()
+    Post._get_writable_attributes()
+    assert model._attributes_cache
+
+    # Map a new model (with its own base to not add it to the app)
+    class Comment(declarative_base(cls=model.RestalchemyBase)):
+        __tablename__ = "comments"
+
+        id = Column(Integer, primary_key=True)
+        text = Column(String)
+
+    assert model._attributes_cache
+    configure_mappers()
+    assert not model._attributes_cache
+    assert "text" in Comment._get_writable_attributes()
+
+
+class NoCacheRequest:
+    class registry:
+        class restalchemy:
+            writable_attributes = []
+            read_only_attributes = ["id"]
+
+
+def test_overwritten_attribute_getters_disable_cache(monkeypatch):
+    model.clear_attributes_cache()
+    monkeypatch.setattr(
+        Post, "__get_read_only_attributes__", classmethod(lambda cls, r, c, u: {"id"})
+    )
+    assert "id" not in Post._get_writable_attributes(NoCacheRequest())
+    assert not model._attributes_cache
+
+
+def test_model_registries_are_not_leaked():
+    config = make_config("sqlite://")
+    registry = config.registry.restalchemy_models
+    assert registry in model._model_registries
+    registry.models = {}
+    model.refresh_model_registries()
+    assert registry.models is None
+
+    ref = weakref.ref(registry)
+    del config, registry
+    gc.collect()
+    assert ref() is None
+
+
+def test_get_model_function_is_cached_per_request():
+    calls = []
+
+    def get_model(request, name):
+        calls.append(name)
+        return Post if request.params.get("tenant") == "a" else None
+
+    registry = model.ModelRegistry(get_model)
+    a, b = DummyRequest(params={"tenant": "a"}), DummyRequest(params={"tenant": "b"})
+    assert registry.get(a, "posts") is Post
+    assert registry.get(a, "posts") is Post
+    assert registry.get(b, "posts") is None
+    assert calls == ["posts", "posts"]
+
+    registry.cache_model_fn = True
+    assert registry.get(a, "posts") is Post
+    assert registry.get(b, "posts") is Post
+    assert calls == ["posts", "posts", "posts"]
@@ -0,0 +1,30 @@
+import pytest
+
+from .conftest import make_app
+
+
+@pytest.fixture
+def cursor_app(tmp_path):
+    app = make_app(tmp_path, {"restalchemy.pagination": "cursor"})
+    yield app
+    app.registry.restalchemy_engine.dispose()
+
+
+def walk(app, url):
+    """Return the ids of all pages, following the `next` links."""
+    ids = []
+    while url:
+        response = app.get(url)
+        ids.extend(post["id"] for post in response.json["posts"])
+        url = response.json["next"]
+    return ids
+
+
+@pytest.mark.parametrize("sort", ["published_at", "-published_at", "published_at,-id"])
+def test_cursor_pagination_with_null_sort_keys(cursor_app, sort):
+    posts = cursor_app.get("/v1/posts?limit=100&sort=" + sort).json["posts"]
+    # Drafts aren't published
+    assert any(post["published_at"] is None for post in posts)
+    assert walk(cursor_app, "/v1/posts?limit=4&count=false&sort=" + sort) == [
+        post["id"] for post in posts
+    ]
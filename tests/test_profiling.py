@@ -0,0 +1,56 @@
+import json
+import logging
+
+import pytest
+
+from .conftest import make_app
+
+
+@pytest.fixture
+def profiling_app(tmp_path):
+    app = make_app(tmp_path, {"restalchemy.profiling": "true"})
+    yield app
+    app.registry.restalchemy_engine.dispose()
+
+
+@pytest.fixture
+def profile_logs(caplog):
+    caplog.set_level(logging.INFO, logger="restalchemy.profiling")
+    return lambda: [
+        json.loads(r.message) for r in caplog.records if r.name == "restalchemy.profiling"
+    ]
+
+
+def test_profile(profiling_app, profile_logs):
+    response = profiling_app.get("/v1/posts?limit=5")
+    assert "serialize;dur=" in response.headers["Server-Timing"]
+    assert "streamed" not in response.headers["Server-Timing"]
+
+    (log,) = profile_logs()
+    assert not log["streamed"]
+    assert log["counts"]["rows"] == 6
+    assert set(log["phases"]) >= {"filters", "sql", "serialize", "json", "total"}
+
+
+@pytest.mark.parametrize("url", ["/v1/posts.ndjson", "/v1/posts?limit=5&count=false"])
+def test_streamed_responses_are_recorded_when_they_are_sent(profiling_app, profile_logs, url):
+    profiling_app.app.registry.restalchemy.streaming = True
+    response = profiling_app.get(url)
+    assert "streamed;desc=" in response.headers["Server-Timing"]
+    assert "serialize;dur=" not in response.headers["Server-Timing"]
+
+    (log,) = profile_logs()
+    assert log["streamed"]
+    assert log["counts"]["objects"] == log["counts"]["rows"] > 0
+    assert {"serialize", "json"} <= set(log["phases"])
+    assert log["phases"]["total"] >= log["phases"]["serialize"]
+
+    (summary,) = profiling_app.get("/v1/_profiling").json["json"]["profiles"]
+    assert summary["values"]["serialize"]["p50"] > 0
+
+
+def test_streamed_responses_return_their_connections(profiling_app, connections):
+    profiling_app.app.registry.restalchemy.streaming = True
+    profiling_app.get("/v1/posts?limit=5&count=false")
+    profiling_app.get("/v1/posts.ndjson")
+    assert connections() == 0
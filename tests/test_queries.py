@@ -0,0 +1,37 @@
+"""The number of SQL statements must not grow with the number of rows (N+1 queries)."""
+
+import pytest
+
+
+def count_statements(app, statements, url: str) -> int:
+    statements.reset()
+    app.get(url)
+    return statements.count
+
+
+def test_list_statements(app, statements):
+    # Rows and the count
+    assert count_statements(app, statements, "/v1/posts?limit=2") == 2
+    assert count_statements(app, statements, "/v1/posts?limit=30") == 2
+    assert count_statements(app, statements, "/v1/posts?limit=30&count=false") == 1
+
+
+@pytest.mark.parametrize(
+    "url, expected",
+    [
+        # Many-to-one is joined
+        ("/v1/posts?include=user", 2),
+        # One-to-many and many-to-many are loaded with one `SELECT ... IN` each
+        ("/v1/posts?include=user,tags", 3),
+        ("/v1/users?include=posts", 3),
+        ("/v1/tags?include=posts", 3),
+    ],
+)
+def test_expand_statements(app, statements, url, expected):
+    assert count_statements(app, statements, url + "&limit=2") == expected
+    assert count_statements(app, statements, url + "&limit=30") == expected
+
+
+def test_single_resource_expand_statements(app, statements):
+    assert count_statements(app, statements, "/v1/posts/1?include=user,tags") == 2
+    assert count_statements(app, statements, "/v1/users/1?include=posts") == 2
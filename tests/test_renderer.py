@@ -0,0 +1,58 @@
+from pyramid.testing import DummyRequest
+from sqlalchemy import Column, Integer, String
+from sqlalchemy.ext.declarative import declarative_base
+
+from restalchemy.model import RestalchemyBase
+from restalchemy.renderer import serialize_model
+
+Base = declarative_base(cls=RestalchemyBase)
+
+
+class Widget(Base):
+    __tablename__ = "widgets"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String(50))
+    secret = Column(String(50))
+
+    __json_private__ = ["secret"]
+
+    def label(self):
+        return "not serialized"
+
+    def price(self):
+        return 42
+
+    def __json_return_price__(self, request):
+        return self.price() * 2
+
+
+def test_serialize_model_returns_class_attributes():
+    assert serialize_model(DummyRequest(), Widget(id=1, name="foo", secret="s")) == {
+        "id": 1,
+        "name": "foo",
+        "price": 84,
+    }
+
+
+def test_serialize_model_returns_instance_attributes():
+    request = DummyRequest()
+    first = Widget(id=1, name="foo")
+    # e.g. set in `__after_get__`
+    first.score = 3
+    first._hidden = True
+    second = Widget(id=2, name="bar")
+
+    assert serialize_model(request, first)["score"] == 3
+    assert "_hidden" not in serialize_model(request, first)
+    # The plan is shared between rows, instance attributes are not
+    assert "score" not in serialize_model(request, second)
+
+
+def test_serialize_model_hides_private_instance_attributes():
+    widget = Widget(id=1, name="foo")
+    widget.secret = "s"
+    widget.token = "t"
+    assert "secret" not in serialize_model(DummyRequest(), widget)
+    assert "token" in serialize_model(DummyRequest(), widget)
+    assert "token" not in serialize_model(DummyRequest(), widget, private=["token"])
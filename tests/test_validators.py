@@ -0,0 +1,75 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import Column, String, Unicode
+
+from restalchemy import validators
+from restalchemy.exceptions import AttributeWrong
+from restalchemy.validators import (
+    get_validator,
+    register_validator,
+    validate_datetime,
+    validated_attributes,
+)
+
+from .models import Post
+
+
+def test_columns_are_validated_on_set(app):
+    assert (Post, "title") in validated_attributes
+    assert (Post, "status") in validated_attributes
+    post = Post()
+    with pytest.raises(AttributeWrong):
+        post.title = 1
+    with pytest.raises(AttributeWrong):
+        post.status = "unknown"
+    post.status = "published"
+    post.title = None
+
+
+def test_validators_are_found_for_subclassed_types():
+    assert get_validator(Column(Unicode(10))) is validators.validate_string
+    assert get_validator(Post.__table__.c.user_id) is validators.validate_int
+    assert get_validator(Post.__table__.c.published_at) is validators.validate_datetime
+
+
+def test_register_validator_clears_lookup_cache(monkeypatch):
+    monkeypatch.setattr(validators, "validators", dict(validators.validators))
+
+    def validate_unicode(column, value):
+        return value
+
+    assert get_validator(Column(Unicode(10))) is validators.validate_string
+    register_validator(Unicode, validate_unicode)
+    try:
+        assert get_validator(Column(Unicode(10))) is validate_unicode
+        assert get_validator(Column(String(10))) is validators.validate_string
+    finally:
+        validators._get_type_validator.cache_clear()
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ("2020-01-02", datetime(2020, 1, 2)),
+        ("2020-1-2", datetime(2020, 1, 2)),
+        ("2020-01-02 03:04:05", datetime(2020, 1, 2, 3, 4, 5)),
+        ("2020-01-02T03:04:05", datetime(2020, 1, 2, 3, 4, 5)),
+        ("2020-01-02T03:04:05Z", datetime(2020, 1, 2, 3, 4, 5)),
+        ("2020-01-02T03:04:05+0000", datetime(2020, 1, 2, 3, 4, 5)),
+        ("2020-01-02T03:04:05+00:00", datetime(2020, 1, 2, 3, 4, 5)),
+        ("2020-01-02T03:04:05.123", datetime(2020, 1, 2, 3, 4, 5, 123000)),
+        ("2020-01-02T03:04:05.123456789", datetime(2020, 1, 2, 3, 4, 5, 123456)),
+    ],
+)
+def test_validate_datetime(value, expected):
+    assert validate_datetime(Post.__table__.c.published_at, value) == expected
+
+
+@pytest.mark.parametrize(
+    "value",
+    ["2020-13-01", "2020-01-02T25:00:00", "2020-01-02T03:04:05+0100", "yesterday", "2020-01", 1],
+)
+def test_validate_datetime_invalid(value):
+    with pytest.raises(AttributeWrong):
+        validate_datetime(Post.__table__.c.published_at, value)